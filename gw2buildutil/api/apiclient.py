@@ -1,38 +1,729 @@
+import asyncio
+import codecs
+import contextlib
+import dbm
+import email.utils
+import functools
+import http.client
+import io
 import json
+import logging
+import math
+import random
+import threading
+import time
+import urllib.error
 import urllib.parse
-import urllib.request
+import zlib
 
+logger = logging.getLogger(__name__)
 SCHEMA_VERSION = '2023-09-02T00:00:00Z'
 MAX_QUERYSTRING_SIZE = 1024
+MAX_PAGE_SIZE = 200
+_HEADERS = {
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip, deflate',
+    'X-Schema-Version': SCHEMA_VERSION,
+}
+DEFAULT_POOL_SIZE = 8
+# seconds to wait for a connection, or for data from the server
+TIMEOUT = 60
+# maximum number of response headers, as for http.client
+_MAX_HEADERS = 100
+# maximum number of bytes to read from a response at once
+_READ_SIZE = 16 * 1024
 
 
+def _decompressor (content_encoding):
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    if content_encoding == 'identity':
+        return None
+    elif content_encoding in ('gzip', 'x-gzip', 'deflate'):
+        # detects gzip or zlib header
+        return zlib.decompressobj(32 + zlib.MAX_WBITS)
+    else:
+        raise urllib.error.URLError(
+            f'unsupported Content-Encoding: {content_encoding}')
+
+
+def _decompress (content_encoding, body):
+    decompressor = _decompressor(content_encoding)
+    if decompressor is None:
+        return body
+    return decompressor.decompress(body) + decompressor.flush()
+
+
+# decodes a JSON array from a response body as it's received, so that its
+# items can be used before the whole body has been read
+class JsonArrayDecoder:
+    def __init__ (self, content_encoding=None):
+        self._decompressor = _decompressor(content_encoding)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._text = ''
+        self._pos = 0
+        # one of 'start', 'first item', 'item', 'separator', 'end'
+        self._expecting = 'start'
+
+    def _skip_space (self):
+        while (self._pos < len(self._text) and
+               self._text[self._pos] in ' \t\r\n'):
+            self._pos += 1
+
+    def _error (self, msg):
+        return json.JSONDecodeError(msg, self._text, self._pos)
+
+    # final: whether there is no more data
+    def _decode (self, final):
+        items = []
+        while True:
+            self._skip_space()
+            if self._pos == len(self._text):
+                break
+            char = self._text[self._pos]
+
+            if self._expecting == 'start':
+                if char != '[':
+                    raise self._error('expected an array')
+                self._pos += 1
+                self._expecting = 'first item'
+
+            elif self._expecting == 'first item' and char == ']':
+                self._pos += 1
+                self._expecting = 'end'
+
+            elif self._expecting in ('first item', 'item'):
+                try:
+                    item, end = self._json_decoder.raw_decode(
+                        self._text, self._pos)
+                except json.JSONDecodeError:
+                    # may be incomplete
+                    if final:
+                        raise
+                    break
+                # a number may continue in data not yet received
+                if not final and (end == len(self._text) or
+                                  self._text[end] in '0123456789+-.eE'):
+                    break
+                items.append(item)
+                self._pos = end
+                self._expecting = 'separator'
+
+            elif self._expecting == 'separator':
+                if char == ',':
+                    self._expecting = 'item'
+                elif char == ']':
+                    self._expecting = 'end'
+                else:
+                    raise self._error('expected \',\' or \']\'')
+                self._pos += 1
+
+            else:
+                raise self._error('extra data')
+
+        # drop decoded text
+        self._text = self._text[self._pos:]
+        self._pos = 0
+        return items
+
+    # returns a list of items completed by data
+    def feed (self, data):
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(data)
+        self._text += self._text_decoder.decode(data)
+        return self._decode(False)
+
+    # call when there is no more data; returns a list of remaining items
+    def close (self):
+        data = b''
+        if self._decompressor is not None:
+            data = self._decompressor.flush()
+        self._text += self._text_decoder.decode(data, True)
+        items = self._decode(True)
+        if self._expecting != 'end':
+            raise self._error('incomplete array')
+        return items
+
+
+# persistent HTTP connections, reused between requests to the same host; safe
+# to use from multiple threads
+# size: maximum number of idle connections to keep for each host
+class ConnectionPool:
+    def __init__ (self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        # {(scheme, netloc): [connection]}
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.reused = 0
+
+    def _acquire (self, host_key):
+        with self._lock:
+            self.requests += 1
+            idle = self._idle.get(host_key)
+            if idle:
+                self.reused += 1
+                return (idle.pop(), True)
+            self.connections += 1
+
+        scheme, netloc = host_key
+        if scheme == 'https':
+            return (http.client.HTTPSConnection(netloc, timeout=TIMEOUT),
+                    False)
+        else:
+            return (http.client.HTTPConnection(netloc, timeout=TIMEOUT), False)
+
+    def _release (self, host_key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(host_key, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    # context manager giving an http.client.HTTPResponse whose body hasn't been
+    # read; the connection is reused if the body is read completely
+    # raises urllib.error.HTTPError for unsuccessful responses, and
+    # urllib.error.URLError for connection errors, like urllib.request.urlopen;
+    # 304 Not Modified is only sent for conditional requests, so isn't an error
+    @contextlib.contextmanager
+    def open (self, url, headers):
+        parsed = urllib.parse.urlsplit(url)
+        host_key = (parsed.scheme, parsed.netloc)
+        target = parsed.path or '/'
+        if parsed.query:
+            target += '?' + parsed.query
+
+        while True:
+            conn, reused = self._acquire(host_key)
+            try:
+                conn.request('GET', target, headers=headers)
+                res = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                # the server may close idle connections at any time, so try
+                # again with another connection
+                if not reused:
+                    raise urllib.error.URLError(e)
+            else:
+                break
+
+        broken = False
+        try:
+            if not (200 <= res.status < 300 or res.status == 304):
+                body = _decompress(res.headers.get('Content-Encoding'),
+                                   _read_all(res))
+                raise urllib.error.HTTPError(url, res.status, res.reason,
+                                             res.headers, io.BytesIO(body))
+            yield res
+        except _ReadError:
+            broken = True
+            raise
+        finally:
+            if not broken and res.isclosed() and not res.will_close:
+                self._release(host_key, conn)
+            else:
+                conn.close()
+
+    def close (self):
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle = {}
+        for conn in idle:
+            conn.close()
+
+    def stats (self):
+        with self._lock:
+            return {
+                'idle': sum(len(conns) for conns in self._idle.values()),
+                'max idle per host': self.size,
+                'connections': self.connections,
+                'requests': self.requests,
+                'reused': self.reused,
+            }
+
+
+# raised when the connection fails while reading a response body, after which
+# the request can only be retried by making it again from the start
+class _ReadError (urllib.error.URLError):
+    def __init__ (self, reason):
+        urllib.error.URLError.__init__(self, reason)
+        # set when the request was allowed by a Throttle: the number of times
+        # the request was retried before this, and the number of seconds to
+        # wait before retrying, or None if it shouldn't be retried
+        self.attempt = 0
+        self.retry_delay = None
+
+
+# yields chunks of a response body
+def _read_chunks (res):
+    while True:
+        try:
+            chunk = res.read(_READ_SIZE)
+        except (OSError, http.client.HTTPException) as e:
+            raise _ReadError(e)
+        if not chunk:
+            # length is the number of bytes left, if the response gave it
+            if res.length:
+                raise _ReadError(http.client.IncompleteRead(b'', res.length))
+            break
+        yield chunk
+
+
+def _read_all (res):
+    return b''.join(_read_chunks(res))
+
+
+# for comparing URLs: the order of IDs in a batch doesn't matter
+def _normalise_url (url):
+    parsed = urllib.parse.urlsplit(url)
+    query = []
+    for name, value in urllib.parse.parse_qsl(parsed.query,
+                                              keep_blank_values=True):
+        if name == 'ids':
+            value = ','.join(sorted(value.split(',')))
+        query.append((name, value))
+    return urllib.parse.urlunsplit((
+        parsed.scheme.lower(), parsed.netloc.lower(), parsed.path,
+        urllib.parse.urlencode(sorted(query)), ''))
+
+
+# results of requests, stored on disk with their ETag and Last-Modified
+# validators, so that making the same request again only needs to transfer the
+# results if they've changed; safe to use from multiple threads
+# results are compressed, but are a copy of those stored by crawling, so this
+# roughly doubles the disk space used
+# path: database file
+class ValidatorCache:
+    # response headers which are stored with results
+    STORED_HEADERS = ('X-Page-Total', 'X-Page-Size', 'X-Result-Total')
+
+    def __init__ (self, path):
+        self.path = path
+        self._db = dbm.open(path, 'c')
+        self._lock = threading.Lock()
+        # keys of requests made since the database was opened, cleared or
+        # pruned
+        self._used = set()
+        # number of requests made without validators
+        self.misses = 0
+        # number of requests made with validators
+        self.revalidations = 0
+        # number of revalidations where cached results were used
+        self.hits = 0
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close()
+
+    def close (self):
+        self._db.close()
+
+    @staticmethod
+    def _key (url):
+        # responses depend on the schema version
+        return f'{SCHEMA_VERSION} {_normalise_url(url)}'
+
+    # returns (entry, headers), where entry is passed to the other methods, and
+    # headers are to be sent with the request
+    def request_headers (self, url):
+        key = self._key(url)
+        with self._lock:
+            self._used.add(key.encode())
+            value = self._db.get(key)
+            if value is None:
+                self.misses += 1
+                return (None, {})
+            self.revalidations += 1
+
+        entry = json.loads(zlib.decompress(value))
+        headers = {}
+        if entry['etag'] is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last modified'] is not None:
+            headers['If-Modified-Since'] = entry['last modified']
+        return (entry, headers)
+
+    # returns (results, headers) from the cache for a 304 Not Modified
+    # response, where headers are the stored response headers
+    def not_modified (self, entry):
+        with self._lock:
+            self.hits += 1
+        return (entry['results'], entry.get('headers', {}))
+
+    # store results of a successful response, if it has validators
+    def store (self, url, response_headers, results):
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return
+        value = zlib.compress(json.dumps({
+            'etag': etag,
+            'last modified': last_modified,
+            'headers': {name: response_headers[name]
+                        for name in self.STORED_HEADERS
+                        if name in response_headers},
+            'results': results,
+        }).encode())
+        key = self._key(url)
+        with self._lock:
+            self._used.add(key.encode())
+            self._db[key] = value
+
+    # replaces the database with a new, empty one, which takes constant time
+    def clear (self):
+        with self._lock:
+            self._db.close()
+            self._db = dbm.open(self.path, 'n')
+            self._used.clear()
+
+    # remove entries for requests which haven't been made since the database
+    # was opened or last pruned, such as pages or batches which no longer
+    # exist; call after making every request which is still needed
+    # returns the number of entries removed
+    def prune (self):
+        with self._lock:
+            unused = [key for key in self._db.keys() if key not in self._used]
+            for key in unused:
+                del self._db[key]
+            self._used.clear()
+        return len(unused)
+
+    def stats (self):
+        with self._lock:
+            return {
+                'size': len(self._db),
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'hits': self.hits,
+            }
+
+
+# seconds from a Retry-After header, or None
+def _retry_after (headers):
+    value = headers.get('Retry-After') if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, retry_time.timestamp() - time.time())
+
+
+# controls the rate of requests: retries requests which fail because of rate
+# limiting, server or connection errors, and adapts the number of concurrent
+# requests and the batch size to errors; safe to use from multiple threads
+# max_concurrency: maximum number of requests allowed at once; this is halved
+#   when rate limited, and increases again with successful requests; this
+#   applies on top of the concurrency of a crawl (crawl.Crawler.concurrency),
+#   so the smaller of the two limits the number of requests made at once
+# max_retries: number of times to retry a request before raising the error
+# max_delay: maximum seconds to wait before retrying, unless the server asks
+#   for longer
+class Throttle:
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # seconds to wait for the first retry, doubled for each retry after that
+    BASE_DELAY = 1
+    # minimum fraction of the configured batch size
+    MIN_BATCH_SCALE = 1 / 8
+    # number of consecutive successful requests after which the batch size
+    # grows again
+    BATCH_RECOVERY_REQUESTS = 20
+    # seconds between checks for whether a request may be made, for
+    # try_acquire
+    _POLL_INTERVAL = 0.05
+
+    def __init__ (self, max_concurrency=8, max_retries=5, max_delay=60):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        # notified when a request finishes
+        self._finished = threading.Condition(self._lock)
+        self._concurrency = max_concurrency
+        self._in_flight = 0
+        self._paused_until = 0
+        self._successes_since_increase = 0
+        self._batch_scale = 1
+        self._successes_since_batch_error = 0
+        self._first_request_time = None
+        self._last_response_time = None
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.connection_errors = 0
+
+    # the same as try_acquire, but returns math.inf if waiting for a request
+    # to finish; the lock must be held
+    def _try_acquire (self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= self._concurrency:
+            return math.inf
+        self._in_flight += 1
+        self.requests += 1
+        if self._first_request_time is None:
+            self._first_request_time = now
+        return None
+
+    # returns None if a request may be made now, else the number of seconds to
+    # wait before trying again; if None, release, failed or cancel must be
+    # called after the request
+    def try_acquire (self):
+        with self._lock:
+            delay = self._try_acquire()
+        return self._POLL_INTERVAL if delay == math.inf else delay
+
+    # wait until a request may be made
+    def acquire (self):
+        with self._finished:
+            while True:
+                delay = self._try_acquire()
+                if delay is None:
+                    return
+                self._finished.wait(None if delay == math.inf else delay)
+
+    # call after a successful response to a request allowed by try_acquire or
+    # acquire
+    def release (self):
+        with self._lock:
+            self._in_flight -= 1
+            self._finished.notify_all()
+            self._last_response_time = time.monotonic()
+            # increase concurrency by one for each round of successful requests
+            self._successes_since_increase += 1
+            if self._successes_since_increase >= self._concurrency:
+                self._concurrency = min(self.max_concurrency,
+                                        self._concurrency + 1)
+                self._successes_since_increase = 0
+            self._successes_since_batch_error += 1
+            if (self._successes_since_batch_error >=
+                self.BATCH_RECOVERY_REQUESTS
+            ):
+                self._batch_scale = min(1, self._batch_scale * 2)
+                self._successes_since_batch_error = 0
+
+    # call instead of release when a request fails
+    # error: urllib.error.URLError the request failed with
+    # attempt: number of times the request has been retried
+    # returns the number of seconds to wait before retrying, or None if the
+    # request shouldn't be retried
+    def failed (self, error, attempt):
+        with self._lock:
+            self._in_flight -= 1
+            self._finished.notify_all()
+            self._last_response_time = time.monotonic()
+            if isinstance(error, urllib.error.HTTPError):
+                if error.code not in self.RETRY_STATUSES:
+                    return None
+                if error.code == 429:
+                    self.rate_limited += 1
+                    self._concurrency = max(1, self._concurrency // 2)
+                    self._successes_since_increase = 0
+                else:
+                    self.server_errors += 1
+                    # large batches are more likely to time out
+                    self._batch_scale = max(self.MIN_BATCH_SCALE,
+                                            self._batch_scale / 2)
+                    self._successes_since_batch_error = 0
+                retry_after = _retry_after(error.headers)
+            else:
+                self.connection_errors += 1
+                retry_after = None
+
+            if attempt >= self.max_retries:
+                return None
+            self.retries += 1
+            if retry_after is None:
+                # full jitter, so that concurrent requests don't retry together
+                delay = random.uniform(
+                    0, min(self.max_delay, self.BASE_DELAY * 2 ** attempt))
+            else:
+                delay = retry_after
+                # the server applies this to every request
+                self._paused_until = max(self._paused_until,
+                                         time.monotonic() + delay)
+        logger.info(f'retrying in {delay:.1f}s: {error}')
+        return delay
+
+    # call instead of release when a request is abandoned, or fails in a way
+    # which says nothing about the rate of requests
+    def cancel (self):
+        with self._lock:
+            self._in_flight -= 1
+            self._finished.notify_all()
+
+    # the batch size to use, given the configured maximum
+    def batch_size (self, max_batch_size):
+        with self._lock:
+            return max(1, int(max_batch_size * self._batch_scale))
+
+    def stats (self):
+        with self._lock:
+            if (self._first_request_time is None or
+                self._last_response_time is None or
+                self._last_response_time <= self._first_request_time
+            ):
+                requests_per_second = None
+            else:
+                requests_per_second = self.requests / (
+                    self._last_response_time - self._first_request_time)
+            return {
+                'requests': self.requests,
+                'requests per second': requests_per_second,
+                'retries': self.retries,
+                'rate limited': self.rate_limited,
+                'server errors': self.server_errors,
+                'connection errors': self.connection_errors,
+                'concurrency': self._concurrency,
+                'max concurrency': self.max_concurrency,
+                'batch size scale': self._batch_scale,
+            }
+
+
+def _page_total (url, headers):
+    try:
+        return int(headers['X-Page-Total'])
+    except (KeyError, TypeError, ValueError):
+        raise urllib.error.URLError(f'missing page total: {url}')
+
+
+# pool: ConnectionPool to make requests with; a new one is created by default
+# cache: ValidatorCache to make conditional requests with, if any
+# throttle: Throttle to control requests with; a new one is created by default
+# page_size: number of results to request in each page by get_page
 class ApiClient:
-    def __init__ (self, base_url, batch_size):
+    def __init__ (self, base_url, batch_size, pool=None, cache=None,
+                  throttle=None, page_size=MAX_PAGE_SIZE):
         self.base_url = base_url
         self.batch_size = batch_size
+        self.page_size = page_size
         self.schema_version = SCHEMA_VERSION
+        self.pool = ConnectionPool() if pool is None else pool
+        self.cache = cache
+        self.throttle = Throttle() if throttle is None else throttle
 
     def _url (self, path):
         path = '/'.join(urllib.parse.quote(part, safe='') for part in path)
         return f'{self.base_url}/{path}'
 
-    def _get_json (self, url):
-        req = urllib.request.Request(url, headers={
-            'Accept': 'application/json',
-            'X-Schema-Version': SCHEMA_VERSION,
-        })
-        with urllib.request.urlopen(req) as res:
-            body = res.read()
-        return json.loads(body)
+    # the same as ConnectionPool.open, but retries requests as allowed by the
+    # throttle
+    # attempt: number of times the request has already been retried
+    # raises _ReadError with its retry delay set if reading the body fails
+    @contextlib.contextmanager
+    def _open (self, url, headers, attempt=0):
+        while True:
+            self.throttle.acquire()
+            stack = contextlib.ExitStack()
+            try:
+                res = stack.enter_context(self.pool.open(url, headers))
+            except urllib.error.URLError as e:
+                delay = self.throttle.failed(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.throttle.cancel()
+                raise
+            else:
+                break
+
+        # results can't be retried once they've been used
+        try:
+            with stack:
+                yield res
+        except _ReadError as e:
+            e.attempt = attempt
+            e.retry_delay = self.throttle.failed(e, attempt)
+            raise
+        except BaseException:
+            # such as an invalid body, or results no longer being wanted
+            self.throttle.cancel()
+            raise
+        else:
+            self.throttle.release()
+
+    # yields items of the JSON array in a response as they're received
+    # response_headers: if given, a list which the response headers are
+    #   appended to
+    # attempt: as for _open
+    def _stream_json (self, url, response_headers=None, attempt=0):
+        cache_entry = None
+        headers = _HEADERS
+        if self.cache is not None:
+            cache_entry, cache_headers = self.cache.request_headers(url)
+            headers = {**_HEADERS, **cache_headers}
+
+        with self._open(url, headers, attempt) as res:
+            if res.status == 304:
+                _read_all(res)
+                if cache_entry is None:
+                    raise urllib.error.HTTPError(url, res.status, res.reason,
+                                                 res.headers, io.BytesIO())
+                results, cached_headers = self.cache.not_modified(cache_entry)
+                if response_headers is not None:
+                    response_headers.append(cached_headers)
+                yield from results
+                return
+
+            if response_headers is not None:
+                response_headers.append(res.headers)
+            results = []
+            decoder = JsonArrayDecoder(res.headers.get('Content-Encoding'))
+            for chunk in _read_chunks(res):
+                for result in decoder.feed(chunk):
+                    if self.cache is not None:
+                        results.append(result)
+                    yield result
+            for result in decoder.close():
+                if self.cache is not None:
+                    results.append(result)
+                yield result
+
+        if self.cache is not None:
+            self.cache.store(url, res.headers, results)
+
+    # returns a list of the items yielded by _stream_json; since nothing is
+    # used until they've all been received, the request is made again if the
+    # connection fails while receiving them
+    def _get_json (self, url, response_headers=None):
+        attempt = 0
+        while True:
+            attempt_headers = []
+            try:
+                results = list(self._stream_json(url, attempt_headers, attempt))
+            except _ReadError as e:
+                if e.retry_delay is None:
+                    raise
+                time.sleep(e.retry_delay)
+                attempt = e.attempt + 1
+            else:
+                if response_headers is not None:
+                    response_headers.extend(attempt_headers)
+                return results
 
     def list_ (self, path):
         return self._get_json(self._url(path))
 
+    def _batch_url (self, path, querystring_parts):
+        return f'{self._url(path)}?{"".join(querystring_parts)}'
+
     def _get_batch (self, path, querystring_parts):
-        url = f'{self._url(path)}?{"".join(querystring_parts)}'
-        return self._get_json(url)
+        return self._get_json(self._batch_url(path, querystring_parts))
 
-    def get (self, path, ids):
+    def _batch_querystrings (self, ids):
         sep = urllib.parse.quote_plus(',')
         sep_size = len(sep)
 
@@ -42,10 +733,10 @@ class ApiClient:
         for id_ in ids:
             id_quoted = urllib.parse.quote_plus(str(id_))
             if batch_size > 0 and (
-                batch_size + 1 > self.batch_size or
+                batch_size + 1 > self.throttle.batch_size(self.batch_size) or
                 querystring_size + len(id_quoted) > MAX_QUERYSTRING_SIZE
             ):
-                yield from self._get_batch(path, querystring_parts)
+                yield querystring_parts
                 querystring_parts = ['ids=']
                 batch_size = 0
                 querystring_size = 4
@@ -55,4 +746,279 @@ class ApiClient:
             querystring_size += sep_size + len(id_quoted)
 
         if batch_size > 0:
-            yield from self._get_batch(path, querystring_parts)
+            yield querystring_parts
+
+    # yields functions which take no arguments and return a list of results;
+    # these may be called concurrently
+    def batches (self, path, ids):
+        for querystring_parts in self._batch_querystrings(ids):
+            yield functools.partial(self._get_batch, path, querystring_parts)
+
+    # results are yielded as they're received; if the connection fails while
+    # receiving them, the request is made again, skipping results which were
+    # already yielded
+    def get (self, path, ids):
+        for querystring_parts in self._batch_querystrings(ids):
+            url = self._batch_url(path, querystring_parts)
+            yielded = set()
+            attempt = 0
+            while True:
+                try:
+                    for result in self._stream_json(url, attempt=attempt):
+                        if result['id'] not in yielded:
+                            yielded.add(result['id'])
+                            yield result
+                except _ReadError as e:
+                    if e.retry_delay is None:
+                        raise
+                    time.sleep(e.retry_delay)
+                    attempt = e.attempt + 1
+                else:
+                    break
+
+    def _page_url (self, path, page):
+        return f'{self._url(path)}?page={page}&page_size={self.page_size}'
+
+    # get results from a page of everything at path, starting from 0; this
+    # needs fewer requests than getting results by ID, since pages can be
+    # larger than batches
+    # returns (results, page_total)
+    def get_page (self, path, page):
+        response_headers = []
+        results = self._get_json(self._page_url(path, page), response_headers)
+        return (results, _page_total(self._page_url(path, page),
+                                     response_headers[0]))
+
+
+# call a coroutine function that reads from or writes to a connection, with a
+# timeout; raises errors like ConnectionPool.open
+async def _io_async (function, *args, **kwargs):
+    try:
+        return await asyncio.wait_for(function(*args, **kwargs), TIMEOUT)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        raise urllib.error.URLError(e)
+
+
+async def _close_async (writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        # the connection is closed either way
+        pass
+
+
+# returns the header lines of a response, including the terminating blank line
+async def _read_headers_async (reader):
+    lines = []
+    while True:
+        try:
+            line = await _io_async(reader.readline)
+        except ValueError:
+            raise urllib.error.URLError(http.client.LineTooLong('header line'))
+        lines.append(line)
+        if line in (b'\r\n', b'\n', b''):
+            return lines
+        if len(lines) > _MAX_HEADERS:
+            raise urllib.error.URLError(http.client.HTTPException(
+                f'got more than {_MAX_HEADERS} headers'))
+
+
+# the standard library has no asynchronous HTTP client, so this makes simple
+# HTTP/1.0 requests (no chunked encoding, connection closed after the response)
+# returns (status, headers, reader, writer) with the body unread, where writer
+# must be closed with _close_async; raises errors like ConnectionPool.open
+async def _open_async (url, headers):
+    parsed = urllib.parse.urlsplit(url)
+    secure = parsed.scheme == 'https'
+    port = parsed.port or (443 if secure else 80)
+    target = parsed.path or '/'
+    if parsed.query:
+        target += '?' + parsed.query
+
+    reader, writer = await _io_async(
+        asyncio.open_connection, parsed.hostname, port, ssl=secure or None)
+    try:
+        request_lines = [f'GET {target} HTTP/1.0', f'Host: {parsed.netloc}']
+        request_lines += [f'{k}: {v}' for k, v in headers.items()]
+        writer.write(('\r\n'.join(request_lines) + '\r\n\r\n').encode('ascii'))
+        await _io_async(writer.drain)
+        try:
+            status_line = await _io_async(reader.readline)
+        except ValueError:
+            raise urllib.error.URLError(http.client.LineTooLong('status line'))
+        try:
+            version, status, reason = (
+                status_line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2))
+            status = int(status)
+        except ValueError:
+            raise urllib.error.URLError(
+                http.client.BadStatusLine(status_line))
+        res_headers = http.client.parse_headers(
+            io.BytesIO(b''.join(await _read_headers_async(reader))))
+        if not (200 <= status < 300 or status == 304):
+            body = _decompress(res_headers.get('Content-Encoding'),
+                               await _io_async(reader.read))
+            raise urllib.error.HTTPError(url, status, reason, res_headers,
+                                         io.BytesIO(body))
+    except BaseException:
+        await _close_async(writer)
+        raise
+    return (status, res_headers, reader, writer)
+
+
+# yields items of the JSON array in the response as they're received
+# cache: ValidatorCache, or None
+# throttle: Throttle
+# response_headers: if given, a list which the response headers are appended to
+# attempt: as for ApiClient._open
+async def _stream_json_async (url, cache, throttle, response_headers=None,
+                              attempt=0):
+    cache_entry = None
+    headers = _HEADERS
+    if cache is not None:
+        cache_entry, cache_headers = cache.request_headers(url)
+        headers = {**_HEADERS, **cache_headers}
+
+    while True:
+        delay = throttle.try_acquire()
+        if delay is not None:
+            await asyncio.sleep(delay)
+            continue
+        try:
+            status, res_headers, reader, writer = await _open_async(
+                url, headers)
+        except urllib.error.URLError as e:
+            delay = throttle.failed(e, attempt)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+        except BaseException:
+            # such as asyncio.CancelledError
+            throttle.cancel()
+            raise
+        else:
+            break
+
+    # results can't be retried once they've been used
+    finished = False
+    try:
+        if status == 304:
+            if cache_entry is None:
+                raise urllib.error.HTTPError(url, status, 'Not Modified',
+                                             res_headers, io.BytesIO())
+            results, cached_headers = cache.not_modified(cache_entry)
+            if response_headers is not None:
+                response_headers.append(cached_headers)
+            for item in results:
+                yield item
+            return
+
+        if response_headers is not None:
+            response_headers.append(res_headers)
+        results = []
+        decoder = JsonArrayDecoder(res_headers.get('Content-Encoding'))
+        try:
+            remaining_size = int(res_headers['Content-Length'])
+        except (KeyError, TypeError, ValueError):
+            remaining_size = None
+        while True:
+            try:
+                chunk = await _io_async(reader.read, _READ_SIZE)
+            except urllib.error.URLError as e:
+                raise _ReadError(e.reason)
+            if not chunk:
+                # the server closed the connection early
+                if remaining_size:
+                    raise _ReadError(
+                        http.client.IncompleteRead(b'', remaining_size))
+                break
+            if remaining_size is not None:
+                remaining_size -= len(chunk)
+            for item in decoder.feed(chunk):
+                if cache is not None:
+                    results.append(item)
+                yield item
+        for item in decoder.close():
+            if cache is not None:
+                results.append(item)
+            yield item
+    except _ReadError as e:
+        finished = True
+        e.attempt = attempt
+        e.retry_delay = throttle.failed(e, attempt)
+        raise
+    except BaseException:
+        finished = True
+        throttle.cancel()
+        raise
+    finally:
+        # the request is finished before closing, which may be interrupted
+        if not finished:
+            throttle.release()
+        await _close_async(writer)
+
+    if cache is not None:
+        cache.store(url, res_headers, results)
+
+
+# the same as ApiClient._get_json
+async def _get_json_async (url, cache, throttle, response_headers=None):
+    attempt = 0
+    while True:
+        attempt_headers = []
+        try:
+            results = [item async for item in _stream_json_async(
+                url, cache, throttle, attempt_headers, attempt)]
+        except _ReadError as e:
+            if e.retry_delay is None:
+                raise
+            await asyncio.sleep(e.retry_delay)
+            attempt = e.attempt + 1
+        else:
+            if response_headers is not None:
+                response_headers.extend(attempt_headers)
+            return results
+
+
+# the same as ApiClient, but list_ and get_page are coroutines, get is an
+# asynchronous generator, and batches yields coroutine functions
+# pool isn't used: each request is made over a new connection (see _open_async)
+class AsyncApiClient (ApiClient):
+    async def list_ (self, path):
+        return await _get_json_async(self._url(path), self.cache,
+                                     self.throttle)
+
+    async def _get_batch (self, path, querystring_parts):
+        return await _get_json_async(
+            self._batch_url(path, querystring_parts), self.cache,
+            self.throttle)
+
+    async def get (self, path, ids):
+        for querystring_parts in self._batch_querystrings(ids):
+            url = self._batch_url(path, querystring_parts)
+            yielded = set()
+            attempt = 0
+            while True:
+                try:
+                    async for result in _stream_json_async(
+                        url, self.cache, self.throttle, attempt=attempt
+                    ):
+                        if result['id'] not in yielded:
+                            yielded.add(result['id'])
+                            yield result
+                except _ReadError as e:
+                    if e.retry_delay is None:
+                        raise
+                    await asyncio.sleep(e.retry_delay)
+                    attempt = e.attempt + 1
+                else:
+                    break
+
+    async def get_page (self, path, page):
+        url = self._page_url(path, page)
+        response_headers = []
+        results = await _get_json_async(url, self.cache, self.throttle,
+                                        response_headers)
+        return (results, _page_total(url, response_headers[0]))
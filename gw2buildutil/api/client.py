@@ -8,10 +8,22 @@ BASE_URL = 'https://api.guildwars2.com/v2'
 BATCH_SIZE = 100
 
 
+# pool: apiclient.ConnectionPool for API requests; a new one is created by
+#   default
+# cache: apiclient.ValidatorCache to make conditional API requests with, if any
+# throttle: apiclient.Throttle to control API requests with; a new one is
+#   created by default
 class Client:
-    def __init__ (self, base_url=BASE_URL, batch_size=BATCH_SIZE):
+    _api_client_type = apiclient.ApiClient
+
+    def __init__ (self, base_url=BASE_URL, batch_size=BATCH_SIZE, pool=None,
+                  cache=None, throttle=None):
         self._fake_client = fakeclient.FakeClient()
-        self._api_client = apiclient.ApiClient(base_url, batch_size)
+        self._api_client = self._api_client_type(
+            base_url, batch_size, pool, cache, throttle)
+        self.pool = self._api_client.pool
+        self.cache = cache
+        self.throttle = self._api_client.throttle
         self.schema_version = repr((
             self._fake_client.schema_version,
             self._api_client.schema_version,
@@ -27,3 +39,61 @@ class Client:
 
     def get (self, path, ids):
         return self._choose_client(path).get(path, ids)
+
+    # yields functions which take no arguments and return a list of results;
+    # these may be called concurrently
+    def batches (self, path, ids):
+        return self._choose_client(path).batches(path, ids)
+
+    # returns (results, page_total) for a page of everything at path, starting
+    # from 0
+    def get_page (self, path, page):
+        return self._choose_client(path).get_page(path, page)
+
+
+# the same as Client, but list_ and get_page are coroutines, get is an
+# asynchronous generator, and batches yields coroutine functions
+# pool is only used by sync_client
+class AsyncClient (Client):
+    _api_client_type = apiclient.AsyncApiClient
+
+    def __init__ (self, base_url=BASE_URL, batch_size=BATCH_SIZE, pool=None,
+                  cache=None, throttle=None):
+        Client.__init__(self, base_url, batch_size, pool, cache, throttle)
+        # for results requested while building entities, which can't wait;
+        # this blocks the event loop, so requests made from the loop can't
+        # finish in the meantime, and it needs its own throttle
+        self.sync_client = Client(
+            base_url, batch_size, self.pool, cache,
+            apiclient.Throttle(1, self.throttle.max_retries,
+                               self.throttle.max_delay))
+
+    async def list_ (self, path):
+        if path in fakeclient.FakeClient.supported_paths:
+            return self._fake_client.list_(path)
+        else:
+            return await self._api_client.list_(path)
+
+    # results are yielded as they're received
+    async def get (self, path, ids):
+        if path in fakeclient.FakeClient.supported_paths:
+            for result in self._fake_client.get(path, ids):
+                yield result
+        else:
+            async for result in self._api_client.get(path, ids):
+                yield result
+
+    async def get_page (self, path, page):
+        if path in fakeclient.FakeClient.supported_paths:
+            return self._fake_client.get_page(path, page)
+        else:
+            return await self._api_client.get_page(path, page)
+
+    def batches (self, path, ids):
+        if path in fakeclient.FakeClient.supported_paths:
+            for batch in self._fake_client.batches(path, ids):
+                async def get_batch (batch=batch):
+                    return batch()
+                yield get_batch
+        else:
+            yield from self._api_client.batches(path, ids)
@@ -1,8 +1,32 @@
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import json
 import logging
+import os
+import tempfile
 
 from . import client as gw2client, entity as gw2entity, storage as gw2storage
 
 logger = logging.getLogger(__name__)
+# number of stored results to load at once
+_RAW_CHUNK_SIZE = 1000
+# number of API IDs to build entities for in each task given to a worker process
+_PROCESS_CHUNK_SIZE = 500
+# Storage.meta keys for the progress of an unfinished crawl_all: its options and
+# listed API IDs, and for each path, the number of listed API IDs fetched again
+_CHECKPOINT_KEY = 'crawl checkpoint'
+_REFETCH_PROGRESS_KEY = 'crawl refetch progress'
+# Storage.meta key for the entity types the index was last built for, which
+# crawl_incremental needs to be the same; unset while the index is out of date
+_INDEXED_KEY = 'crawl indexed'
+
+
+# Storage.meta key for the API IDs at path whose results were dropped because no
+# crawled entity type accepted them, and the entity types crawled
+def _ignored_key (path):
+    return f'crawl ignored /{"/".join(path)}'
 
 
 def _dependency_order (entity_types):
@@ -19,73 +43,967 @@ def _dependency_order (entity_types):
         remaining -= used
 
 
+# entity types which use entities of the given types when being built
+def _dependent_types (entity_types, all_entity_types):
+    dependents = set()
+    remaining = set(entity_types)
+    while remaining:
+        found = {t for t in all_entity_types
+                 if t.crawl_dependencies() & remaining} - dependents
+        dependents.update(found)
+        remaining = found
+    return dependents
+
+
+# entity types which may be built from a result
+def _accepting_types (entity_types, result):
+    return [t for t in entity_types if t.accepts_result(result)]
+
+
+# storage used by worker processes
+_worker_storage = None
+
+
+def _init_worker (snapshot_path):
+    global _worker_storage
+    _worker_storage = gw2storage.SnapshotStorage(snapshot_path)
+
+
+# build entities in a worker process
+# returns (entities, failed_api_ids), where failed_api_ids are those which
+# couldn't be built from the snapshot, eg. because they need results which
+# haven't been fetched yet
+def _build_entities (api_ids, entity_types):
+    entities = []
+    failed_api_ids = []
+    results = _worker_storage.raw_many(entity_types[0].path(), api_ids)
+    for api_id, result in zip(api_ids, results):
+        api_id_entities = []
+        try:
+            for entity_type in _accepting_types(entity_types, result):
+                try:
+                    api_id_entities.append(
+                        _worker_storage.from_result(entity_type, result))
+                except gw2entity.SkipEntityError:
+                    pass
+        except KeyError:
+            failed_api_ids.append(api_id)
+        else:
+            entities.extend(api_id_entities)
+    return (entities, failed_api_ids)
+
+
+# value stored under _INDEXED_KEY
+def _indexed_value (entity_types):
+    return ' '.join(sorted(t.type_id() for t in entity_types))
+
+
+def _same_result (result, other_result):
+    # stored results may have lists where the fetched result has tuples
+    return (json.dumps(result, sort_keys=True) ==
+            json.dumps(other_result, sort_keys=True))
+
+
 class Crawler:
-    def __init__ (self, client, storage, entity_types):
+    # concurrency: maximum number of batches of results to fetch at once; the
+    #   client's throttle (apiclient.Throttle) may allow fewer requests at once
+    # processes: number of worker processes to build entities in when crawling
+    #   everything; if more than 1, storage must be a FileStorage or
+    #   MemoryStorage
+    # paged: when crawling everything, get all results for paths with no stored
+    #   results in pages (client.get_page), rather than listing API IDs and
+    #   getting results by ID
+    def __init__ (self, client, storage, entity_types, concurrency=1,
+                  processes=1, paged=True):
         self.client = client
+        self._wrapped_storage = storage
         self.storage = gw2storage.CrawlingStorage(storage, self)
         self.entity_types = entity_types
+        self.concurrency = concurrency
+        self.processes = processes
+        self.paged = paged
+        # {path: retention}, see _retention
+        self._retentions = {}
+        # {path: set(api_ids)}, see _ignored
+        self._ignored_api_ids = {}
+        # paths whose ignored API IDs have changed since they were stored
+        self._unsaved_ignored = set()
+        if processes > 1 and not isinstance(
+            storage, (gw2storage.FileStorage, gw2storage.MemoryStorage)
+        ):
+            raise TypeError(f'can\'t use worker processes with '
+                            f'{type(storage).__name__}')
+
+    # call functions which take no arguments, and yield (index, result) for
+    # each as it completes, where index is the function's position
+    def _call_concurrent (self, functions):
+        if self.concurrency <= 1:
+            yield from enumerate(function() for function in functions)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(
+            self.concurrency
+        ) as executor:
+            # {future: index}; functions are only called once there's room,
+            # since batches may depend on earlier responses
+            in_flight = {}
+            for index, function in enumerate(functions):
+                in_flight[executor.submit(function)] = index
+                if len(in_flight) >= self.concurrency:
+                    done, _ = concurrent.futures.wait(
+                        in_flight,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield (in_flight.pop(future), future.result())
+            for future in concurrent.futures.as_completed(in_flight):
+                yield (in_flight[future], future.result())
+
+    # yields lists of results, one for each batch, as they're received
+    def _get_batches (self, path, api_ids):
+        for _, results in self._call_concurrent(
+            self.client.batches(path, api_ids)
+        ):
+            yield results
+
+    def _get (self, path, api_ids):
+        if self.concurrency <= 1:
+            # results are yielded as they're received
+            yield from self.client.get(path, api_ids)
+        else:
+            for results in self._get_batches(path, api_ids):
+                yield from results
+
+    # results for path are only stored if a crawled entity type accepts them,
+    # unless some type accepts every result
+    # returns None if every result is stored, else the value stored for ignored
+    # API IDs, which changes with the crawled entity types
+    def _retention (self, path):
+        if path not in self._retentions:
+            entity_types = [t for t in self.entity_types if t.path() == path]
+            if not entity_types or any(
+                t.accepts_result.__func__ is
+                gw2entity.Entity.accepts_result.__func__
+                for t in entity_types
+            ):
+                self._retentions[path] = None
+            else:
+                self._retentions[path] = (
+                    entity_types,
+                    ' '.join(sorted(t.type_id() for t in entity_types)))
+        return self._retentions[path]
+
+    # API IDs, as strings, whose results were dropped by a crawl of the same
+    # entity types, so don't need fetching; path must have a retention
+    # changes are stored by _save_ignored
+    def _ignored (self, path):
+        if path not in self._ignored_api_ids:
+            data = json.loads(self.storage.meta(_ignored_key(path)) or 'null')
+            if data is not None and data['types'] == self._retention(path)[1]:
+                self._ignored_api_ids[path] = set(data['api ids'])
+            else:
+                # other entity types may accept results dropped before
+                self._ignored_api_ids[path] = set()
+                if data is not None:
+                    self._unsaved_ignored.add(path)
+        return self._ignored_api_ids[path]
+
+    def _is_ignored (self, path, api_id):
+        return (self._retention(path) is not None and
+                str(api_id) in self._ignored(path))
+
+    # store the ignored API IDs which have changed
+    def _save_ignored (self):
+        for path in self._unsaved_ignored:
+            api_ids = self._ignored_api_ids[path]
+            self.storage.store_meta(_ignored_key(path), json.dumps({
+                'types': self._retention(path)[1],
+                'api ids': sorted(api_ids),
+            }) if api_ids else None)
+        self._unsaved_ignored.clear()
+
+    # only keep ignored API IDs which are still listed
+    def _keep_ignored (self, path, api_ids):
+        if self._retention(path) is None:
+            return
+        ignored = self._ignored(path)
+        unlisted = ignored - {str(api_id) for api_id in api_ids}
+        if unlisted:
+            ignored -= unlisted
+            self._unsaved_ignored.add(path)
+
+    def _store_raw (self, path, result):
+        retention = self._retention(path)
+        if retention is None:
+            self.storage.store_raw(path, result)
+            return
+
+        ignored = self._ignored(path)
+        api_id = str(result['id'])
+        if _accepting_types(retention[0], result):
+            self.storage.store_raw(path, result)
+            if api_id in ignored:
+                ignored.remove(api_id)
+                self._unsaved_ignored.add(path)
+        else:
+            self.storage.remove_raw(path, result['id'])
+            if api_id not in ignored:
+                ignored.add(api_id)
+                self._unsaved_ignored.add(path)
+
+    # drop stored results which no crawled entity type accepts, such as those
+    # stored by an older version, and return the remaining API IDs
+    def _retain_raw (self, path, api_ids):
+        retention = self._retention(path)
+        if retention is None:
+            return api_ids
+
+        api_ids = [api_id for api_id in api_ids
+                   if not self._is_ignored(path, api_id)]
+        retained = []
+        with self.storage.batch():
+            for i in range(0, len(api_ids), _RAW_CHUNK_SIZE):
+                chunk_api_ids = api_ids[i:i + _RAW_CHUNK_SIZE]
+                results = self.storage.raw_many(path, chunk_api_ids)
+                for api_id, result in zip(chunk_api_ids, results):
+                    if _accepting_types(retention[0], result):
+                        retained.append(api_id)
+                    else:
+                        self._store_raw(path, result)
+            self._save_ignored()
+        if len(retained) < len(api_ids):
+            logger.info(f'dropped {len(api_ids) - len(retained)} '
+                        f'/{"/".join(path)}')
+        return retained
+
+    def _new_api_ids (self, path, api_ids):
+        return [api_id for api_id in api_ids
+                if not self.storage.exists_raw(path, api_id) and
+                not self._is_ignored(path, api_id)]
 
     def crawl_raw (self, path, api_ids):
-        new_api_ids = [api_id for api_id in api_ids
-                       if not self.storage.exists_raw(path, api_id)]
+        new_api_ids = self._new_api_ids(path, api_ids)
         if not new_api_ids:
             return
         logger.info(f'get {len(new_api_ids)}/{len(api_ids)} /{"/".join(path)}')
 
-        for result in self.client.get(path, new_api_ids):
-            self.storage.store_raw(path, result)
+        # storage is only accessed from this thread
+        for results in self._get_batches(path, new_api_ids):
+            # each batch is stored as a unit, so that an interrupted crawl can
+            # continue from the last stored batch
+            with self.storage.batch():
+                for result in results:
+                    self._store_raw(path, result)
+        self._save_ignored()
 
-    def _process (self, api_ids, entity_types):
-        for api_id in api_ids:
-            for entity_type in entity_types:
-                try:
-                    entity = self.storage.from_api_id(entity_type, api_id, self)
-                except gw2entity.SkipEntityError:
-                    pass
-                else:
-                    self.storage.store(entity)
+    # results which are added or removed while pages are fetched move others
+    # between pages, so some may have been missed
+    # returns the API IDs of results to get by ID, in listed
+    @staticmethod
+    def _missed_api_ids (listed, paged_api_ids):
+        paged_api_ids = {str(api_id) for api_id in paged_api_ids}
+        return [api_id for api_id in listed
+                if str(api_id) not in paged_api_ids]
+
+    # the same as crawl_raw for all API IDs, using pages
+    # returns the listed API IDs
+    def _crawl_raw_paged (self, path):
+        logger.info(f'get all /{"/".join(path)}')
+        paged_api_ids = []
+        results, page_total = self.client.get_page(path, 0)
+        # pages are only requested once the number of pages is known
+        page_results = self._call_concurrent(
+            functools.partial(self.client.get_page, path, page)
+            for page in range(1, page_total))
+        for results in itertools.chain(
+            (results,), (results for _, (results, _) in page_results)
+        ):
+            with self.storage.batch():
+                for result in results:
+                    self._store_raw(path, result)
+                    paged_api_ids.append(result['id'])
+
+        logger.info(f'list /{"/".join(path)}')
+        api_ids = self.client.list_(path)
+        missed_api_ids = self._missed_api_ids(api_ids, paged_api_ids)
+        if missed_api_ids:
+            logger.info(f'get {len(missed_api_ids)} missed from pages '
+                        f'/{"/".join(path)}')
+            for results in self._get_batches(path, missed_api_ids):
+                with self.storage.batch():
+                    for result in results:
+                        self._store_raw(path, result)
+        self._save_ignored()
+        return api_ids
+
+    # whether _crawl_raw_paged should be used to fetch everything for path
+    def _use_pages (self, path, refetch):
+        return self.paged and (
+            refetch or next(iter(self.storage.raw_api_ids(path)), None) is None)
+
+    # the same as crawl_raw, but fetches results even if they're stored
+    # progress: {path: number of api_ids already fetched}, with paths joined by
+    #   '/'; updated and stored as results are fetched
+    def _refetch_raw (self, path, api_ids, progress):
+        path_key = '/'.join(path)
+        start = progress.get(path_key, 0)
+        if start > 0:
+            self._reconcile_ignored(path, api_ids[:start])
+        logger.info(f'get {len(api_ids) - start}/{len(api_ids)} /{path_key}')
+
+        positions = {str(api_id): i for i, api_id in enumerate(api_ids)}
+        # batches may complete in any order, so progress only moves past a
+        # batch once all earlier batches are stored
+        # {batch index: end position of its results}
+        completed = {}
+        next_index = 0
+        for index, results in self._call_concurrent(
+            self.client.batches(path, api_ids[start:])
+        ):
+            with self.storage.batch():
+                completed[index] = start
+                for result in results:
+                    self._store_raw(path, result)
+                    completed[index] = max(completed[index],
+                                           positions[str(result['id'])] + 1)
+                while next_index in completed:
+                    progress[path_key] = max(progress.get(path_key, 0),
+                                             completed.pop(next_index))
+                    next_index += 1
+                self.storage.store_meta(_REFETCH_PROGRESS_KEY,
+                                        json.dumps(progress))
+        self._save_ignored()
+
+    # ignored API IDs are only stored once a path is fetched, so after an
+    # interrupted refetch they may be out of date for the results before
+    # progress: fix them from the stored results, and fetch results which are
+    # neither stored nor ignored
+    def _reconcile_ignored (self, path, api_ids):
+        if self._retention(path) is None:
+            return
+        ignored = self._ignored(path)
+        stored = {str(api_id) for api_id in api_ids
+                  if self.storage.exists_raw(path, api_id)}
+        if ignored & stored:
+            ignored -= stored
+            self._unsaved_ignored.add(path)
+        self.crawl_raw(path, api_ids)
+
+    # store relations given by entities' extra_entity_relations, without
+    # building them where possible
+    # entity_types: all with the same path
+    def _process_relations (self, api_ids, entity_types):
+        api_ids = list(api_ids)
+        path = entity_types[0].path()
+        with self.storage.batch():
+            for i in range(0, len(api_ids), _RAW_CHUNK_SIZE):
+                chunk_api_ids = api_ids[i:i + _RAW_CHUNK_SIZE]
+                results = self.storage.raw_many(path, chunk_api_ids)
+                for api_id, result in zip(chunk_api_ids, results):
+                    for entity_type in _accepting_types(entity_types, result):
+                        try:
+                            relations = entity_type.relations_from_result(
+                                result)
+                            if relations is None:
+                                relations = self.storage.from_result(
+                                    entity_type, result, self
+                                ).extra_entity_relations()
+                        except gw2entity.SkipEntityError:
+                            continue
+                        self.storage.store_entity_relations(
+                            entity_type, api_id, relations)
+
+    # build entities and store their IDs; relations must already be stored
+    # index: if given, {(entity_type, id_): set(api_ids)}, updated with the IDs
+    #   of stored entities
+    # entities: if given, a list, extended with stored entities
+    def _process (self, api_ids, entity_types, index=None, entities=None):
+        api_ids = list(api_ids)
+        path = entity_types[0].path()
+        with self.storage.batch():
+            for i in range(0, len(api_ids), _RAW_CHUNK_SIZE):
+                results = self.storage.raw_many(
+                    path, api_ids[i:i + _RAW_CHUNK_SIZE])
+                for result in results:
+                    for entity_type in _accepting_types(entity_types, result):
+                        try:
+                            entity = self.storage.from_result(
+                                entity_type, result, self)
+                        except gw2entity.SkipEntityError:
+                            pass
+                        else:
+                            self._store_built(entity, index, entities)
+
+    def _store_built (self, entity, index, entities):
+        self.storage.store_entity_ids(entity)
+        if index is not None:
+            for id_ in entity.ids:
+                index.setdefault(
+                    (type(entity), id_), set()).add(entity.api_id)
+        if entities is not None:
+            entities.append(entity)
+
+    # the same as calling _process for each group, using worker processes
+    # api_ids_by_path: {path: api_ids}
+    def _process_parallel (self, api_ids_by_path, ordered_grouped, index,
+                           entities):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            # workers read stored results and relations from a snapshot
+            snapshot_path = os.path.join(tmp_path, 'snapshot')
+            logger.info(f'write snapshot for {self.processes} processes')
+            gw2storage.compile_snapshot(self._wrapped_storage, snapshot_path)
+
+            with concurrent.futures.ProcessPoolExecutor(
+                self.processes, initializer=_init_worker,
+                initargs=(snapshot_path,)
+            ) as executor:
+                tasks = []
+                for group in ordered_grouped:
+                    api_ids = list(api_ids_by_path[group[0].path()])
+                    for i in range(0, len(api_ids), _PROCESS_CHUNK_SIZE):
+                        chunk_api_ids = api_ids[i:i + _PROCESS_CHUNK_SIZE]
+                        tasks.append((group, executor.submit(
+                            _build_entities, chunk_api_ids, group)))
+
+                with self.storage.batch():
+                    for group, future in tasks:
+                        built_entities, failed_api_ids = future.result()
+                        for entity in built_entities:
+                            self._store_built(entity, index, entities)
+                        self._process(failed_api_ids, group, index, entities)
+
+    # precompute the result of Storage.from_id without filters
+    # returns {(entity_type, id_): api_ids}
+    def _resolve_ids (self, index):
+        resolved = {}
+        for entity_type, id_ in index:
+            try:
+                entities = self.storage.all_from_id(entity_type, id_)
+            except KeyError:
+                # all entities with this ID were removed
+                entities = []
+            filtered_entities = (
+                gw2entity.Entity.DEFAULT_FILTERS.filter_(entities))
+            api_ids = sorted(e.api_id for e in filtered_entities)
+            self.storage.store_resolved_ids(entity_type.type_id(), id_, api_ids)
+            resolved[(entity_type, id_)] = api_ids
+        return resolved
 
     def crawl (self, entity_type, api_ids):
-        self.crawl_raw(entity_type, api_ids)
+        self.crawl_raw(entity_type.path(), api_ids)
+        api_ids = self._retain_raw(entity_type.path(), api_ids)
+        self._process_relations(api_ids, (entity_type,))
+        self.storage.entity_cache.clear()
         self._process(api_ids, (entity_type,))
 
-    def crawl_all (self, entity_types):
+    # warm_pack_path: if given, write a warm pack of all crawled entities to
+    #   this path (see storage.write_warm_pack)
+    # refetch: fetch results again even if they're stored, replacing them
+    # resume: continue an interrupted crawl if there is one, using the API IDs
+    #   it listed and its value for refetch
+    def crawl_all (self, entity_types, warm_pack_path=None, refetch=False,
+                   resume=False):
+        checkpoint = self.storage.meta(_CHECKPOINT_KEY) if resume else None
+        if checkpoint is None:
+            # listed is {path: api_ids}, with paths joined by '/'
+            checkpoint = {'refetch': refetch, 'listed': {}}
+            self.storage.store_meta(_CHECKPOINT_KEY, json.dumps(checkpoint))
+            # progress of an earlier crawl doesn't apply to this one
+            self.storage.store_meta(_REFETCH_PROGRESS_KEY, None)
+            refetch_progress = {}
+        else:
+            checkpoint = json.loads(checkpoint)
+            refetch_progress = json.loads(
+                self.storage.meta(_REFETCH_PROGRESS_KEY) or '{}')
+        # stored results change before the index is rebuilt
+        self.storage.store_meta(_INDEXED_KEY, None)
+
+        self._crawl_all(entity_types, warm_pack_path, checkpoint,
+                        refetch_progress)
+        self.storage.store_meta(_CHECKPOINT_KEY, None)
+        self.storage.store_meta(_REFETCH_PROGRESS_KEY, None)
+        self.storage.store_meta(_INDEXED_KEY, _indexed_value(entity_types))
+
+    @staticmethod
+    def _ordered_groups (entity_types):
         by_path = {}
         for entity_type in entity_types:
             by_path.setdefault(entity_type.path(), []).append(entity_type)
 
         ordered = list(_dependency_order(entity_types))
-        ordered_grouped = sorted(by_path.values(),
-                                 key=lambda group: ordered.index(group[0]))
+        return sorted(by_path.values(),
+                      key=lambda group: ordered.index(group[0]))
+
+    def _write_warm_pack (self, warm_pack_path, entities, index, resolved):
+        logger.info(f'write warm pack: {warm_pack_path}')
+        gw2storage.write_warm_pack(
+            warm_pack_path, self.storage.schema_version(),
+            entities, index, resolved)
+
+    def _crawl_all (self, entity_types, warm_pack_path, checkpoint,
+                    refetch_progress):
+        ordered_grouped = self._ordered_groups(entity_types)
 
         api_ids_by_path = {}
+        for group in ordered_grouped:
+            path = group[0].path()
+            path_key = '/'.join(path)
+            if path_key in checkpoint['listed']:
+                api_ids = checkpoint['listed'][path_key]
+            else:
+                if self._use_pages(path, checkpoint['refetch']):
+                    # gets results without a separate list request
+                    api_ids = self._crawl_raw_paged(path)
+                    # every result is stored, so there's nothing to refetch
+                    refetch_progress[path_key] = len(api_ids)
+                    self.storage.store_meta(_REFETCH_PROGRESS_KEY,
+                                            json.dumps(refetch_progress))
+                else:
+                    logger.info(f'list /{path_key}')
+                    api_ids = self.client.list_(path)
+                checkpoint['listed'][path_key] = api_ids
+                self.storage.store_meta(_CHECKPOINT_KEY,
+                                        json.dumps(checkpoint))
+            self._keep_ignored(path, api_ids)
+            if checkpoint['refetch']:
+                self._refetch_raw(path, api_ids, refetch_progress)
+            else:
+                self.crawl_raw(path, api_ids)
+            api_ids_by_path[path] = self._retain_raw(path, api_ids)
+
+        # readers see the previous index until this is complete
+        with self.storage.rebuild_index():
+            # a single batch means each index entry is written once
+            with self.storage.batch():
+                index, entities, resolved = self._build_index(
+                    ordered_grouped, api_ids_by_path,
+                    warm_pack_path is not None)
+
+        if warm_pack_path is not None:
+            self._write_warm_pack(warm_pack_path, entities, index, resolved)
+
+    # returns (index, entities, resolved), where entities is None unless
+    # keep_entities is True
+    def _build_index (self, ordered_grouped, api_ids_by_path, keep_entities):
+        # store all relations first, so that each entity is only built once,
+        # and ID generation can use relations
+        for group in ordered_grouped:
+            self._process_relations(api_ids_by_path[group[0].path()], group)
+        # entities built before their relations are stored are incomplete
+        self.storage.entity_cache.clear()
+        # the same as the stored index
+        index = {}
+        entities = [] if keep_entities else None
+        if self.processes > 1:
+            self._process_parallel(api_ids_by_path, ordered_grouped, index,
+                                   entities)
+        else:
+            for group in ordered_grouped:
+                self._process(api_ids_by_path[group[0].path()], group, index,
+                              entities)
+        return (index, entities, self._resolve_ids(index))
+
+    # check_changed: fetch all listed results to find those which changed,
+    #   rather than only fetching new results
+    # if the index wasn't built by crawling the same entity types, this crawls
+    # everything instead
+    def crawl_incremental (self, entity_types, check_changed=True):
+        indexed_value = _indexed_value(entity_types)
+        if self.storage.meta(_INDEXED_KEY) != indexed_value:
+            logger.info('index not built for these entity types, crawl all')
+            self.crawl_all(entity_types)
+            return
+
+        self.storage.store_meta(_INDEXED_KEY, None)
+        with self.storage.batch():
+            self._crawl_incremental(entity_types, check_changed)
+            self._save_ignored()
+        self.storage.store_meta(_INDEXED_KEY, indexed_value)
+
+    # find entities affected by changes to the entities in queue, which must
+    # also be rebuilt: those using them through relations, and all entities of
+    # types which depend on their types
+    # affected: set of (entity_type, api_id), updated
+    # found: called with each newly affected entity built from a stored result,
+    #   in the current state of the storage
+    def _find_affected (self, queue, affected, entity_types, listed,
+                        affected_types, found):
+        queue = list(queue)
+        while queue:
+            entity_type, api_id = queue.pop()
+            if (entity_type, api_id) in affected:
+                continue
+            affected.add((entity_type, api_id))
+
+            if entity_type not in affected_types:
+                affected_types.add(entity_type)
+                for dependent_type in _dependent_types(
+                    (entity_type,), entity_types
+                ):
+                    queue.extend((dependent_type, dependent_api_id)
+                                 for dependent_api_id
+                                 in listed[dependent_type.path()])
+
+            if not self.storage.exists_raw(entity_type.path(), api_id):
+                continue
+            result = self.storage.raw(entity_type.path(), api_id)
+            if not entity_type.accepts_result(result):
+                continue
+            try:
+                entity = self.storage.from_result(entity_type, result, self)
+            except gw2entity.SkipEntityError:
+                continue
+            found(entity)
+            # relations only exist between entities from the stored result, so
+            # this is the same before and after the change
+            for other_type, other_api_id in entity.extra_entity_relations():
+                if other_type in entity_types:
+                    queue.append((other_type, other_api_id))
+
+    def _crawl_incremental (self, entity_types, check_changed):
+        ordered_grouped = self._ordered_groups(entity_types)
+
+        # {path: api_ids}
+        listed = {}
+        # results to store
+        new_results = []
+        # set of (entity_type, api_id)
+        changed = set()
+        removed = set()
+        # stored results to remove, as (path, api_id)
+        unlisted = []
         for group in ordered_grouped:
             path = group[0].path()
             logger.info(f'list /{"/".join(path)}')
             api_ids = self.client.list_(path)
-            api_ids_by_path[path] = api_ids
-            self.crawl_raw(path, api_ids)
-            self._process(api_ids, group)
-        # now relations should all exist, we process again so that ID generation
-        # can use relations
+            listed[path] = api_ids
+            self._keep_ignored(path, api_ids)
+
+            fetch_api_ids = (
+                [api_id for api_id in api_ids
+                 if not self._is_ignored(path, api_id)] if check_changed
+                else self._new_api_ids(path, api_ids))
+            logger.info(f'get {len(fetch_api_ids)}/{len(api_ids)} '
+                        f'/{"/".join(path)}')
+            retention = self._retention(path)
+            for result in self._get(path, fetch_api_ids):
+                api_id = result['id']
+                if not self.storage.exists_raw(path, api_id):
+                    if (retention is not None and
+                        not _accepting_types(retention[0], result)
+                    ):
+                        # never stored, so nothing to rebuild
+                        self._store_raw(path, result)
+                        continue
+                elif _same_result(result, self.storage.raw(path, api_id)):
+                    continue
+                new_results.append((path, result))
+                changed.update((entity_type, api_id) for entity_type in group)
+
+            # stored results which are no longer listed; only those which were
+            # indexed were processed
+            listed_api_ids = {str(api_id) for api_id in api_ids}
+            for stored_api_id in list(self.storage.raw_api_ids(path)):
+                if stored_api_id in listed_api_ids:
+                    continue
+                unlisted.append((path, stored_api_id))
+                api_id = self.storage.raw(path, stored_api_id)['id']
+                for entity_type in group:
+                    if self.storage.entity_ids(entity_type.type_id(), api_id):
+                        changed.add((entity_type, api_id))
+                        removed.add((entity_type, api_id))
+
+        logger.info(f'changed: {len(changed) - len(removed)}, '
+                    f'removed: {len(removed)}')
+        if not changed:
+            for path, api_id in unlisted:
+                self.storage.remove_raw(path, api_id)
+            return
+
+        # {(entity_type, id_)} whose index entries changed
+        changed_ids = set()
+        def remove (entity):
+            for id_ in self.storage.remove(entity):
+                changed_ids.add((type(entity), id_))
+
+        # remove everything stored for affected entities, as built from the
+        # results stored before this crawl
+        self.storage.entity_cache.clear()
+        affected = set()
+        affected_types = set()
+        old_entities = []
+        self._find_affected(changed, affected, entity_types, listed,
+                            affected_types, old_entities.append)
+        for entity in old_entities:
+            remove(entity)
+
+        for path, result in new_results:
+            self._store_raw(path, result)
+        for path, api_id in unlisted:
+            self.storage.remove_raw(path, api_id)
+
+        # new results may relate to entities which weren't affected before;
+        # other entities' relations are unchanged, so don't need following
+        # again
+        self.storage.entity_cache.clear()
+        updated = changed - removed
+        affected -= updated
+        self._find_affected(
+            updated, affected, entity_types, listed, affected_types,
+            lambda entity: ((type(entity), entity.api_id) in updated or
+                            remove(entity)))
+        logger.info(f'affected: {len(affected)}')
+
+        # rebuild as in crawl_all, but only affected entities
+        # results which are no longer accepted have been dropped
+        affected_api_ids = {
+            group[0].path(): [api_id for api_id in listed[group[0].path()]
+                              if any((entity_type, api_id) in affected
+                                     for entity_type in group) and
+                              self.storage.exists_raw(group[0].path(), api_id)]
+            for group in ordered_grouped}
         for group in ordered_grouped:
-            path = group[0].path()
-            api_ids = api_ids_by_path[path]
-            self._process(api_ids, group)
+            self._process_relations(affected_api_ids[group[0].path()], group)
+        self.storage.entity_cache.clear()
+        index = {}
+        for group in ordered_grouped:
+            self._process(affected_api_ids[group[0].path()], group, index)
+        changed_ids.update(index)
+        self._resolve_ids(changed_ids)
+
+
+# the same as Crawler, for use with an event loop
+# client: like client.AsyncClient
+# concurrency: maximum number of batches of results to fetch at once; the
+#   client's throttle (apiclient.Throttle) may allow fewer requests at once
+# process_chunk_size: number of API IDs to build entities for between yielding
+#   to the event loop
+class AsyncCrawler (Crawler):
+    def __init__ (self, client, storage, entity_types, concurrency=8,
+                  process_chunk_size=100, paged=True):
+        Crawler.__init__(self, client, storage, entity_types, concurrency,
+                         paged=paged)
+        self.process_chunk_size = process_chunk_size
+        self._semaphore = None
+
+    # building an entity may request results which weren't listed; this can't
+    # wait, so blocks the event loop
+    def crawl_raw (self, path, api_ids):
+        new_api_ids = self._new_api_ids(path, api_ids)
+        if not new_api_ids:
+            return
+        logger.info(f'get (blocking) {len(new_api_ids)}/{len(api_ids)} '
+                    f'/{"/".join(path)}')
+
+        for result in self.client.sync_client.get(path, new_api_ids):
+            self._store_raw(path, result)
+        self._save_ignored()
+
+    async def _get_batch (self, batch):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await batch()
+
+    async def crawl_raw_async (self, path, api_ids):
+        new_api_ids = self._new_api_ids(path, api_ids)
+        if not new_api_ids:
+            return
+        logger.info(f'get {len(new_api_ids)}/{len(api_ids)} /{"/".join(path)}')
+        await self._get_raw_async(path, new_api_ids)
+
+    # fetch and store results, even if they're stored
+    async def _get_raw_async (self, path, api_ids):
+        tasks = [asyncio.ensure_future(self._get_batch(batch))
+                 for batch in self.client.batches(path, api_ids)]
+        try:
+            # storage is only accessed from the event loop
+            for task in asyncio.as_completed(tasks):
+                results = await task
+                with self.storage.batch():
+                    for result in results:
+                        self._store_raw(path, result)
+        finally:
+            for task in tasks:
+                task.cancel()
+        self._save_ignored()
+
+    # the same as _crawl_raw_paged
+    async def _crawl_raw_paged_async (self, path):
+        logger.info(f'get all /{"/".join(path)}')
+        paged_api_ids = []
+        def store (results):
+            with self.storage.batch():
+                for result in results:
+                    self._store_raw(path, result)
+                    paged_api_ids.append(result['id'])
+
+        results, page_total = await self._get_batch(
+            functools.partial(self.client.get_page, path, 0))
+        store(results)
+        tasks = [asyncio.ensure_future(self._get_batch(
+                     functools.partial(self.client.get_page, path, page)))
+                 for page in range(1, page_total)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                results, _ = await task
+                store(results)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        logger.info(f'list /{"/".join(path)}')
+        api_ids = await self.client.list_(path)
+        missed_api_ids = self._missed_api_ids(api_ids, paged_api_ids)
+        if missed_api_ids:
+            logger.info(f'get {len(missed_api_ids)} missed from pages '
+                        f'/{"/".join(path)}')
+            await self._get_raw_async(path, missed_api_ids)
+        self._save_ignored()
+        return api_ids
+
+    # list and fetch everything at path
+    # refetch: as for crawl_all
+    async def _crawl_path_async (self, path, refetch):
+        if self._use_pages(path, refetch):
+            return await self._crawl_raw_paged_async(path)
+        logger.info(f'list /{"/".join(path)}')
+        api_ids = await self.client.list_(path)
+        if refetch:
+            logger.info(f'get {len(api_ids)}/{len(api_ids)} '
+                        f'/{"/".join(path)}')
+            await self._get_raw_async(path, api_ids)
+        else:
+            await self.crawl_raw_async(path, api_ids)
+        return api_ids
+
+    # call process (_process or _process_relations) with api_ids in chunks
+    async def _process_async (self, process, api_ids, *args):
+        api_ids = list(api_ids)
+        for i in range(0, len(api_ids), self.process_chunk_size):
+            process(api_ids[i:i + self.process_chunk_size], *args)
+            await asyncio.sleep(0)
+
+    async def crawl (self, entity_type, api_ids):
+        await self.crawl_raw_async(entity_type.path(), api_ids)
+        api_ids = self._retain_raw(entity_type.path(), api_ids)
+        await self._process_async(
+            self._process_relations, api_ids, (entity_type,))
+        self.storage.entity_cache.clear()
+        await self._process_async(self._process, api_ids, (entity_type,))
+
+    # refetch: as for Crawler.crawl_all; resuming isn't supported
+    async def crawl_all (self, entity_types, warm_pack_path=None,
+                         refetch=False):
+        self.storage.store_meta(_INDEXED_KEY, None)
+        await self._crawl_all(entity_types, warm_pack_path, refetch)
+        self.storage.store_meta(_INDEXED_KEY, _indexed_value(entity_types))
+
+    async def _crawl_all (self, entity_types, warm_pack_path, refetch):
+        ordered_grouped = self._ordered_groups(entity_types)
+
+        # fetch everything first, so that building entities rarely blocks
+        paths = [group[0].path() for group in ordered_grouped]
+        all_api_ids = await asyncio.gather(*(
+            self._crawl_path_async(path, refetch) for path in paths))
+        for path, api_ids in zip(paths, all_api_ids):
+            self._keep_ignored(path, api_ids)
+        api_ids_by_path = {path: self._retain_raw(path, api_ids)
+                           for path, api_ids in zip(paths, all_api_ids)}
+
+        with self.storage.rebuild_index(), self.storage.batch():
+            for group in ordered_grouped:
+                await self._process_async(
+                    self._process_relations, api_ids_by_path[group[0].path()],
+                    group)
+            self.storage.entity_cache.clear()
+            index = {}
+            entities = [] if warm_pack_path is not None else None
+            for group in ordered_grouped:
+                await self._process_async(
+                    self._process, api_ids_by_path[group[0].path()], group,
+                    index, entities)
+            resolved = self._resolve_ids(index)
+
+        if warm_pack_path is not None:
+            self._write_warm_pack(warm_pack_path, entities, index, resolved)
+
+
+# after a full recrawl, remove cached responses which it didn't use
+def _prune_cache (client):
+    cache = getattr(client, 'cache', None)
+    if cache is not None:
+        removed = cache.prune()
+        if removed:
+            logger.info(f'removed {removed} unused cached responses')
 
 
 def crawl (client=gw2client.Client(),
            storage=None,
            entity_types=gw2entity.BUILTIN_TYPES,
-           full_recrawl=False):
+           full_recrawl=False,
+           warm_pack_path=None,
+           concurrency=1,
+           incremental=False,
+           processes=1,
+           resume=False,
+           paged=True,
+           check_changed=True):
+    if incremental and warm_pack_path is not None:
+        raise ValueError('a warm pack can\'t be written by an incremental '
+                         'crawl')
+    if storage is None:
+        with gw2storage.FileStorage() as storage:
+            crawl(client, storage, entity_types, full_recrawl, warm_pack_path,
+                  concurrency, incremental, processes, resume, paged,
+                  check_changed)
+        return
+
+    crawler = Crawler(client, storage, entity_types, concurrency, processes,
+                      paged)
+    if storage.schema_version() != client.schema_version:
+        # also removes any checkpoint, since it's for different data
+        storage.clear_raw()
+        storage.store_schema_version(client.schema_version)
+        # nothing to compare against or refetch
+        incremental = False
+        full_recrawl = False
+    if incremental and not full_recrawl:
+        # only valid if entity definitions haven't changed since the last crawl
+        crawler.crawl_incremental(entity_types, check_changed)
+    else:
+        # the index is always rebuilt, since entity definitions may change;
+        # stored results are replaced rather than cleared, so that readers can
+        # still use the previous index meanwhile
+        crawler.crawl_all(entity_types, warm_pack_path, full_recrawl, resume)
+        if full_recrawl and not resume:
+            _prune_cache(client)
+
+
+# the same as crawl, for use with an event loop
+async def crawl_async (client=None,
+                       storage=None,
+                       entity_types=gw2entity.BUILTIN_TYPES,
+                       full_recrawl=False,
+                       warm_pack_path=None,
+                       concurrency=8,
+                       paged=True):
+    if client is None:
+        client = gw2client.AsyncClient()
     if storage is None:
         with gw2storage.FileStorage() as storage:
-            crawl(client, storage, entity_types, full_recrawl)
+            await crawl_async(client, storage, entity_types, full_recrawl,
+                              warm_pack_path, concurrency, paged)
         return
 
-    crawler = Crawler(client, storage, entity_types)
-    if storage.schema_version() != client.schema_version or full_recrawl:
+    crawler = AsyncCrawler(client, storage, entity_types, concurrency,
+                           paged=paged)
+    if storage.schema_version() != client.schema_version:
         storage.clear_raw()
         storage.store_schema_version(client.schema_version)
-    storage.clear() # required if entity definition changes
-    crawler.crawl_all(entity_types)
+        # nothing to refetch
+        full_recrawl = False
+    # the index is always rebuilt, since entity definitions may change; stored
+    # results are replaced rather than cleared, as for crawl
+    await crawler.crawl_all(entity_types, warm_pack_path, full_recrawl)
+    if full_recrawl:
+        _prune_cache(client)
@@ -16,6 +16,7 @@ class Entity (abc.ABC, gw2util.Typed, gw2util.Identified):
     # raise SkipEntityError to skip
     # when loading a dependency, should prefer Storage.raw to
     # Storage.from_api_id where possible
+    # must be picklable, so must not keep references to the storage or crawler
     def __init__ (self, api_id, ids):
         gw2util.Identified.__init__(self, ids)
         self.api_id = api_id
@@ -39,11 +40,29 @@ class Entity (abc.ABC, gw2util.Typed, gw2util.Identified):
     def path ():
         pass
 
+    # cheap check on a result, used when crawling to avoid building entities of
+    # every type sharing a path; if this returns False, the constructor must
+    # raise SkipEntityError
+    @classmethod
+    def accepts_result (cls, result):
+        return True
+
     # relations must not be chained, ie. rely on other relations existing
     # id generation may rely on relations
     def extra_entity_relations (self):
         return {}
 
+    # the result of extra_entity_relations for an entity built from result,
+    # without building it; returns None if this isn't possible
+    # if building would raise SkipEntityError, should raise it too or return no
+    # relations
+    @classmethod
+    def relations_from_result (cls, result):
+        if cls.extra_entity_relations is Entity.extra_entity_relations:
+            return {}
+        else:
+            return None
+
     @staticmethod
     def _filter_first_by_name (entities):
         # filter to entity with earliest API ID (for determinism), for each
@@ -82,11 +101,9 @@ class Profession (Entity):
             for build_id, api_id in result.get('skills_by_palette', [])}
 
         self._weapons = {}
-        for type_id, weapon_result in result['weapons'].items():
-            try:
-                weapon_type = build.WeaponTypes.from_id(type_id)
-            except KeyError:
-                continue
+        for weapon_type, weapon_result in Profession._weapons_from_result(
+            result
+        ):
             weapon_elite_spec_api_id = weapon_result.get('specialization')
             hands = set()
             for flag in weapon_result['flags']:
@@ -101,18 +118,37 @@ class Profession (Entity):
                            for skill in weapon_result['skills']}
             }
 
+    @staticmethod
+    def _weapons_from_result (result):
+        for type_id, weapon_result in result['weapons'].items():
+            try:
+                weapon_type = build.WeaponTypes.from_id(type_id)
+            except KeyError:
+                continue
+            yield (weapon_type, weapon_result)
+
     @staticmethod
     def path ():
         return ('professions',)
 
+    @staticmethod
+    def _relations (weapon_skill_api_ids):
+        return {(Skill, skill_api_id): ['weapon skill of profession']
+                for skill_api_id in weapon_skill_api_ids}
+
     def extra_entity_relations (self):
-        entities = {}
-        if self._weapons is not None:
-            for weapon_type in self._weapons.values():
-                for skill_api_id in weapon_type['skills']:
-                    entities[(Skill, skill_api_id)] = [
-                        'weapon skill of profession']
-        return entities
+        return Profession._relations(
+            skill_api_id
+            for weapon_type in self._weapons.values()
+            for skill_api_id in weapon_type['skills'])
+
+    @classmethod
+    def relations_from_result (cls, result):
+        return Profession._relations(
+            skill['id']
+            for weapon_type, weapon_result
+            in Profession._weapons_from_result(result)
+            for skill in weapon_result['skills'])
 
     def can_wield_type (self, weapon_type, elite_spec=None):
         wield_info = self._weapons.get(weapon_type)
@@ -204,13 +240,7 @@ class Skill (Entity):
         if full_id == 'portal entre':
             id_ = 'portal'
 
-        try:
-            self.type_ = build.SkillTypes.from_id(result.get('type'))
-        except KeyError:
-            if result['description'].startswith('Mech Command.'):
-                self.type_ = build.SkillTypes.PROFESSION
-            else:
-                raise SkipEntityError()
+        self.type_ = Skill._type_from_result(result)
 
         prof_api_ids = result.get('professions', ())
         self.professions = set()
@@ -384,6 +414,16 @@ class Skill (Entity):
     def _name_from_result (result):
         return result['name']
 
+    @staticmethod
+    def _type_from_result (result):
+        try:
+            return build.SkillTypes.from_id(result.get('type'))
+        except KeyError:
+            if result['description'].startswith('Mech Command.'):
+                return build.SkillTypes.PROFESSION
+            else:
+                raise SkipEntityError()
+
     @staticmethod
     def _is_aquatic_from_result (result):
         flags = result.get('flags', ())
@@ -397,16 +437,31 @@ class Skill (Entity):
     def path ():
         return ('skills',)
 
-    def extra_entity_relations (self):
+    @staticmethod
+    def _relations (flipover_skill_api_id, bundle_skills_api_ids,
+                    toolbelt_skill_api_id):
         entities = {}
-        if self._flipover_skill_api_id is not None:
-            entities[(Skill, self._flipover_skill_api_id)] = ['flipover']
-        for bundle_skill_api_id in self._bundle_skills_api_ids:
+        if flipover_skill_api_id is not None:
+            entities[(Skill, flipover_skill_api_id)] = ['flipover']
+        for bundle_skill_api_id in bundle_skills_api_ids:
             entities[(Skill, bundle_skill_api_id)] = ['bundle']
-        if self._toolbelt_skill_api_id is not None:
-            entities[(Skill, self._toolbelt_skill_api_id)] = ['toolbelt']
+        if toolbelt_skill_api_id is not None:
+            entities[(Skill, toolbelt_skill_api_id)] = ['toolbelt']
         return entities
 
+    def extra_entity_relations (self):
+        return Skill._relations(self._flipover_skill_api_id,
+                                self._bundle_skills_api_ids,
+                                self._toolbelt_skill_api_id)
+
+    @classmethod
+    def relations_from_result (cls, result):
+        # skipped entities have no relations
+        Skill._type_from_result(result)
+        return Skill._relations(result.get('flip_skill'),
+                                result.get('bundle_skills', []),
+                                result.get('toolbelt_skill'))
+
     @staticmethod
     def _storage_build_id (profession, build_id):
         return f'build:{profession.api_id}:{build_id}'
@@ -496,18 +551,29 @@ class RevenantLegend (Entity):
     def path ():
         return ('legends',)
 
-    def extra_entity_relations (self):
-        api_ids = ([self._heal_skill_api_id] +
-                   self._utility_skill_api_ids +
-                   [self._elite_skill_api_id])
+    @staticmethod
+    def _relations (heal_skill_api_id, utility_skill_api_ids,
+                    elite_skill_api_id):
+        api_ids = ([heal_skill_api_id] +
+                   utility_skill_api_ids +
+                   [elite_skill_api_id])
         return {(Skill, api_id): ['legend'] for api_id in api_ids}
 
+    def extra_entity_relations (self):
+        return RevenantLegend._relations(self._heal_skill_api_id,
+                                         self._utility_skill_api_ids,
+                                         self._elite_skill_api_id)
+
+    @classmethod
+    def relations_from_result (cls, result):
+        return RevenantLegend._relations(
+            result['heal'], result['utilities'], result['elite'])
+
     def heal_skill (self, storage):
         return storage.from_api_id(Skill, self._heal_skill_api_id)
 
     def utility_skills (self, storage):
-        return [storage.from_api_id(Skill, api_id)
-                for api_id in self._utility_skill_api_ids]
+        return storage.from_api_ids(Skill, self._utility_skill_api_ids)
 
     def elite_skill (self, storage):
         return storage.from_api_id(Skill, self._elite_skill_api_id)
@@ -586,11 +652,7 @@ sigil_pattern = re.compile(r'^'
 
 class Sigil (Entity):
     def __init__ (self, result, relations, storage, crawler):
-        if result['type'] != 'UpgradeComponent':
-            raise SkipEntityError()
-        if result['details']['type'] != 'Sigil':
-            raise SkipEntityError()
-        if result['name'] == 'Legendary Sigil':
+        if not Sigil.accepts_result(result):
             raise SkipEntityError()
 
         self.name = result['name']
@@ -605,6 +667,12 @@ class Sigil (Entity):
 
         Entity.__init__(self, result['id'], ids)
 
+    @classmethod
+    def accepts_result (cls, result):
+        return (result['type'] == 'UpgradeComponent' and
+                result['details']['type'] == 'Sigil' and
+                result['name'] != 'Legendary Sigil')
+
     @staticmethod
     def path ():
         return ('items',)
@@ -616,11 +684,7 @@ rune_pattern = re.compile(r'^'
 
 class Rune (Entity):
     def __init__ (self, result, relations, storage, crawler):
-        if result['type'] != 'UpgradeComponent':
-            raise SkipEntityError()
-        if result['details']['type'] != 'Rune':
-            raise SkipEntityError()
-        if result['name'] in ('', 'Legendary Rune'):
+        if not Rune.accepts_result(result):
             raise SkipEntityError()
 
         self.name = result['name']
@@ -635,6 +699,12 @@ class Rune (Entity):
 
         Entity.__init__(self, result['id'], ids)
 
+    @classmethod
+    def accepts_result (cls, result):
+        return (result['type'] == 'UpgradeComponent' and
+                result['details']['type'] == 'Rune' and
+                result['name'] not in ('', 'Legendary Rune'))
+
     @staticmethod
     def path ():
         return ('items',)
@@ -646,7 +716,7 @@ relic_pattern = re.compile(r'^'
 
 class Relic (Entity):
     def __init__ (self, result, relations, storage, crawler):
-        if result['type'] not in ('Mwcc', 'Relic'):
+        if not Relic.accepts_result(result):
             raise SkipEntityError()
 
         self.name = result['name']
@@ -658,6 +728,10 @@ class Relic (Entity):
 
         Entity.__init__(self, result['id'], ids)
 
+    @classmethod
+    def accepts_result (cls, result):
+        return result['type'] in ('Mwcc', 'Relic')
+
     @staticmethod
     def path ():
         return ('items',)
@@ -670,9 +744,7 @@ food_prefixes = (
 
 class Food (Entity):
     def __init__ (self, result, relations, storage, crawler):
-        if result['type'] != 'Consumable':
-            raise SkipEntityError()
-        if result['details']['type'] != 'Food':
+        if not Food.accepts_result(result):
             raise SkipEntityError()
 
         self.name = result['name']
@@ -687,6 +759,11 @@ class Food (Entity):
 
         Entity.__init__(self, result['id'], ids)
 
+    @classmethod
+    def accepts_result (cls, result):
+        return (result['type'] == 'Consumable' and
+                result['details']['type'] == 'Food')
+
     @staticmethod
     def path ():
         return ('items',)
@@ -694,14 +771,17 @@ class Food (Entity):
 
 class UtilityConsumable (Entity):
     def __init__ (self, result, relations, storage, crawler):
-        if result['type'] != 'Consumable':
-            raise SkipEntityError()
-        if result['details']['type'] != 'Utility':
+        if not UtilityConsumable.accepts_result(result):
             raise SkipEntityError()
 
         self.name = result['name']
         Entity.__init__(self, result['id'], self.name)
 
+    @classmethod
+    def accepts_result (cls, result):
+        return (result['type'] == 'Consumable' and
+                result['details']['type'] == 'Utility')
+
     @staticmethod
     def path ():
         return ('items',)
@@ -72,3 +72,12 @@ class FakeClient:
             result = dict(data[id_])
             result['id'] = id_
             yield result
+
+    def batches (self, path, ids):
+        yield lambda: list(self.get(path, ids))
+
+    # returns (results, page_total); everything is in the first page
+    def get_page (self, path, page):
+        if page != 0:
+            raise ValueError(f'page out of range: {page}')
+        return (list(self.get(path, self.list_(path))), 1)
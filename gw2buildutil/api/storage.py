@@ -1,15 +1,253 @@
 import abc
+import collections
+import collections.abc
+import contextlib
+import functools
 import os
 import json
 import dbm
+import importlib
 import inspect
+import mmap
+import pickle
+import sqlite3
+import struct
+import time
+import zlib
 
 from .. import util as gw2util
 
 from . import entity as gw2entity, util
 
 
+DEFAULT_ENTITY_CACHE_SIZE = 4096
+
+
+def _default_path ():
+    default_cache_path = os.path.join(os.path.expanduser('~'), '.cache')
+    cache_path = os.environ.get('XDG_CACHE_HOME', default_cache_path)
+    return os.path.join(cache_path, 'gw2buildutil')
+
+
+class JsonCodec:
+    id_ = 'json'
+
+    def encode (self, data):
+        return json.dumps(data)
+
+    def decode (self, value):
+        return json.loads(value)
+
+
+# common substrings in API results, most common last
+_BINARY_CODEC_DICTIONARY = ''.join((
+    'specialization', 'professions', 'weapon_type', 'dual_wield',
+    'attunement', 'flip_skill', 'next_chain', 'prev_chain', 'bundle_skills',
+    'toolbelt_skill', 'categories', 'chat_link', 'vendor_value', 'game_types',
+    'default_skin', 'upgrade_component', 'infix_upgrade', 'attributes',
+    'modifier', 'bonuses', 'rarity', 'level', 'details', 'order', 'tier',
+    'traited_facts', 'requires_trait', 'overrides', 'duration', 'status',
+    'apply_count', 'hit_count', 'dmg_multiplier', 'percent', 'distance',
+    'value', 'target', 'Recharge', 'Damage', 'Duration', 'Buff', 'Number',
+    'Range', 'Time', 'Weapon_', 'Profession_', 'Utility', 'Heal', 'Elite',
+    'Weapon', 'NoUnderwater', 'description', 'facts', 'flags', 'slot', 'text',
+    'type', 'name', 'id', '.png',
+    'https://render.guildwars2.com/file/', 'icon',
+)).encode()
+
+
+# compact JSON, compressed when it helps using a preset dictionary of common
+# substrings; results are about half the size of JSON, and the format doesn't
+# depend on the Python version
+class BinaryCodec:
+    id_ = 'binary2'
+    # not valid JSON, so records can be decoded without knowing the codec
+    MAGIC = b'\0gb\2'
+    _UNCOMPRESSED = b'\0'
+    _COMPRESSED = b'\1'
+    # raw deflate stream, no header or checksum
+    _WBITS = -15
+
+    def encode (self, data):
+        encoded = json.dumps(data, separators=(',', ':')).encode()
+        compressor = zlib.compressobj(
+            zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, self._WBITS,
+            zdict=_BINARY_CODEC_DICTIONARY)
+        compressed = compressor.compress(encoded) + compressor.flush()
+        if len(compressed) < len(encoded):
+            return self.MAGIC + self._COMPRESSED + compressed
+        else:
+            return self.MAGIC + self._UNCOMPRESSED + encoded
+
+    def decode (self, value):
+        header_size = len(self.MAGIC) + 1
+        flag = value[len(self.MAGIC):header_size]
+        encoded = value[header_size:]
+        if flag == self._COMPRESSED:
+            decompressor = zlib.decompressobj(
+                self._WBITS, zdict=_BINARY_CODEC_DICTIONARY)
+            encoded = decompressor.decompress(encoded)
+        return json.loads(encoded)
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+_CODECS = {codec.id_: codec for codec in (JSON_CODEC, BINARY_CODEC)}
+
+
+# decode a value encoded by any codec
+def _decode (value):
+    if isinstance(value, bytes) and value.startswith(BinaryCodec.MAGIC):
+        return BINARY_CODEC.decode(value)
+    else:
+        return JSON_CODEC.decode(value)
+
+
+class EntityCache:
+    # least-recently-used cache of built entities, keyed by (type, api_id)
+    # size 0 disables caching
+    def __init__ (self, size=DEFAULT_ENTITY_CACHE_SIZE):
+        self.size = size
+        self._entities = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key (entity_type, api_id):
+        # api IDs are stringified in storage keys, so do the same here
+        return (entity_type, str(api_id))
+
+    def get (self, entity_type, api_id):
+        key = EntityCache._key(entity_type, api_id)
+        try:
+            entity = self._entities[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self._entities.move_to_end(key)
+        self.hits += 1
+        return entity
+
+    def put (self, entity_type, api_id, entity):
+        if self.size <= 0:
+            return
+        key = EntityCache._key(entity_type, api_id)
+        self._entities[key] = entity
+        self._entities.move_to_end(key)
+        while len(self._entities) > self.size:
+            self._entities.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate (self, entity_type, api_id):
+        self._entities.pop(EntityCache._key(entity_type, api_id), None)
+
+    def clear (self):
+        self._entities.clear()
+
+    def stats (self):
+        return {
+            'size': len(self._entities),
+            'max size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __len__ (self):
+        return len(self._entities)
+
+
+class StorageStats:
+    # counts and cumulative times of storage operations; times include time
+    # spent in nested operations, eg. from_id includes all_from_id
+    # callback: if set, called after each operation as
+    #   callback(operation, elapsed_seconds), where operation is a method name
+    #   or 'decode'
+    def __init__ (self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset (self):
+        # {operation: [count, time, misses]}
+        self._operations = {}
+        self.bytes_read = 0
+        self.decode_count = 0
+        self.decode_time = 0
+
+    def _record (self, operation, elapsed, miss=False):
+        counters = self._operations.setdefault(operation, [0, 0, 0])
+        counters[0] += 1
+        counters[1] += elapsed
+        if miss:
+            counters[2] += 1
+        if self.callback is not None:
+            self.callback(operation, elapsed)
+
+    def record_decode (self, size, elapsed):
+        self.bytes_read += size
+        self.decode_count += 1
+        self.decode_time += elapsed
+        if self.callback is not None:
+            self.callback('decode', elapsed)
+
+    def snapshot (self):
+        return {
+            'operations': {
+                operation: {'count': count, 'time': time_, 'misses': misses}
+                for operation, (count, time_, misses)
+                in self._operations.items()},
+            'bytes read': self.bytes_read,
+            'decode count': self.decode_count,
+            'decode time': self.decode_time,
+        }
+
+
+# decorator for Storage methods to record stats, if enabled; KeyError counts
+# as a miss, unless it's NotUniqueError
+def _instrumented (method):
+    operation = method.__name__
+
+    @functools.wraps(method)
+    def wrapper (self, *args, **kwargs):
+        stats = self.stats
+        if stats is None:
+            return method(self, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        except NotUniqueError:
+            stats._record(operation, time.perf_counter() - start)
+            raise
+        except KeyError:
+            stats._record(operation, time.perf_counter() - start, True)
+            raise
+        stats._record(operation, time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+
 class Storage (abc.ABC):
+    # StorageStats to record operations in; the default, None, records nothing
+    stats = None
+
+    # subclasses must call this constructor
+    def __init__ (self, entity_cache_size=DEFAULT_ENTITY_CACHE_SIZE):
+        self.entity_cache = EntityCache(entity_cache_size)
+
+    def _decode (self, value):
+        if self.stats is None:
+            return _decode(value)
+        start = time.perf_counter()
+        data = _decode(value)
+        elapsed = time.perf_counter() - start
+        # some storage reads text, which is stored encoded as UTF-8
+        size = len(value) if isinstance(value, bytes) else len(value.encode())
+        self.stats.record_decode(size, elapsed)
+        return data
+
     @abc.abstractmethod
     def store_schema_version (self, version):
         pass
@@ -18,6 +256,17 @@ class Storage (abc.ABC):
     def schema_version (self):
         pass
 
+    # store a str value which persists until clear_raw; value None removes it
+    # 'version' and 'codec' are reserved keys
+    @abc.abstractmethod
+    def store_meta (self, key, value):
+        pass
+
+    # returns None if not stored
+    @abc.abstractmethod
+    def meta (self, key):
+        pass
+
     @abc.abstractmethod
     def store_raw (self, path, result):
         pass
@@ -30,31 +279,222 @@ class Storage (abc.ABC):
     def raw (self, path, api_id):
         pass
 
+    # results are in the same order as api_ids
+    # implementations should override this if they can do better than calling
+    # raw for each API ID
+    @_instrumented
+    def raw_many (self, path, api_ids):
+        return [self.raw(path, api_id) for api_id in api_ids]
+
+    # does nothing if there is no stored result
+    @abc.abstractmethod
+    def remove_raw (self, path, api_id):
+        pass
+
     @abc.abstractmethod
     def clear_raw (self):
         pass
 
+    # API IDs of all stored results for path, as strings
     @abc.abstractmethod
-    def store (self, entity):
+    def raw_api_ids (self, path):
         pass
 
+    # add api_ids to the index for id_, discarding any stored resolved IDs for
+    # id_
+    @abc.abstractmethod
+    def store_ids (self, type_id, id_, api_ids):
+        pass
+
+    # IDs which have api_id in their index entry
+    @abc.abstractmethod
+    def entity_ids (self, type_id, api_id):
+        pass
+
+    # remove api_id from the index for every ID, discarding any stored resolved
+    # IDs for them, and return the IDs it was removed from
+    @abc.abstractmethod
+    def remove_entity_ids (self, type_id, api_id):
+        pass
+
+    # add to the relations of an entity
+    # relations is {name: [(entity_type_id, api_id), ...]}
+    @abc.abstractmethod
+    def store_relations (self, type_id, api_id, relations):
+        pass
+
+    # remove from the relations of an entity; relations is as for
+    # store_relations
+    @abc.abstractmethod
+    def remove_relations (self, type_id, api_id, relations):
+        pass
+
+    # within this context, implementations may defer index writes until the
+    # outermost batch ends; reads still see deferred writes
+    @contextlib.contextmanager
+    def batch (self):
+        yield
+
+    # within this context, the index (everything but raw results) starts empty;
+    # implementations may keep the previous index readable by other storage
+    # objects until the context exits successfully, and keep it if it doesn't
+    @contextlib.contextmanager
+    def rebuild_index (self):
+        self.clear()
+        yield
+
+    def store_entity_ids (self, entity):
+        entity_type_id = type(entity).type_id()
+        for id_ in entity.ids:
+            self.store_ids(entity_type_id, id_, (entity.api_id,))
+
+    # store the relations of other entities given by an entity's
+    # extra_entity_relations
+    def store_entity_relations (self, entity_type, api_id, extra_relations):
+        entity_ref = (entity_type.type_id(), api_id)
+        for (other_type, other_api_id), relation_ids \
+            in extra_relations.items() \
+        :
+            # relations of the other entity change, so it must be rebuilt
+            self.entity_cache.invalidate(other_type, other_api_id)
+            self.store_relations(other_type.type_id(), other_api_id,
+                                 {id_: (entity_ref,) for id_ in relation_ids})
+
+    def store (self, entity):
+        self.store_entity_ids(entity)
+        self.store_entity_relations(type(entity), entity.api_id,
+                                    entity.extra_entity_relations())
+
+    # undo store: remove everything stored for the entity, which must have been
+    # built from the same result as when it was stored
+    # returns the IDs the entity was removed from
+    def remove (self, entity):
+        entity_type_id = type(entity).type_id()
+        self.entity_cache.invalidate(type(entity), entity.api_id)
+        ids = self.remove_entity_ids(entity_type_id, entity.api_id)
+
+        entity_ref = (entity_type_id, entity.api_id)
+        for (other_type, other_api_id), relation_ids \
+            in entity.extra_entity_relations().items() \
+        :
+            self.entity_cache.invalidate(other_type, other_api_id)
+            self.remove_relations(other_type.type_id(), other_api_id,
+                                  {id_: (entity_ref,) for id_ in relation_ids})
+        return ids
+
     @abc.abstractmethod
     def relations (self, entity_type, api_id):
         pass
 
+    @staticmethod
+    def _relations_from_data (relations_data):
+        return util.Relations({
+            name: [util.Relation(e_type_id, api_id)
+                   for e_type_id, api_id in rs]
+            for name, rs in relations_data.items()})
+
+    def _build (self, entity_type, api_id, result, crawler):
+        relations = self.relations(entity_type, api_id)
+        entity = entity_type(result, relations, self, crawler)
+        self.entity_cache.put(entity_type, api_id, entity)
+        return entity
+
+    @_instrumented
     def from_api_id (self, entity_type, api_id, crawler=None):
+        try:
+            return self.entity_cache.get(entity_type, api_id)
+        except KeyError:
+            pass
         result = self.raw(entity_type.path(), api_id)
-        relations = self.relations(entity_type, api_id)
-        return entity_type(result, relations, self, crawler)
+        return self._build(entity_type, api_id, result, crawler)
+
+    # the same as from_api_id, for an already loaded result
+    @_instrumented
+    def from_result (self, entity_type, result, crawler=None):
+        api_id = result['id']
+        try:
+            return self.entity_cache.get(entity_type, api_id)
+        except KeyError:
+            pass
+        return self._build(entity_type, api_id, result, crawler)
+
+    # results are in the same order as api_ids
+    @_instrumented
+    def from_api_ids (self, entity_type, api_ids, crawler=None):
+        api_ids = list(api_ids)
+        entities = {}
+        missing_api_ids = []
+        for api_id in api_ids:
+            try:
+                entities[str(api_id)] = self.entity_cache.get(
+                    entity_type, api_id)
+            except KeyError:
+                missing_api_ids.append(api_id)
+
+        if missing_api_ids:
+            results = self.raw_many(entity_type.path(), missing_api_ids)
+            for api_id, result in zip(missing_api_ids, results):
+                entities[str(api_id)] = self._build(
+                    entity_type, api_id, result, crawler)
+
+        return [entities[str(api_id)] for api_id in api_ids]
 
     @abc.abstractmethod
     def all_from_id (self, entity_type, id_):
         pass
 
+    # store API IDs of entities matching id_ after applying
+    # Entity.DEFAULT_FILTERS, so that from_id doesn't have to build every
+    # matching entity; more than one API ID means id_ is ambiguous
+    @abc.abstractmethod
+    def store_resolved_ids (self, type_id, id_, api_ids):
+        pass
+
+    # returns None if not stored
+    @abc.abstractmethod
+    def resolved_ids (self, type_id, id_):
+        pass
+
+    @staticmethod
+    def _not_unique_error (id_, entities):
+        entities_message = ', '.join(
+            f'{type(e).type_id()}:{e.api_id}:{repr(str(e))}' for e in entities)
+        return NotUniqueError(
+            f'not unique: {repr(id_)} - matches: {entities_message}')
+
+    # the same as from_id without filters, using resolved IDs; returns None if
+    # they aren't stored for every entity type
+    def _from_resolved_id (self, entity_types, id_):
+        # [(entity_type, api_ids)]
+        matches = []
+        for entity_type in entity_types:
+            api_ids = self.resolved_ids(entity_type.type_id(), id_)
+            if api_ids is None:
+                return None
+            if api_ids:
+                matches.append((entity_type, api_ids))
+
+        if not matches:
+            raise KeyError(id_)
+        if len(matches) == 1 and len(matches[0][1]) == 1:
+            entity_type, (api_id,) = matches[0]
+            return self.from_api_id(entity_type, api_id)
+        # only the matching entities are built
+        entities = []
+        for entity_type, api_ids in matches:
+            entities.extend(self.from_api_ids(entity_type, api_ids))
+        raise self._not_unique_error(id_, entities)
+
+    @_instrumented
     def from_id (self, entity_types, id_, filters=util.Filters()):
         if inspect.isclass(entity_types):
             entity_types = (entity_types,)
 
+        if not filters:
+            entity = self._from_resolved_id(entity_types, id_)
+            if entity is not None:
+                return entity
+
         entities = []
         for entity_type in entity_types:
             try:
@@ -69,11 +509,7 @@ class Storage (abc.ABC):
         if len(filtered_entities) == 1:
             return filtered_entities[0]
         elif filtered_entities:
-            entities_message = ', '.join(
-                f'{type(e).type_id()}:{e.api_id}:{repr(str(e))}'
-                for e in filtered_entities)
-            raise KeyError(f'not unique: {repr(id_)} - matches: '
-                           f'{entities_message}')
+            raise self._not_unique_error(id_, filtered_entities)
         else:
             raise KeyError(id_)
 
@@ -82,134 +518,1151 @@ class Storage (abc.ABC):
         pass
 
 
-class FileStorage (Storage):
+# raised by Storage.from_id when more than one entity matches
+class NotUniqueError (KeyError):
+    pass
+
+
+class ReadOnlyError (ValueError):
+    pass
+
+
+class _KeyValueStorage (Storage):
+    # subclasses set _raw_db and _db to mappings from str keys to bytes values,
+    # behaving like dbm databases
     _SCHEMA_VERSION_KEY = 'meta:version'
+    _CODEC_KEY = 'meta:codec'
 
-    def __init__ (self, path=None):
-        if path is None:
-            default_cache_path = os.path.join(os.path.expanduser('~'), '.cache')
-            cache_path = os.environ.get('XDG_CACHE_HOME', default_cache_path)
-            self.path = os.path.join(cache_path, 'gw2buildutil')
+    # codec is used to encode stored data; data encoded by any codec can be
+    # read
+    def __init__ (self, entity_cache_size, codec, read_only=False):
+        Storage.__init__(self, entity_cache_size)
+        self._codec = codec
+        self.read_only = read_only
+        self._batch_depth = 0
+        # {key: set(api_ids)}
+        self._pending_ids = {}
+        # {key: set(ids)}, for _entity_ids_key
+        self._pending_entity_ids = {}
+        # {key: {name: set(refs)}}
+        self._pending_relations = {}
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close()
+
+    def _check_writable (self):
+        if self.read_only:
+            raise ReadOnlyError(f'{type(self).__name__} is read-only')
+
+    def _stored_codec_id (self):
+        if self._CODEC_KEY in self._raw_db:
+            return self._raw_db[self._CODEC_KEY].decode()
         else:
-            self.path = path
+            return JSON_CODEC.id_
 
-        os.makedirs(self.path, exist_ok=True)
-        self._raw_db = dbm.open(os.path.join(self.path, 'api-raw.db'), 'c')
+    def schema_version (self):
+        # stored data should be recreated if it uses a different codec
+        if (self._SCHEMA_VERSION_KEY in self._raw_db and
+            self._stored_codec_id() == self._codec.id_
+        ):
+            return self._raw_db[self._SCHEMA_VERSION_KEY].decode()
+        else:
+            return None
+
+    def _api_id_key (self, path, api_id):
+        return f'entity:{"/".join(path)}:{api_id}'
+
+    def exists_raw (self, path, api_id):
+        return self._api_id_key(path, api_id) in self._raw_db
+
+    @_instrumented
+    def raw (self, path, api_id):
+        return self._decode(self._raw_db[self._api_id_key(path, api_id)])
+
+    def _id_key (self, type_id, id_):
+        return f'{type_id}:id:{gw2util.Identified.normalise_id(id_)}'
+
+    def _load_ids (self, id_key):
+        if id_key in self._db:
+            return set(self._decode(self._db[id_key]))
+        else:
+            return set()
+
+    # reverse of _id_key: the IDs an entity is stored under
+    def _entity_ids_key (self, type_id, api_id):
+        return f'{type_id}:ids-of:{api_id}'
+
+    def _relations_key (self, type_id, api_id):
+        return f'{type_id}:relations:{api_id}'
+
+    def _load_relations (self, relations_key):
+        if relations_key in self._db:
+            data = self._decode(self._db[relations_key])
+        else:
+            data = {}
+        return {id_: set([(e_type_id, ref_api_id)
+                          for e_type_id, ref_api_id in refs])
+                for id_, refs in data.items()}
+
+    @staticmethod
+    def _merge_relations (all_relations, relations):
+        for id_, refs in relations.items():
+            all_relations.setdefault(id_, set()).update(
+                (e_type_id, ref_api_id) for e_type_id, ref_api_id in refs)
+
+    def _resolved_key (self, type_id, id_):
+        return f'{type_id}:resolved:{gw2util.Identified.normalise_id(id_)}'
+
+    def resolved_ids (self, type_id, id_):
+        resolved_key = self._resolved_key(type_id, id_)
+        if resolved_key in self._db:
+            return self._decode(self._db[resolved_key])
+        else:
+            return None
+
+    @_instrumented
+    def relations (self, entity_type, api_id):
+        relations_key = self._relations_key(entity_type.type_id(), api_id)
+        relations_data = self._load_relations(relations_key)
+        self._merge_relations(relations_data,
+                              self._pending_relations.get(relations_key, {}))
+        return self._relations_from_data(relations_data)
+
+    @_instrumented
+    def all_from_id (self, entity_type, id_):
+        id_key = self._id_key(entity_type.type_id(), id_)
+        api_ids = self._load_ids(id_key)
+        api_ids.update(self._pending_ids.get(id_key, ()))
+        if not api_ids:
+            raise KeyError(id_)
+        return self.from_api_ids(entity_type, api_ids)
+
+    def store_schema_version (self, version):
+        self._check_writable()
+        self._raw_db[self._SCHEMA_VERSION_KEY] = version
+        self._raw_db[self._CODEC_KEY] = self._codec.id_
+
+    def _meta_key (self, key):
+        return f'meta:{key}'
+
+    def store_meta (self, key, value):
+        self._check_writable()
+        meta_key = self._meta_key(key)
+        if value is not None:
+            self._raw_db[meta_key] = value
+        elif meta_key in self._raw_db:
+            del self._raw_db[meta_key]
+
+    def meta (self, key):
+        meta_key = self._meta_key(key)
+        if meta_key in self._raw_db:
+            return bytes(self._raw_db[meta_key]).decode()
+        else:
+            return None
+
+    def store_raw (self, path, result):
+        self._check_writable()
+        self._raw_db[self._api_id_key(path, result['id'])] = (
+            self._codec.encode(result))
+
+    def remove_raw (self, path, api_id):
+        self._check_writable()
+        key = self._api_id_key(path, api_id)
+        if key in self._raw_db:
+            del self._raw_db[key]
+
+    # remove all keys from _raw_db - subclasses should override if they can do
+    # better than deleting keys one by one
+    def _clear_raw_db (self):
+        for key in self._raw_db.keys():
+            del self._raw_db[key]
+
+    def clear_raw (self):
+        self._check_writable()
+        self.entity_cache.clear()
+        self._clear_raw_db()
+
+    def raw_api_ids (self, path):
+        prefix = self._api_id_key(path, '').encode()
+        for key in self._raw_db.keys():
+            if isinstance(key, str):
+                key = key.encode()
+            if key.startswith(prefix):
+                yield key[len(prefix):].decode()
+
+    @contextlib.contextmanager
+    def batch (self):
+        self._batch_depth += 1
         try:
-            self._db = dbm.open(os.path.join(self.path, 'api.db'), 'c')
-        except Exception:
-            self._raw_db.close()
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush()
+
+    def _flush (self):
+        pending_ids = self._pending_ids
+        pending_entity_ids = self._pending_entity_ids
+        pending_relations = self._pending_relations
+        self._pending_ids = {}
+        self._pending_entity_ids = {}
+        self._pending_relations = {}
+        for id_key, api_ids in pending_ids.items():
+            self._write_ids(id_key, api_ids)
+        for entity_ids_key, ids in pending_entity_ids.items():
+            self._write_ids(entity_ids_key, ids)
+        for relations_key, relations in pending_relations.items():
+            self._write_relations(relations_key, relations)
+
+    def _write_ids (self, id_key, api_ids):
+        data = self._load_ids(id_key)
+        data.update(api_ids)
+        self._db[id_key] = self._codec.encode(tuple(data))
+
+    def store_ids (self, type_id, id_, api_ids):
+        self._check_writable()
+        id_key = self._id_key(type_id, id_)
+        normalised_id = gw2util.Identified.normalise_id(id_)
+        if self._batch_depth > 0:
+            self._pending_ids.setdefault(id_key, set()).update(api_ids)
+            for api_id in api_ids:
+                self._pending_entity_ids.setdefault(
+                    self._entity_ids_key(type_id, api_id), set()
+                ).add(normalised_id)
+        else:
+            self._write_ids(id_key, api_ids)
+            for api_id in api_ids:
+                self._write_ids(self._entity_ids_key(type_id, api_id),
+                                (normalised_id,))
+        self._remove_resolved_ids(type_id, id_)
+
+    def entity_ids (self, type_id, api_id):
+        entity_ids_key = self._entity_ids_key(type_id, api_id)
+        ids = self._load_ids(entity_ids_key)
+        ids.update(self._pending_entity_ids.get(entity_ids_key, ()))
+        return ids
+
+    def remove_entity_ids (self, type_id, api_id):
+        self._check_writable()
+        # removal is rare, so just write anything pending first
+        self._flush()
+        entity_ids_key = self._entity_ids_key(type_id, api_id)
+        ids = self._load_ids(entity_ids_key)
+        for id_ in ids:
+            id_key = self._id_key(type_id, id_)
+            api_ids = {other_api_id for other_api_id in self._load_ids(id_key)
+                       if str(other_api_id) != str(api_id)}
+            if api_ids:
+                self._db[id_key] = self._codec.encode(tuple(api_ids))
+            elif id_key in self._db:
+                del self._db[id_key]
+            self._remove_resolved_ids(type_id, id_)
+        if entity_ids_key in self._db:
+            del self._db[entity_ids_key]
+        return ids
+
+    def _write_relations (self, relations_key, relations):
+        all_relations = self._load_relations(relations_key)
+        self._merge_relations(all_relations, relations)
+        data_out = {id_: list(refs) for id_, refs in all_relations.items()}
+        self._db[relations_key] = self._codec.encode(data_out)
+
+    def store_relations (self, type_id, api_id, relations):
+        self._check_writable()
+        relations_key = self._relations_key(type_id, api_id)
+        if self._batch_depth > 0:
+            self._merge_relations(
+                self._pending_relations.setdefault(relations_key, {}),
+                relations)
+        else:
+            self._write_relations(relations_key, relations)
+
+    def remove_relations (self, type_id, api_id, relations):
+        self._check_writable()
+        self._flush()
+        relations_key = self._relations_key(type_id, api_id)
+        all_relations = self._load_relations(relations_key)
+        for id_, refs in relations.items():
+            if id_ in all_relations:
+                all_relations[id_].difference_update(
+                    (e_type_id, ref_api_id) for e_type_id, ref_api_id in refs)
+                if not all_relations[id_]:
+                    del all_relations[id_]
+        if all_relations:
+            data_out = {id_: list(refs) for id_, refs in all_relations.items()}
+            self._db[relations_key] = self._codec.encode(data_out)
+        elif relations_key in self._db:
+            del self._db[relations_key]
+
+    def store_resolved_ids (self, type_id, id_, api_ids):
+        self._check_writable()
+        self._db[self._resolved_key(type_id, id_)] = (
+            self._codec.encode(list(api_ids)))
+
+    # resolved IDs are out of date once the index entry changes
+    def _remove_resolved_ids (self, type_id, id_):
+        resolved_key = self._resolved_key(type_id, id_)
+        if resolved_key in self._db:
+            del self._db[resolved_key]
+
+    def _clear_pending (self):
+        self._pending_ids.clear()
+        self._pending_entity_ids.clear()
+        self._pending_relations.clear()
+
+    # remove all keys from _db - as for _clear_raw_db
+    def _clear_db (self):
+        for key in self._db.keys():
+            del self._db[key]
+
+    def clear (self):
+        self._check_writable()
+        self.entity_cache.clear()
+        self._clear_pending()
+        self._clear_db()
+
+    # for rebuild_index: replace _db with a new, empty database, then either
+    # replace the previous database with it or discard it; subclasses should
+    # override these to keep the previous database readable meanwhile
+    def _stage_db (self):
+        self._clear_db()
+
+    def _commit_staged_db (self):
+        pass
+
+    def _discard_staged_db (self):
+        pass
+
+    @contextlib.contextmanager
+    def rebuild_index (self):
+        self._check_writable()
+        self.entity_cache.clear()
+        self._clear_pending()
+        self._stage_db()
+        try:
+            yield
+            self._flush()
+        except BaseException:
+            self._clear_pending()
+            self._discard_staged_db()
+            raise
+        else:
+            self._commit_staged_db()
+        finally:
+            # may have been built using the discarded index
+            self.entity_cache.clear()
+
+
+class FileStorage (_KeyValueStorage):
+    _RAW_DB_NAME = 'api-raw.db'
+    _DB_NAME = 'api.db'
+    # index being rebuilt, which replaces _DB_NAME when complete
+    _STAGED_DB_NAME = 'api-staged.db'
+
+    # read_only: never create or modify files, and don't lock the databases, so
+    #   that any number of processes can read at once
+    # snapshot_path: read from a file written by compile_snapshot instead of
+    #   the databases in path; implies read_only
+    def __init__ (self, path=None,
+                  entity_cache_size=DEFAULT_ENTITY_CACHE_SIZE,
+                  codec=JSON_CODEC, read_only=False, snapshot_path=None):
+        _KeyValueStorage.__init__(self, entity_cache_size, codec,
+                                  read_only or snapshot_path is not None)
+        self.path = _default_path() if path is None else path
+        self.snapshot_path = snapshot_path
+        self._mm = None
+
+        if snapshot_path is not None:
+            self._mm, self._raw_db, self._db = _open_snapshot(snapshot_path)
+        else:
+            if not self.read_only:
+                os.makedirs(self.path, exist_ok=True)
+            self._raw_db = self._open_db(self._RAW_DB_NAME)
+            try:
+                self._db = self._open_db(self._DB_NAME)
+            except Exception:
+                self._raw_db.close()
+                raise
+
+        if self.read_only:
+            # nothing is written, so use the codec of the stored data
+            self._codec = _CODECS.get(self._stored_codec_id(), codec)
+
+    def _open_db (self, name):
+        db_path = os.path.join(self.path, name)
+        if not self.read_only:
+            return dbm.open(db_path, 'c')
+
+        db_module_name = dbm.whichdb(db_path)
+        if db_module_name is None:
+            raise FileNotFoundError(f'database doesn\'t exist: {db_path}')
+        # gdbm takes a lock even when reading, unless asked not to
+        flag = 'ru' if db_module_name == 'dbm.gnu' else 'r'
+        return dbm.open(db_path, flag)
 
     def close (self):
+        if self._mm is not None:
+            self._mm.close()
+            return
         try:
             self._raw_db.close()
         finally:
             self._db.close()
 
+    # create a new, empty database, using the same implementation as an
+    # existing database, if any
+    def _new_db (self, name, like_name):
+        db_module_name = dbm.whichdb(os.path.join(self.path, like_name))
+        db_module = (importlib.import_module(db_module_name)
+                     if db_module_name else dbm)
+        return db_module.open(os.path.join(self.path, name), 'n')
+
+    # replace a database with a new, empty one, which takes constant time
+    # rather than time proportional to the number of keys; readers with the
+    # previous database open keep reading it
+    def _recreate_db (self, db, name):
+        db.close()
+        new_name = f'new-{name}'
+        self._new_db(new_name, name).close()
+        self._replace_db(new_name, name)
+        return self._open_db(name)
+
+    def _clear_raw_db (self):
+        self._raw_db = self._recreate_db(self._raw_db, self._RAW_DB_NAME)
+
+    def _clear_db (self):
+        self._db = self._recreate_db(self._db, self._DB_NAME)
+
+    # some dbm implementations use multiple files, named with suffixes
+    def _db_files (self, name):
+        return [file_name for file_name in os.listdir(self.path)
+                if file_name == name or file_name.startswith(f'{name}.')]
+
+    # replace database to_name with database from_name, which is closed, by
+    # renaming its files
+    def _replace_db (self, from_name, to_name):
+        old_file_names = set(self._db_files(to_name))
+        for file_name in self._db_files(from_name):
+            to_file_name = to_name + file_name[len(from_name):]
+            os.replace(os.path.join(self.path, file_name),
+                       os.path.join(self.path, to_file_name))
+            old_file_names.discard(to_file_name)
+        # files the new database doesn't have
+        for file_name in old_file_names:
+            os.remove(os.path.join(self.path, file_name))
+
+    # readers with the previous database open keep reading it, and new readers
+    # open the replacement
+    def _stage_db (self):
+        self._db.close()
+        self._db = self._new_db(self._STAGED_DB_NAME, self._DB_NAME)
+
+    def _commit_staged_db (self):
+        self._db.close()
+        self._replace_db(self._STAGED_DB_NAME, self._DB_NAME)
+        self._db = self._open_db(self._DB_NAME)
+
+    def _discard_staged_db (self):
+        self._db.close()
+        for file_name in self._db_files(self._STAGED_DB_NAME):
+            os.remove(os.path.join(self.path, file_name))
+        self._db = self._open_db(self._DB_NAME)
+
+
+class _MemoryDb (collections.abc.MutableMapping):
+    # dict with the same behaviour as a dbm database: keys and values are bytes,
+    # and str keys and values are encoded
+    def __init__ (self):
+        self._data = {}
+
+    @staticmethod
+    def _bytes (s):
+        return s.encode() if isinstance(s, str) else s
+
+    def __getitem__ (self, key):
+        return self._data[self._bytes(key)]
+
+    def __setitem__ (self, key, value):
+        self._data[self._bytes(key)] = self._bytes(value)
+
+    def __delitem__ (self, key):
+        del self._data[self._bytes(key)]
+
+    def __contains__ (self, key):
+        return self._bytes(key) in self._data
+
+    def __iter__ (self):
+        return iter(self._data)
+
+    def __len__ (self):
+        return len(self._data)
+
+    def clear (self):
+        self._data.clear()
+
+
+def _copy_db (src_db, dest_db):
+    for key in src_db.keys():
+        dest_db[key] = src_db[key]
+
+
+# storage held entirely in memory, which can be loaded from and saved to a
+# FileStorage
+class MemoryStorage (_KeyValueStorage):
+    def __init__ (self, entity_cache_size=DEFAULT_ENTITY_CACHE_SIZE,
+                  codec=JSON_CODEC):
+        _KeyValueStorage.__init__(self, entity_cache_size, codec)
+        self._raw_db = _MemoryDb()
+        self._db = _MemoryDb()
+
+    def close (self):
+        pass
+
+    def _clear_raw_db (self):
+        self._raw_db.clear()
+
+    def _clear_db (self):
+        self._db.clear()
+
+    def _stage_db (self):
+        self._previous_db = self._db
+        self._db = _MemoryDb()
+
+    def _commit_staged_db (self):
+        self._previous_db = None
+
+    def _discard_staged_db (self):
+        self._db = self._previous_db
+        self._previous_db = None
+
+    # replace all data with the data in another storage (FileStorage,
+    # MemoryStorage or SnapshotStorage)
+    def load (self, storage):
+        self.clear_raw()
+        self.clear()
+        _copy_db(storage._raw_db, self._raw_db)
+        _copy_db(storage._db, self._db)
+
+    # replace all data in a FileStorage or MemoryStorage with the data in this
+    # storage
+    def save (self, storage):
+        storage.clear_raw()
+        storage.clear()
+        _copy_db(self._raw_db, storage._raw_db)
+        _copy_db(self._db, storage._db)
+
+
+# snapshot file layout (all integers little-endian):
+# - header: magic, format version, then for each table: entries offset, number
+#   of entries
+# - keys and values, packed
+# - for each table: entries sorted by key: key offset, key size, value offset,
+#   value size
+_SNAPSHOT_MAGIC = b'GW2BSNAP'
+_SNAPSHOT_VERSION = 1
+# raw, index
+_SNAPSHOT_NUM_TABLES = 2
+_SNAPSHOT_HEADER = struct.Struct(
+    '<8sI' + 'QQ' * _SNAPSHOT_NUM_TABLES)
+_SNAPSHOT_ENTRY = struct.Struct('<QIQI')
+
+
+# write the contents of a FileStorage or MemoryStorage to a snapshot file, to be
+# read by SnapshotStorage; the file is replaced atomically
+def compile_snapshot (storage, path):
+    if not isinstance(storage, _KeyValueStorage):
+        raise TypeError(
+            f'can\'t compile a snapshot of {type(storage).__name__}')
+    # include index writes deferred by a batch
+    storage._flush()
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * _SNAPSHOT_HEADER.size)
+        tables = []
+        for db in (storage._raw_db, storage._db):
+            entries = []
+            for key in sorted(k if isinstance(k, bytes) else k.encode()
+                              for k in db.keys()):
+                value = db[key]
+                key_offset = f.tell()
+                f.write(key)
+                value_offset = f.tell()
+                f.write(value)
+                entries.append((key_offset, len(key), value_offset, len(value)))
+            tables.append(entries)
+
+        table_positions = []
+        for entries in tables:
+            table_positions.extend((f.tell(), len(entries)))
+            for entry in entries:
+                f.write(_SNAPSHOT_ENTRY.pack(*entry))
+
+        f.seek(0)
+        f.write(_SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, *table_positions))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class _SnapshotTable (collections.abc.Mapping):
+    def __init__ (self, mm, entries_offset, num_entries):
+        self._mm = mm
+        self._entries_offset = entries_offset
+        self._num_entries = num_entries
+
+    def _entry (self, index):
+        return _SNAPSHOT_ENTRY.unpack_from(
+            self._mm, self._entries_offset + index * _SNAPSHOT_ENTRY.size)
+
+    def _key (self, entry):
+        key_offset, key_size, value_offset, value_size = entry
+        return self._mm[key_offset:key_offset + key_size]
+
+    def _find (self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        low = 0
+        high = self._num_entries
+        while low < high:
+            mid = (low + high) // 2
+            entry = self._entry(mid)
+            entry_key = self._key(entry)
+            if entry_key < key:
+                low = mid + 1
+            elif entry_key > key:
+                high = mid
+            else:
+                return entry
+        return None
+
+    def __getitem__ (self, key):
+        entry = self._find(key)
+        if entry is None:
+            raise KeyError(key)
+        key_offset, key_size, value_offset, value_size = entry
+        return self._mm[value_offset:value_offset + value_size]
+
+    def __contains__ (self, key):
+        return self._find(key) is not None
+
+    def __iter__ (self):
+        for index in range(self._num_entries):
+            yield self._key(self._entry(index))
+
+    def __len__ (self):
+        return self._num_entries
+
+
+# returns (mmap, raw_table, table)
+def _open_snapshot (path):
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        magic, version, *table_positions = _SNAPSHOT_HEADER.unpack_from(mm)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError(f'not a snapshot file: {path}')
+        if version != _SNAPSHOT_VERSION:
+            raise ValueError(f'unsupported snapshot version: {version}')
+    except Exception:
+        mm.close()
+        raise
+
+    raw_table, table = [_SnapshotTable(mm, *table_positions[i:i + 2])
+                        for i in range(0, len(table_positions), 2)]
+    return (mm, raw_table, table)
+
+
+# read-only storage backed by a memory-mapped snapshot file, which may be
+# shared between processes
+class SnapshotStorage (_KeyValueStorage):
+    def __init__ (self, path, entity_cache_size=DEFAULT_ENTITY_CACHE_SIZE):
+        # codec is replaced after opening, with the one used by the data
+        _KeyValueStorage.__init__(self, entity_cache_size, JSON_CODEC,
+                                  read_only=True)
+        self.path = path
+        self._mm, self._raw_db, self._db = _open_snapshot(path)
+        self._codec = _CODECS.get(self._stored_codec_id(), JSON_CODEC)
+
+    def close (self):
+        self._mm.close()
+
+
+_WARM_PACK_VERSION = 1
+
+
+# write built entities and their indexes to a file in a form that can be loaded
+# quickly by WarmPackStorage
+# entities: iterable of entities
+# ids: {(entity_type, id_): api_ids}, as stored using Storage.store_ids
+# resolved_ids: {(entity_type, id_): api_ids}, as stored using
+#   Storage.store_resolved_ids
+# the file is replaced atomically
+def write_warm_pack (path, schema_version, entities, ids, resolved_ids):
+    data = {
+        'version': _WARM_PACK_VERSION,
+        'schema version': schema_version,
+        'entities': {(type(entity).type_id(), str(entity.api_id)): entity
+                     for entity in entities},
+        'ids': {(entity_type.type_id(), gw2util.Identified.normalise_id(id_)):
+                tuple(api_ids)
+                for (entity_type, id_), api_ids in ids.items()},
+        'resolved ids': {
+            (entity_type.type_id(), gw2util.Identified.normalise_id(id_)):
+            list(api_ids)
+            for (entity_type, id_), api_ids in resolved_ids.items()},
+    }
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# read-only storage serving already-built entities from a file written by
+# write_warm_pack, which is loaded in one read
+# storage: if given, used for anything not in the warm pack, including raw
+#   results and relations
+class WarmPackStorage (Storage):
+    def __init__ (self, path, storage=None):
+        # entities are already built, so there's nothing to cache
+        Storage.__init__(self, 0)
+        self.path = path
+        self._storage = storage
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data['version'] != _WARM_PACK_VERSION:
+            raise ValueError(f'unsupported warm pack version: '
+                             f'{data["version"]}')
+        self._schema_version = data['schema version']
+        self._entities = data['entities']
+        self._ids = data['ids']
+        self._resolved_ids = data['resolved ids']
+
+    def close (self):
+        pass
+
     def __enter__ (self):
         return self
 
     def __exit__ (self, *args):
         self.close()
 
+    def _read_only_error (self):
+        return ReadOnlyError(f'{type(self).__name__} is read-only')
+
     def store_schema_version (self, version):
-        self._raw_db[self._SCHEMA_VERSION_KEY] = version
+        raise self._read_only_error()
 
     def schema_version (self):
-        if self._SCHEMA_VERSION_KEY in self._raw_db:
-            return self._raw_db[self._SCHEMA_VERSION_KEY].decode()
-        else:
-            return None
+        return self._schema_version
 
-    def _api_id_key (self, path, api_id):
-        return f'entity:{"/".join(path)}:{api_id}'
+    def store_meta (self, key, value):
+        raise self._read_only_error()
+
+    def meta (self, key):
+        if self._storage is None:
+            return None
+        return self._storage.meta(key)
 
     def store_raw (self, path, result):
-        self._raw_db[self._api_id_key(path, result['id'])] = json.dumps(result)
+        raise self._read_only_error()
 
     def exists_raw (self, path, api_id):
-        return self._api_id_key(path, api_id) in self._raw_db
+        return (self._storage is not None and
+                self._storage.exists_raw(path, api_id))
 
     def raw (self, path, api_id):
-        return json.loads(self._raw_db[self._api_id_key(path, api_id)])
+        if self._storage is None:
+            raise KeyError(api_id)
+        return self._storage.raw(path, api_id)
+
+    def raw_many (self, path, api_ids):
+        if self._storage is None:
+            raise KeyError(api_ids)
+        return self._storage.raw_many(path, api_ids)
+
+    def remove_raw (self, path, api_id):
+        raise self._read_only_error()
 
     def clear_raw (self):
-        for key in self._raw_db.keys():
-            del self._raw_db[key]
+        raise self._read_only_error()
 
-    def _id_key (self, entity_type, id_):
-        return (f'{entity_type.type_id()}:'
-                f'id:{gw2util.Identified.normalise_id(id_)}')
+    def raw_api_ids (self, path):
+        if self._storage is None:
+            return iter(())
+        return self._storage.raw_api_ids(path)
 
-    def _store (self, entity_type, api_id, ids):
-        for id_ in ids:
-            id_key = self._id_key(entity_type, id_)
-            if id_key in self._db:
-                data = json.loads(self._db[id_key])
-            else:
-                data = []
-            data.append(api_id)
-            self._db[id_key] = json.dumps(tuple(set(data)))
+    def store_ids (self, type_id, id_, api_ids):
+        raise self._read_only_error()
 
-    def _relations_key (self, entity_type, api_id):
-        return (f'{entity_type.type_id()}:relations:{api_id}')
+    def entity_ids (self, type_id, api_id):
+        entity = self._entities.get((type_id, str(api_id)))
+        if entity is not None:
+            return {gw2util.Identified.normalise_id(id_) for id_ in entity.ids}
+        if self._storage is None:
+            return set()
+        return self._storage.entity_ids(type_id, api_id)
 
-    def _store_relations (self, entity_type, api_id, dest_entity, ids):
-        relations_key = self._relations_key(entity_type, api_id)
-        dest_entity_ref = (type(dest_entity).type_id(), dest_entity.api_id)
-        if relations_key in self._db:
-            data = json.loads(self._db[relations_key])
-        else:
-            data = {}
-        relations = {id_: set([(e_type_id, ref_api_id)
-                               for e_type_id, ref_api_id in refs])
-                     for id_, refs in data.items()}
-        for id_ in ids:
-            relations.setdefault(id_, set()).add(dest_entity_ref)
-        data_out = {id_: list(refs) for id_, refs in relations.items()}
-        self._db[relations_key] = json.dumps(data_out)
+    def remove_entity_ids (self, type_id, api_id):
+        raise self._read_only_error()
 
-    def store (self, entity):
-        self._store(type(entity), entity.api_id, entity.ids)
+    def store_relations (self, type_id, api_id, relations):
+        raise self._read_only_error()
 
-        for (other_type, other_api_id), relation_ids \
-            in entity.extra_entity_relations().items() \
-        :
-            self._store_relations(
-                other_type, other_api_id, entity, relation_ids)
+    def remove_relations (self, type_id, api_id, relations):
+        raise self._read_only_error()
 
     def relations (self, entity_type, api_id):
-        relations_key = self._relations_key(entity_type, api_id)
-        if relations_key in self._db:
-            relations_data = json.loads(self._db[relations_key])
+        if self._storage is None:
+            return util.Relations({})
+        return self._storage.relations(entity_type, api_id)
+
+    @_instrumented
+    def from_api_id (self, entity_type, api_id, crawler=None):
+        try:
+            return self._entities[(entity_type.type_id(), str(api_id))]
+        except KeyError:
+            if self._storage is None:
+                raise
+        return self._storage.from_api_id(entity_type, api_id, crawler)
+
+    @_instrumented
+    def from_api_ids (self, entity_type, api_ids, crawler=None):
+        return [self.from_api_id(entity_type, api_id, crawler)
+                for api_id in api_ids]
+
+    @_instrumented
+    def all_from_id (self, entity_type, id_):
+        key = (entity_type.type_id(), gw2util.Identified.normalise_id(id_))
+        try:
+            api_ids = self._ids[key]
+        except KeyError:
+            if self._storage is None:
+                raise
+            return self._storage.all_from_id(entity_type, id_)
+        return self.from_api_ids(entity_type, api_ids)
+
+    def store_resolved_ids (self, type_id, id_, api_ids):
+        raise self._read_only_error()
+
+    def resolved_ids (self, type_id, id_):
+        key = (type_id, gw2util.Identified.normalise_id(id_))
+        api_ids = self._resolved_ids.get(key)
+        if api_ids is None and self._storage is not None:
+            return self._storage.resolved_ids(type_id, id_)
+        return api_ids
+
+    def rebuild_index (self):
+        raise self._read_only_error()
+
+    def clear (self):
+        raise self._read_only_error()
+
+
+class SqliteStorage (Storage):
+    _SCHEMA_VERSION_KEY = 'version'
+    _CODEC_KEY = 'codec'
+    _MAX_QUERY_PARAMS = 999
+
+    _SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID""",
+        # api_id is stored as text, for consistency with other storage
+        # implementations; data is text or a blob, depending on the codec
+        """CREATE TABLE IF NOT EXISTS raw (
+            path TEXT NOT NULL,
+            api_id TEXT NOT NULL,
+            data NOT NULL,
+            PRIMARY KEY (path, api_id)
+        ) WITHOUT ROWID""",
+        # other api_id columns have no type, so that integer/string API IDs are
+        # returned as they were stored; they're compared as text
+        """CREATE TABLE IF NOT EXISTS ids (
+            type_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            api_id NOT NULL,
+            PRIMARY KEY (type_id, id, api_id)
+        ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS ids_api_id
+            ON ids (type_id, CAST(api_id AS TEXT))""",
+        """CREATE TABLE IF NOT EXISTS relations (
+            type_id TEXT NOT NULL,
+            api_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            rel_type_id TEXT NOT NULL,
+            rel_api_id NOT NULL,
+            PRIMARY KEY (type_id, api_id, name, rel_type_id, rel_api_id)
+        ) WITHOUT ROWID""",
+        # api_ids is encoded by the codec
+        """CREATE TABLE IF NOT EXISTS resolved (
+            type_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            api_ids NOT NULL,
+            PRIMARY KEY (type_id, id)
+        ) WITHOUT ROWID""",
+    )
+
+    # codec is used to encode stored raw results; data encoded by any codec can
+    # be read
+    def __init__ (self, path=None,
+                  entity_cache_size=DEFAULT_ENTITY_CACHE_SIZE,
+                  codec=JSON_CODEC):
+        Storage.__init__(self, entity_cache_size)
+        self._codec = codec
+        if path is None:
+            default_path = _default_path()
+            os.makedirs(default_path, exist_ok=True)
+            self.path = os.path.join(default_path, 'api.sqlite')
         else:
-            relations_data = {}
-        return util.Relations({
-            name: [util.Relation(e_type_id, api_id)
-                   for e_type_id, api_id in rs]
-            for name, rs in relations_data.items()})
+            self.path = path
+
+        # autocommit unless a transaction is explicitly started
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            # allows readers in other processes while writing
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            for statement in self._SCHEMA:
+                self._db.execute(statement)
+        except Exception:
+            self._db.close()
+            raise
+
+    def close (self):
+        self._db.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close()
+
+    @contextlib.contextmanager
+    def _transaction (self):
+        if self._db.in_transaction:
+            yield
+            return
+        self._db.execute('BEGIN')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        else:
+            self._db.execute('COMMIT')
+
+    def batch (self):
+        return self._transaction()
 
+    # other connections see the previous index until the transaction commits
+    @contextlib.contextmanager
+    def rebuild_index (self):
+        try:
+            with self._transaction():
+                self.clear()
+                yield
+        finally:
+            self.entity_cache.clear()
+
+    def store_meta (self, key, value):
+        if value is None:
+            self._db.execute('DELETE FROM meta WHERE key = ?', (key,))
+        else:
+            self._db.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                (key, value))
+
+    def meta (self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?',
+                               (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def store_schema_version (self, version):
+        with self._transaction():
+            self.store_meta(self._SCHEMA_VERSION_KEY, version)
+            self.store_meta(self._CODEC_KEY, self._codec.id_)
+
+    def schema_version (self):
+        # stored data should be recreated if it uses a different codec
+        if (self.meta(self._CODEC_KEY) or JSON_CODEC.id_) != self._codec.id_:
+            return None
+        return self.meta(self._SCHEMA_VERSION_KEY)
+
+    def store_raw (self, path, result):
+        self._db.execute(
+            'INSERT OR REPLACE INTO raw (path, api_id, data) VALUES (?, ?, ?)',
+            ('/'.join(path), str(result['id']), self._codec.encode(result)))
+
+    def exists_raw (self, path, api_id):
+        row = self._db.execute(
+            'SELECT 1 FROM raw WHERE path = ? AND api_id = ?',
+            ('/'.join(path), str(api_id))).fetchone()
+        return row is not None
+
+    @_instrumented
+    def raw (self, path, api_id):
+        row = self._db.execute(
+            'SELECT data FROM raw WHERE path = ? AND api_id = ?',
+            ('/'.join(path), str(api_id))).fetchone()
+        if row is None:
+            raise KeyError(api_id)
+        return self._decode(row[0])
+
+    @_instrumented
+    def raw_many (self, path, api_ids):
+        api_ids = [str(api_id) for api_id in api_ids]
+        data_by_api_id = {}
+        # stay under the limit on the number of query parameters
+        for i in range(0, len(api_ids), self._MAX_QUERY_PARAMS - 1):
+            chunk = api_ids[i:i + self._MAX_QUERY_PARAMS - 1]
+            placeholders = ', '.join('?' * len(chunk))
+            data_by_api_id.update(self._db.execute(
+                'SELECT api_id, data FROM raw '
+                f'WHERE path = ? AND api_id IN ({placeholders})',
+                ['/'.join(path)] + chunk))
+        return [self._decode(data_by_api_id[api_id]) for api_id in api_ids]
+
+    def remove_raw (self, path, api_id):
+        self._db.execute('DELETE FROM raw WHERE path = ? AND api_id = ?',
+                         ('/'.join(path), str(api_id)))
+
+    def clear_raw (self):
+        self.entity_cache.clear()
+        with self._transaction():
+            self._db.execute('DELETE FROM raw')
+            self._db.execute('DELETE FROM meta')
+
+    def raw_api_ids (self, path):
+        for (api_id,) in self._db.execute(
+            'SELECT api_id FROM raw WHERE path = ?', ('/'.join(path),)
+        ):
+            yield api_id
+
+    def store_ids (self, type_id, id_, api_ids):
+        id_ = gw2util.Identified.normalise_id(id_)
+        self._db.executemany(
+            'INSERT OR IGNORE INTO ids (type_id, id, api_id) VALUES (?, ?, ?)',
+            [(type_id, id_, api_id) for api_id in api_ids])
+        # resolved IDs are out of date once the index entry changes
+        self._db.execute('DELETE FROM resolved WHERE type_id = ? AND id = ?',
+                         (type_id, id_))
+
+    def entity_ids (self, type_id, api_id):
+        return {id_ for (id_,) in self._db.execute(
+            'SELECT id FROM ids '
+            'WHERE type_id = ? AND CAST(api_id AS TEXT) = ?',
+            (type_id, str(api_id)))}
+
+    def remove_entity_ids (self, type_id, api_id):
+        with self._transaction():
+            ids = self.entity_ids(type_id, api_id)
+            self._db.execute(
+                'DELETE FROM ids WHERE type_id = ? AND CAST(api_id AS TEXT) = ?',
+                (type_id, str(api_id)))
+            self._db.executemany(
+                'DELETE FROM resolved WHERE type_id = ? AND id = ?',
+                [(type_id, id_) for id_ in ids])
+        return ids
+
+    def store_relations (self, type_id, api_id, relations):
+        self._db.executemany(
+            'INSERT OR IGNORE INTO relations '
+            '(type_id, api_id, name, rel_type_id, rel_api_id) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(type_id, str(api_id), name, rel_type_id, rel_api_id)
+             for name, refs in relations.items()
+             for rel_type_id, rel_api_id in refs])
+
+    def remove_relations (self, type_id, api_id, relations):
+        self._db.executemany(
+            'DELETE FROM relations WHERE type_id = ? AND api_id = ? AND '
+            'name = ? AND rel_type_id = ? AND rel_api_id = ?',
+            [(type_id, str(api_id), name, rel_type_id, rel_api_id)
+             for name, refs in relations.items()
+             for rel_type_id, rel_api_id in refs])
+
+    @_instrumented
+    def relations (self, entity_type, api_id):
+        relations_data = {}
+        for name, rel_type_id, rel_api_id in self._db.execute(
+            'SELECT name, rel_type_id, rel_api_id FROM relations '
+            'WHERE type_id = ? AND api_id = ?',
+            (entity_type.type_id(), str(api_id)),
+        ):
+            relations_data.setdefault(name, []).append(
+                (rel_type_id, rel_api_id))
+        return self._relations_from_data(relations_data)
+
+    @_instrumented
     def all_from_id (self, entity_type, id_):
-        key = self._id_key(entity_type, id_)
-        api_ids = json.loads(self._db[key])
-        return [self.from_api_id(entity_type, api_id) for api_id in api_ids]
+        api_ids = [api_id for (api_id,) in self._db.execute(
+            'SELECT api_id FROM ids WHERE type_id = ? AND id = ?',
+            (entity_type.type_id(), gw2util.Identified.normalise_id(id_)))]
+        if not api_ids:
+            raise KeyError(id_)
+        return self.from_api_ids(entity_type, api_ids)
+
+    def store_resolved_ids (self, type_id, id_, api_ids):
+        self._db.execute(
+            'INSERT OR REPLACE INTO resolved (type_id, id, api_ids) '
+            'VALUES (?, ?, ?)',
+            (type_id, gw2util.Identified.normalise_id(id_),
+             self._codec.encode(list(api_ids))))
+
+    def resolved_ids (self, type_id, id_):
+        row = self._db.execute(
+            'SELECT api_ids FROM resolved WHERE type_id = ? AND id = ?',
+            (type_id, gw2util.Identified.normalise_id(id_))).fetchone()
+        return None if row is None else self._decode(row[0])
 
     def clear (self):
-        for key in self._db.keys():
-            del self._db[key]
+        self.entity_cache.clear()
+        with self._transaction():
+            self._db.execute('DELETE FROM ids')
+            self._db.execute('DELETE FROM relations')
+            self._db.execute('DELETE FROM resolved')
 
 
 class CrawlingStorage (Storage):
     def __init__ (self, storage, crawler):
+        Storage.__init__(self)
+        # share the cache, since built entities don't depend on the storage
+        # used to build them
+        self.entity_cache = storage.entity_cache
         self._storage = storage
         self._crawler = crawler
 
+    # shared with the wrapped storage
+    @property
+    def stats (self):
+        return self._storage.stats
+
+    @stats.setter
+    def stats (self, stats):
+        self._storage.stats = stats
+
     def store_schema_version (self, version):
         self._storage.store_schema_version(version)
 
     def schema_version (self):
         return self._storage.schema_version()
 
+    def store_meta (self, key, value):
+        self._storage.store_meta(key, value)
+
+    def meta (self, key):
+        return self._storage.meta(key)
+
     def store_raw (self, path, result):
         self._storage.store_raw(path, result)
 
@@ -220,11 +1673,41 @@ class CrawlingStorage (Storage):
         self._crawler.crawl_raw(path, (api_id,))
         return self._storage.raw(path, api_id)
 
+    def raw_many (self, path, api_ids):
+        api_ids = list(api_ids)
+        # fetches all missing results together
+        self._crawler.crawl_raw(path, api_ids)
+        return self._storage.raw_many(path, api_ids)
+
+    def remove_raw (self, path, api_id):
+        self._storage.remove_raw(path, api_id)
+
     def clear_raw (self):
         self._storage.clear_raw()
 
-    def store (self, entity):
-        self._storage.store(entity)
+    def raw_api_ids (self, path):
+        return self._storage.raw_api_ids(path)
+
+    def batch (self):
+        return self._storage.batch()
+
+    def rebuild_index (self):
+        return self._storage.rebuild_index()
+
+    def store_ids (self, type_id, id_, api_ids):
+        self._storage.store_ids(type_id, id_, api_ids)
+
+    def entity_ids (self, type_id, api_id):
+        return self._storage.entity_ids(type_id, api_id)
+
+    def remove_entity_ids (self, type_id, api_id):
+        return self._storage.remove_entity_ids(type_id, api_id)
+
+    def store_relations (self, type_id, api_id, relations):
+        self._storage.store_relations(type_id, api_id, relations)
+
+    def remove_relations (self, type_id, api_id, relations):
+        self._storage.remove_relations(type_id, api_id, relations)
 
     def relations (self, entity_type, api_id):
         return self._storage.relations(entity_type, api_id)
@@ -232,5 +1715,11 @@ class CrawlingStorage (Storage):
     def all_from_id (self, entity_type, id_):
         return self._storage.all_from_id(entity_type, id_)
 
+    def store_resolved_ids (self, type_id, id_, api_ids):
+        self._storage.store_resolved_ids(type_id, id_, api_ids)
+
+    def resolved_ids (self, type_id, id_):
+        return self._storage.resolved_ids(type_id, id_)
+
     def clear (self):
         self._storage.clear()
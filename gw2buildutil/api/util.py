@@ -30,6 +30,9 @@ class Filters:
             return NotImplemented
         return Filters(self._filters + other._filters)
 
+    def __len__ (self):
+        return len(self._filters)
+
     def filter_ (self, entities):
         for filter_ in self._filters:
             if len(entities) <= 1:
@@ -72,8 +75,9 @@ class Relations:
             return None
 
     def entities_raw (self, name, entity_type, storage):
-        for relation in self.all_matching(name, entity_type):
-            yield relation.entity_raw(entity_type, storage)
+        api_ids = [relation.api_id
+                   for relation in self.all_matching(name, entity_type)]
+        yield from storage.raw_many(entity_type.path(), api_ids)
 
     def entity_raw (self, name, entity_type, storage):
         relation = self.matching(name, entity_type)
@@ -81,8 +85,9 @@ class Relations:
             return relation.entity_raw(entity_type, storage)
 
     def entities (self, name, entity_type, storage, crawler=None):
-        for relation in self.all_matching(name, entity_type):
-            yield relation.entity(entity_type, storage, crawler)
+        api_ids = [relation.api_id
+                   for relation in self.all_matching(name, entity_type)]
+        yield from storage.from_api_ids(entity_type, api_ids, crawler)
 
     def entity (self, name, entity_type, storage, crawler=None):
         relation = self.matching(name, entity_type)
@@ -12,7 +12,7 @@ setuptools.setup(
     long_description=readme_text,
     long_description_content_type='text/markdown',
     url='http://ikn.org.uk/lib/gw2buildutil',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=('tests', 'tests.*')),
     classifiers=[
         "Programming Language :: Python :: 3.7",
         "License :: OSI Approved :: BSD License",
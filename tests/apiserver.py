@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import http.server
+import json
+import threading
+import urllib.parse
+import zlib
+
+from . import fakeapi
+
+
+_COMPRESS = {'gzip': gzip.compress, 'deflate': zlib.compress}
+
+
+class _Handler (http.server.BaseHTTPRequestHandler):
+    # keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message (self, format_, *args):
+        pass
+
+    def _send (self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json (self, status, data, headers={}):
+        body = json.dumps(data).encode('utf-8')
+        headers = {'Content-Type': 'application/json', **headers}
+        if status == 200:
+            headers['ETag'] = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                self._send(304, b'', {'ETag': headers['ETag']})
+                return
+        encoding = self.server.api.content_encoding
+        if (encoding is not None and
+            encoding in self.headers.get('Accept-Encoding', '')):
+            body = _COMPRESS[encoding](body)
+            headers['Content-Encoding'] = encoding
+        self._send(status, body, headers)
+
+    def do_GET (self):
+        api = self.server.api
+        url = urllib.parse.urlsplit(self.path)
+        path = tuple(part for part in url.path.split('/')[2:] if part)
+        query = urllib.parse.parse_qs(url.query)
+        api.requests.append(self.path)
+        failure = None
+        with api.lock:
+            if api.failures.get(path):
+                failure = api.failures[path].pop(0)
+
+        if isinstance(failure, int):
+            self._send(failure, b'{}', {'Content-Type': 'application/json',
+                                        'Retry-After': '0'})
+        elif failure is not None:
+            self.wfile.write(failure)
+            self.close_connection = True
+        elif path in api.raw_responses:
+            self.wfile.write(api.raw_responses[path])
+            self.close_connection = True
+        elif path not in api.data:
+            self._send_json(404, {'text': 'no such endpoint'})
+        elif 'ids' in query:
+            # in a consistent order, as for the API
+            api_ids = set(query['ids'][0].split(','))
+            self._send_json(200, [result for result in api.data[path]
+                                  if str(result['id']) in api_ids])
+        elif 'page' in query:
+            page = int(query['page'][0])
+            page_size = int(query['page_size'][0])
+            results = api.data[path]
+            page_total = max(1, -(-len(results) // page_size))
+            if page >= page_total:
+                self._send_json(400, {'text': 'page out of range'})
+            else:
+                start = page * page_size
+                self._send_json(200, results[start:start + page_size],
+                                {'X-Page-Total': str(page_total)})
+        else:
+            self._send_json(200, [result['id'] for result in api.data[path]])
+
+
+# serves data over HTTP in the same way as the API, on a local port, while used
+# as a context manager
+# raw_responses: {path: bytes}, sent instead of the response to any request for
+#   path
+# content_encoding: 'gzip' or 'deflate' to compress responses with, if the
+#   request accepts it
+# failures: {path: responses}, sent instead of the response to the first
+#   requests for path, in order; each is an error status, sent with
+#   Retry-After: 0, or bytes sent before closing the connection
+class ApiServer:
+    def __init__ (self, data=fakeapi.DATA, raw_responses={},
+                  content_encoding=None, failures={}):
+        self.data = data
+        self.raw_responses = raw_responses
+        self.content_encoding = content_encoding
+        self.failures = {path: list(responses)
+                         for path, responses in failures.items()}
+        self.lock = threading.Lock()
+        # request targets, in the order received
+        self.requests = []
+        self._server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), _Handler)
+        self._server.api = self
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}/v2'
+
+    def __enter__ (self):
+        # poll often, so shutting down is quick
+        threading.Thread(target=self._server.serve_forever, args=(.01,),
+                         daemon=True).start()
+        return self
+
+    def __exit__ (self, *args):
+        self._server.shutdown()
+        self._server.server_close()
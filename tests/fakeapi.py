@@ -0,0 +1,222 @@
+import copy
+
+from gw2buildutil.api import entity as gw2entity, fakeclient
+from gw2buildutil.api import storage as gw2storage
+
+
+def _weapon (skills, flags=('Mainhand',)):
+    return {'flags': list(flags), 'skills': skills}
+
+
+def _skill (id_, name, type_, slot, profession, **fields):
+    return {'id': id_, 'name': name, 'type': type_, 'slot': slot,
+            'professions': [profession], 'description': 'x', **fields}
+
+
+# a small API dataset covering every builtin entity type
+DATA = {
+    ('professions',): [
+        {'id': 'Guardian', 'name': 'Guardian', 'code': 1,
+         'skills_by_palette': [[4, 10], [5, 11]],
+         'weapons': {
+            'Sword': _weapon([{'id': 100, 'slot': 'Weapon_1'},
+                              {'id': 101, 'slot': 'Weapon_2'}]),
+            'Greatsword': _weapon([{'id': 102, 'slot': 'Weapon_1'}],
+                                  ('TwoHand',)),
+         }},
+        {'id': 'Engineer', 'name': 'Engineer', 'code': 3,
+         'skills_by_palette': [[7, 20]],
+         'weapons': {
+            'Pistol': _weapon([{'id': 200, 'slot': 'Weapon_1'}]),
+         }},
+        {'id': 'Revenant', 'name': 'Revenant', 'code': 9,
+         'skills_by_palette': [],
+         'weapons': {
+            'Staff': _weapon([{'id': 300, 'slot': 'Weapon_1'}], ('TwoHand',)),
+         }},
+    ],
+    ('specializations',): [
+        {'id': 27, 'name': 'Dragonhunter', 'profession': 'Guardian',
+         'elite': True},
+        {'id': 16, 'name': 'Zeal', 'profession': 'Guardian', 'elite': False},
+        {'id': 43, 'name': 'Scrapper', 'profession': 'Engineer',
+         'elite': False},
+    ],
+    ('skills',): [
+        _skill(100, 'Strike', 'Weapon', 'Weapon_1', 'Guardian',
+               weapon_type='Sword', next_chain=103),
+        _skill(103, 'Vengeful Strike', 'Weapon', 'Weapon_1', 'Guardian',
+               weapon_type='Sword', prev_chain=100),
+        _skill(101, 'Flashing Blade', 'Weapon', 'Weapon_2', 'Guardian',
+               weapon_type='Sword'),
+        _skill(102, 'Strike', 'Weapon', 'Weapon_1', 'Guardian',
+               weapon_type='Greatsword'),
+        _skill(10, 'Shelter', 'Heal', 'Heal', 'Guardian'),
+        _skill(11, '"Hold the Line!"', 'Utility', 'Utility', 'Guardian'),
+        _skill(13, 'Spear of Justice', 'Profession', 'Profession_1',
+               'Guardian', specialization=27),
+        _skill(20, 'Elixir Gun', 'Utility', 'Utility', 'Engineer',
+               bundle_skills=[21, 22], toolbelt_skill=23),
+        _skill(21, 'Tranquilizer Dart', 'Bundle', 'Weapon_1', 'Engineer'),
+        _skill(22, 'Acid Bomb', 'Bundle', 'Weapon_2', 'Engineer'),
+        _skill(23, 'Super Elixir', 'Toolbelt', 'Toolbelt', 'Engineer'),
+        _skill(200, 'Explosive Shot', 'Weapon', 'Weapon_1', 'Engineer',
+               weapon_type='Pistol'),
+        _skill(300, 'Warding Rift', 'Weapon', 'Weapon_1', 'Revenant',
+               weapon_type='Staff'),
+        _skill(30, 'Legendary Assassin Stance', 'Profession', 'Profession_2',
+               'Revenant'),
+        _skill(31, 'Enchanted Daggers', 'Heal', 'Heal', 'Revenant'),
+        _skill(32, 'Riposting Shadows', 'Utility', 'Utility', 'Revenant'),
+        _skill(33, 'Phase Traversal', 'Utility', 'Utility', 'Revenant'),
+        _skill(34, 'Jade Winds', 'Elite', 'Elite', 'Revenant'),
+    ],
+    ('legends',): [
+        {'id': 'Legend2', 'code': 2, 'swap': 30, 'heal': 31,
+         'utilities': [32, 33], 'elite': 34},
+    ],
+    ('traits',): [
+        {'id': 500, 'name': 'Zealous Blade', 'specialization': 16, 'tier': 1,
+         'slot': 'Major', 'order': 0},
+        {'id': 501, 'name': 'Minor Thing', 'specialization': 16, 'tier': 1,
+         'slot': 'Minor', 'order': 0},
+    ],
+    ('pets',): [
+        {'id': 1, 'name': 'Juvenile Jungle Stalker'},
+        {'id': 2, 'name': 'Juvenile Bear'},
+    ],
+    ('itemstats',): [
+        {'id': 600, 'name': 'Berserker\'s', 'attributes': [1, 2, 3]},
+        {'id': 601, 'name': 'Power', 'attributes': [1]},
+    ],
+    ('pvp', 'amulets'): [
+        {'id': 700, 'name': 'Berserker Amulet'},
+    ],
+    ('items',): [
+        {'id': 800, 'name': 'Superior Sigil of Force',
+         'type': 'UpgradeComponent', 'details': {'type': 'Sigil'}},
+        {'id': 801, 'name': 'Major Sigil of Force',
+         'type': 'UpgradeComponent', 'details': {'type': 'Sigil'}},
+        {'id': 802, 'name': 'Superior Rune of the Scholar',
+         'type': 'UpgradeComponent', 'details': {'type': 'Rune'}},
+        {'id': 803, 'name': 'Relic of the Thief', 'type': 'Relic',
+         'details': {}},
+        {'id': 804, 'name': 'Bowl of Sweet and Spicy Butternut Squash Soup',
+         'type': 'Consumable', 'details': {'type': 'Food'}},
+        {'id': 805, 'name': 'Superior Sharpening Stone', 'type': 'Consumable',
+         'details': {'type': 'Utility'}},
+        {'id': 806, 'name': 'Junk Thing', 'type': 'Trophy', 'details': {}},
+    ],
+}
+
+
+# serves DATA in the same way as gw2buildutil.api.client.Client, in batches and
+# pages of batch_size results; paths supported by FakeClient are served by it
+class FakeApi:
+    schema_version = 'fake1'
+
+    def __init__ (self, data=DATA, batch_size=4):
+        self.data = copy.deepcopy(data)
+        self.batch_size = batch_size
+        self.listed_paths = []
+        self._fake_client = fakeclient.FakeClient()
+
+    def _api_ids (self, path):
+        if path in fakeclient.FakeClient.supported_paths:
+            return self._fake_client.list_(path)
+        return [result['id'] for result in self.data[path]]
+
+    def list_ (self, path):
+        self.listed_paths.append(path)
+        return self._api_ids(path)
+
+    def _get_batch (self, path, api_ids):
+        if path in fakeclient.FakeClient.supported_paths:
+            return list(self._fake_client.get(path, api_ids))
+        results = {result['id']: result for result in self.data[path]}
+        return [copy.deepcopy(results[api_id])
+                for api_id in api_ids if api_id in results]
+
+    def batches (self, path, api_ids):
+        api_ids = list(api_ids)
+        for i in range(0, len(api_ids), self.batch_size):
+            batch_api_ids = api_ids[i:i + self.batch_size]
+            yield lambda batch_api_ids=batch_api_ids: (
+                self._get_batch(path, batch_api_ids))
+
+    def get (self, path, api_ids):
+        for get_batch in self.batches(path, api_ids):
+            yield from get_batch()
+
+    # returns (results, number of pages)
+    def get_page (self, path, page):
+        api_ids = self._api_ids(path)
+        num_pages = max(1, -(-len(api_ids) // self.batch_size))
+        start = page * self.batch_size
+        return (self._get_batch(path, api_ids[start:start + self.batch_size]),
+                num_pages)
+
+
+# serves DATA in the same way as gw2buildutil.api.client.AsyncClient
+class FakeAsyncApi:
+    def __init__ (self, data=DATA, batch_size=4):
+        self.sync_client = FakeApi(data, batch_size)
+        self.schema_version = self.sync_client.schema_version
+
+    async def list_ (self, path):
+        return self.sync_client.list_(path)
+
+    def batches (self, path, api_ids):
+        for get_batch in self.sync_client.batches(path, api_ids):
+            async def get_batch_async (get_batch=get_batch):
+                return get_batch()
+            yield get_batch_async
+
+    async def get_page (self, path, page):
+        return self.sync_client.get_page(path, page)
+
+
+# (entity type, ID) pairs looked up by lookups
+LOOKUPS = (
+    (gw2entity.Skill, 'eg tb'),
+    (gw2entity.Skill, 'shiro heal'),
+    (gw2entity.Skill, 'gs 1'),
+    (gw2entity.Skill, 'shelter'),
+    (gw2entity.Skill, 'sword 1'),
+    (gw2entity.Specialisation, 'dh'),
+    (gw2entity.Trait, 'zeal 1-1'),
+    (gw2entity.Stats, 'berserker'),
+    (gw2entity.Sigil, 'force'),
+    (gw2entity.Rune, 'scholar'),
+    (gw2entity.Boon, 'alac'),
+)
+
+
+# returns {ID: API ID of the matching entity, or None if it isn't unique}, for
+# LOOKUPS
+def lookups (storage):
+    api_ids = {}
+    for entity_type, id_ in LOOKUPS:
+        try:
+            api_ids[id_] = storage.from_id(entity_type, id_).api_id
+        except gw2storage.NotUniqueError:
+            api_ids[id_] = None
+    return api_ids
+
+
+# returns the decoded index of a FileStorage or MemoryStorage, with lists
+# sorted; empty resolved IDs are equivalent to missing ones, so are left out
+def index (storage):
+    storage._flush()
+    result = {}
+    for key in storage._db.keys():
+        value = gw2storage._decode(storage._db[key])
+        if isinstance(value, list):
+            value = sorted(map(str, value))
+        elif isinstance(value, dict):
+            value = {name: sorted(map(str, refs))
+                     for name, refs in value.items()}
+        if ':resolved:' in str(key) and not value:
+            continue
+        result[key if isinstance(key, str) else key.decode()] = value
+    return result
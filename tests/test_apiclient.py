@@ -0,0 +1,428 @@
+import asyncio
+import copy
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import urllib.error
+import zlib
+
+from gw2buildutil.api import apiclient, client, crawl, entity, storage
+
+from . import apiserver, fakeapi
+
+
+async def _get_all (api_client, path):
+    api_ids = await api_client.list_(path)
+    return [result async for result in api_client.get(path, api_ids)]
+
+
+class ApiClientTestCase (unittest.TestCase):
+    def test_get (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4)
+            api_ids = api_client.list_(('skills',))
+            results = list(api_client.get(('skills',), api_ids))
+        self.assertEqual(results, fakeapi.DATA[('skills',)])
+
+    def test_compressed (self):
+        for encoding in ('gzip', 'deflate'):
+            with self.subTest(encoding=encoding):
+                with apiserver.ApiServer(
+                    content_encoding=encoding
+                ) as server:
+                    api_client = apiclient.ApiClient(server.base_url, 4)
+                    api_ids = api_client.list_(('skills',))
+                    batch = next(api_client.batches(('skills',), api_ids))()
+                    with self.assertRaises(urllib.error.HTTPError):
+                        api_client.list_(('missing',))
+                self.assertEqual(batch, fakeapi.DATA[('skills',)][:4])
+
+    def test_get_page (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4, page_size=5)
+            pages = [api_client.get_page(('skills',), page)
+                     for page in range(4)]
+        self.assertEqual([page_total for results, page_total in pages],
+                         [4] * 4)
+        self.assertEqual([result for results, page_total in pages
+                          for result in results],
+                         fakeapi.DATA[('skills',)])
+
+
+class JsonArrayDecoderTestCase (unittest.TestCase):
+    ITEMS = fakeapi.DATA[('skills',)] + [1, -2.5e3, 'x', None, [], {}]
+
+    def _decode (self, decoder, body, chunk_size):
+        items = []
+        for i in range(0, len(body), chunk_size):
+            items.extend(decoder.feed(body[i:i + chunk_size]))
+        items.extend(decoder.close())
+        return items
+
+    def test_chunks (self):
+        body = json.dumps(self.ITEMS, ensure_ascii=False).encode('utf-8')
+        for chunk_size in (1, 7, len(body)):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self._decode(apiclient.JsonArrayDecoder(),
+                                              body, chunk_size),
+                                 self.ITEMS)
+
+    def test_items_before_end (self):
+        decoder = apiclient.JsonArrayDecoder()
+        self.assertEqual(decoder.feed(b'[{"id": 1}, 2'), [{'id': 1}])
+        # the number may continue
+        self.assertEqual(decoder.feed(b'3, 4'), [23])
+        self.assertEqual(decoder.feed(b']'), [4])
+        self.assertEqual(decoder.close(), [])
+
+    def test_compressed (self):
+        body = json.dumps(self.ITEMS).encode('utf-8')
+        for encoding, compress in (('gzip', gzip.compress),
+                                   ('deflate', zlib.compress)):
+            with self.subTest(encoding=encoding):
+                self.assertEqual(
+                    self._decode(apiclient.JsonArrayDecoder(encoding),
+                                 compress(body), 5),
+                    self.ITEMS)
+
+    def test_empty (self):
+        self.assertEqual(
+            self._decode(apiclient.JsonArrayDecoder(), b' [ ] ', 1), [])
+
+    def test_invalid (self):
+        for body in (b'{}', b'[1 2]', b'[1, 2', b'[1] 2', b''):
+            with self.subTest(body=body):
+                with self.assertRaises(json.JSONDecodeError):
+                    self._decode(apiclient.JsonArrayDecoder(), body, 1)
+
+    def test_unsupported_encoding (self):
+        with self.assertRaises(urllib.error.URLError):
+            apiclient.JsonArrayDecoder('br')
+
+
+class ConnectionPoolTestCase (unittest.TestCase):
+    def test_reuse (self):
+        pool = apiclient.ConnectionPool()
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4, pool)
+            api_ids = api_client.list_(('skills',))
+            results = list(api_client.get(('skills',), api_ids))
+            with self.assertRaises(urllib.error.HTTPError):
+                api_client.list_(('missing',))
+            api_client.list_(('pets',))
+            pool.close()
+        self.assertEqual(results, fakeapi.DATA[('skills',)])
+        self.assertEqual(pool.stats(), {
+            'idle': 0,
+            'max idle per host': apiclient.DEFAULT_POOL_SIZE,
+            'connections': 1,
+            'requests': 8,
+            'reused': 7,
+        })
+
+    def test_closed_connection (self):
+        pool = apiclient.ConnectionPool()
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4, pool)
+            api_client.list_(('skills',))
+            # as if the server closed the idle connection
+            for conns in pool._idle.values():
+                for conn in conns:
+                    conn.sock.close()
+            api_ids = api_client.list_(('skills',))
+            pool.close()
+        self.assertEqual(api_ids, [result['id']
+                                   for result in fakeapi.DATA[('skills',)]])
+        self.assertEqual(pool.stats()['connections'], 2)
+
+    def test_shared (self):
+        pool = apiclient.ConnectionPool()
+        with apiserver.ApiServer() as server:
+            test_storage = storage.MemoryStorage()
+            crawl.crawl(client.Client(server.base_url, 1, pool), test_storage,
+                        (entity.Skill,), concurrency=4)
+            pool.close()
+        stats = pool.stats()
+        self.assertLessEqual(stats['connections'], 4)
+        self.assertEqual(stats['reused'],
+                         stats['requests'] - stats['connections'])
+
+
+class AsyncApiClientTestCase (unittest.TestCase):
+    def test_get (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.AsyncApiClient(server.base_url, 4)
+            results = asyncio.run(_get_all(api_client, ('skills',)))
+        self.assertEqual(results, fakeapi.DATA[('skills',)])
+        # batches are requested separately
+        self.assertEqual(len(server.requests), 6)
+
+    def test_get_page (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.AsyncApiClient(server.base_url, 4,
+                                                  page_size=5)
+            results, page_total = asyncio.run(
+                api_client.get_page(('skills',), 3))
+        self.assertEqual(results, fakeapi.DATA[('skills',)][15:])
+        self.assertEqual(page_total, 4)
+
+    def test_compressed (self):
+        with apiserver.ApiServer(content_encoding='gzip') as server:
+            api_client = apiclient.AsyncApiClient(server.base_url, 4)
+            results = asyncio.run(_get_all(api_client, ('skills',)))
+        self.assertEqual(results, fakeapi.DATA[('skills',)])
+
+    def test_error (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.AsyncApiClient(server.base_url, 4)
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                asyncio.run(api_client.list_(('missing',)))
+        self.assertEqual(cm.exception.code, 404)
+
+    def test_no_headers (self):
+        with apiserver.ApiServer(raw_responses={
+            ('skills',): b'HTTP/1.0 200 OK\r\n\r\n[10, 11]',
+        }) as server:
+            api_client = apiclient.AsyncApiClient(server.base_url, 4)
+            api_ids = asyncio.run(api_client.list_(('skills',)))
+        self.assertEqual(api_ids, [10, 11])
+
+    def test_too_many_headers (self):
+        with apiserver.ApiServer(raw_responses={
+            ('skills',): (b'HTTP/1.0 200 OK\r\n' + b'X-Header: 1\r\n' * 200 +
+                          b'\r\n[]'),
+        }) as server:
+            api_client = apiclient.AsyncApiClient(
+                server.base_url, 4, throttle=apiclient.Throttle(max_retries=0))
+            with self.assertRaises(urllib.error.URLError):
+                asyncio.run(api_client.list_(('skills',)))
+
+
+class ThrottleTestCase (unittest.TestCase):
+    def _error (self, code, retry_after=None):
+        headers = {} if retry_after is None else {'Retry-After': retry_after}
+        return urllib.error.HTTPError('url', code, 'error', headers, None)
+
+    def test_concurrency (self):
+        throttle = apiclient.Throttle(2)
+        self.assertIsNone(throttle.try_acquire())
+        self.assertIsNone(throttle.try_acquire())
+        self.assertIsNotNone(throttle.try_acquire())
+        throttle.cancel()
+        self.assertIsNone(throttle.try_acquire())
+        self.assertEqual(throttle.stats()['requests'], 3)
+
+    def test_rate_limited (self):
+        throttle = apiclient.Throttle(8)
+        throttle.acquire()
+        self.assertEqual(throttle.failed(self._error(429, '3'), 0), 3)
+        stats = throttle.stats()
+        self.assertEqual(stats['concurrency'], 4)
+        self.assertEqual(stats['rate limited'], 1)
+        # waits for Retry-After before any request
+        self.assertGreater(throttle.try_acquire(), 2)
+
+    def test_server_error (self):
+        throttle = apiclient.Throttle(max_delay=0)
+        throttle.acquire()
+        self.assertEqual(throttle.failed(self._error(503), 0), 0)
+        self.assertEqual(throttle.batch_size(100), 50)
+        self.assertEqual(throttle.stats()['server errors'], 1)
+        for i in range(apiclient.Throttle.BATCH_RECOVERY_REQUESTS):
+            throttle.acquire()
+            throttle.release()
+        self.assertEqual(throttle.batch_size(100), 100)
+
+    def test_not_retried (self):
+        throttle = apiclient.Throttle(max_retries=2)
+        throttle.acquire()
+        self.assertIsNone(throttle.failed(self._error(404), 0))
+        throttle.acquire()
+        self.assertIsNone(throttle.failed(self._error(429, '0'), 2))
+        self.assertEqual(throttle.stats()['retries'], 0)
+
+
+# the start of a response to a batch of skills, including the first result,
+# after which the connection is closed
+_TRUNCATED_RESPONSE = (
+    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+    b'Content-Length: 10000\r\n\r\n[' +
+    json.dumps(fakeapi.DATA[('skills',)][0]).encode('utf-8') + b', {"id"')
+
+
+class RetryTestCase (unittest.TestCase):
+    def test_error_status (self):
+        with apiserver.ApiServer(failures={
+            ('skills',): [429, 503],
+        }) as server:
+            throttle = apiclient.Throttle(max_delay=0)
+            api_client = apiclient.ApiClient(server.base_url, 4,
+                                             throttle=throttle)
+            api_ids = api_client.list_(('skills',))
+        self.assertEqual(api_ids, [result['id']
+                                   for result in fakeapi.DATA[('skills',)]])
+        self.assertEqual(len(server.requests), 3)
+        stats = throttle.stats()
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['rate limited'], 1)
+        self.assertEqual(stats['server errors'], 1)
+
+    def test_max_retries (self):
+        with apiserver.ApiServer(failures={('skills',): [503] * 3}) as server:
+            api_client = apiclient.ApiClient(
+                server.base_url, 4,
+                throttle=apiclient.Throttle(max_retries=2, max_delay=0))
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                api_client.list_(('skills',))
+        self.assertEqual(cm.exception.code, 503)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_truncated (self):
+        with apiserver.ApiServer(failures={
+            ('skills',): [_TRUNCATED_RESPONSE, _TRUNCATED_RESPONSE],
+        }) as server:
+            throttle = apiclient.Throttle(max_delay=0)
+            api_client = apiclient.ApiClient(server.base_url, 4,
+                                             throttle=throttle)
+            api_ids = [result['id'] for result in fakeapi.DATA[('skills',)]]
+            batch = next(api_client.batches(('skills',), api_ids))()
+            # results already yielded aren't yielded again
+            results = list(api_client.get(('skills',), api_ids))
+        self.assertEqual(batch, fakeapi.DATA[('skills',)][:4])
+        self.assertEqual(results, fakeapi.DATA[('skills',)])
+        self.assertEqual(throttle.stats()['connection errors'], 2)
+
+    def test_error_status_async (self):
+        with apiserver.ApiServer(failures={('skills',): [429]}) as server:
+            throttle = apiclient.Throttle(max_delay=0)
+            api_client = apiclient.AsyncApiClient(server.base_url, 4,
+                                                  throttle=throttle)
+            results = asyncio.run(_get_all(api_client, ('skills',)))
+        self.assertEqual(results, fakeapi.DATA[('skills',)])
+        self.assertEqual(throttle.stats()['rate limited'], 1)
+
+    def test_truncated_async (self):
+        with apiserver.ApiServer(failures={
+            ('skills',): [_TRUNCATED_RESPONSE],
+        }) as server:
+            api_client = apiclient.AsyncApiClient(
+                server.base_url, 4, throttle=apiclient.Throttle(max_delay=0))
+            api_ids = [result['id'] for result in fakeapi.DATA[('skills',)]]
+
+            async def get ():
+                return [result async for result
+                        in api_client.get(('skills',), api_ids)]
+            results = asyncio.run(get())
+        self.assertEqual(results, fakeapi.DATA[('skills',)])
+
+    def test_cancelled_async (self):
+        with apiserver.ApiServer() as server:
+            throttle = apiclient.Throttle(1)
+            api_client = apiclient.AsyncApiClient(server.base_url, 4,
+                                                  throttle=throttle)
+
+            async def get_first ():
+                async for result in api_client.get(('skills',), [10, 11]):
+                    return result
+            asyncio.run(get_first())
+            # the abandoned request doesn't hold up later ones
+            api_ids = asyncio.run(api_client.list_(('skills',)))
+        self.assertEqual(len(api_ids), len(fakeapi.DATA[('skills',)]))
+
+
+class ValidatorCacheTestCase (unittest.TestCase):
+    def setUp (self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.cache = apiclient.ValidatorCache(
+            os.path.join(self._dir.name, 'cache'))
+
+    def tearDown (self):
+        self.cache.close()
+        self._dir.cleanup()
+
+    def test_revalidate (self):
+        data = copy.deepcopy(fakeapi.DATA)
+        with apiserver.ApiServer(data) as server:
+            api_client = apiclient.ApiClient(server.base_url, 4,
+                                             cache=self.cache)
+            api_ids = api_client.list_(('skills',))
+            self.assertEqual(api_client.list_(('skills',)), api_ids)
+            data[('skills',)].pop()
+            changed_api_ids = api_client.list_(('skills',))
+        self.assertEqual(changed_api_ids, api_ids[:-1])
+        self.assertEqual(self.cache.stats(), {
+            'size': 1,
+            'misses': 1,
+            'revalidations': 2,
+            'hits': 1,
+        })
+
+    def test_revalidate_async (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.AsyncApiClient(server.base_url, 4,
+                                                  cache=self.cache)
+            results = asyncio.run(_get_all(api_client, ('skills',)))
+            cached_results = asyncio.run(_get_all(api_client, ('skills',)))
+        self.assertEqual(cached_results, results)
+        self.assertEqual(self.cache.stats()['hits'],
+                         self.cache.stats()['misses'])
+
+    def test_batch_order (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4,
+                                             cache=self.cache)
+            list(api_client.get(('skills',), [10, 11]))
+            # the same batch
+            results = list(api_client.get(('skills',), [11, 10]))
+        self.assertEqual([result['id'] for result in results], [10, 11])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_page_total (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4,
+                                             cache=self.cache, page_size=5)
+            page = api_client.get_page(('skills',), 1)
+            # the page total is stored with the results
+            cached_page = api_client.get_page(('skills',), 1)
+        self.assertEqual(cached_page, page)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_prune (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4,
+                                             cache=self.cache)
+            api_client.list_(('skills',))
+            api_client.list_(('pets',))
+            self.assertEqual(self.cache.prune(), 0)
+            api_client.list_(('pets',))
+        self.assertEqual(self.cache.prune(), 1)
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+    def test_clear (self):
+        with apiserver.ApiServer() as server:
+            api_client = apiclient.ApiClient(server.base_url, 4,
+                                             cache=self.cache)
+            api_client.list_(('skills',))
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_full_recrawl_prunes (self):
+        with apiserver.ApiServer() as server:
+            self.cache.store(f'{server.base_url}/unused',
+                             {'ETag': '"x"'}, [])
+            # not used since the cache was opened
+            self.cache.close()
+            self.cache = apiclient.ValidatorCache(self.cache.path)
+            api_client = client.Client(server.base_url, 4, cache=self.cache)
+            test_storage = storage.MemoryStorage()
+            crawl.crawl(api_client, test_storage, (entity.Skill,))
+            size = self.cache.stats()['size']
+            crawl.crawl(api_client, test_storage, (entity.Skill,),
+                        full_recrawl=True)
+        self.assertEqual(self.cache.stats()['size'], size - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,377 @@
+import asyncio
+import copy
+import os
+import tempfile
+import unittest
+
+from gw2buildutil.api import crawl, entity, storage
+
+from . import fakeapi
+
+
+def _skill (data, api_id):
+    for result in data[('skills',)]:
+        if result['id'] == api_id:
+            return result
+
+
+def _rename (data):
+    _skill(data, 20)['name'] = 'Elixir Cannon'
+
+
+def _remove (data):
+    data[('skills',)].remove(_skill(data, 22))
+    _skill(data, 20)['bundle_skills'] = [21]
+
+
+def _add (data):
+    data[('skills',)].append(fakeapi._skill(
+        26, 'Flame Jet', 'Bundle', 'Weapon_3', 'Engineer'))
+    _skill(data, 20)['bundle_skills'] = [21, 22, 26]
+
+
+def _swap_palettes (data):
+    data[('professions',)][0]['skills_by_palette'] = [[4, 11], [5, 10]]
+
+
+def _rename_specialization (data):
+    data[('specializations',)][1]['name'] = 'Zealotry'
+
+
+def _changed (mutate):
+    data = copy.deepcopy(fakeapi.DATA)
+    mutate(data)
+    return data
+
+
+def _crawled (data=fakeapi.DATA, **kwargs):
+    crawled_storage = storage.MemoryStorage()
+    crawl.crawl(fakeapi.FakeApi(data), crawled_storage, **kwargs)
+    return crawled_storage
+
+
+# fails to get a batch once a number of batches have been got, counting only
+# batches of path if given
+class _FailingApi (fakeapi.FakeApi):
+    def __init__ (self, num_batches, data=fakeapi.DATA, path=None):
+        fakeapi.FakeApi.__init__(self, data)
+        self.num_batches = num_batches
+        self.path = path
+
+    def _get_batch (self, path, api_ids):
+        if self.path is not None and path != self.path:
+            return fakeapi.FakeApi._get_batch(self, path, api_ids)
+        if self.num_batches == 0:
+            raise ConnectionError('failed to get batch')
+        self.num_batches -= 1
+        return fakeapi.FakeApi._get_batch(self, path, api_ids)
+
+
+# fails to list any path
+class _UnlistableApi (fakeapi.FakeApi):
+    def list_ (self, path):
+        raise ConnectionError('failed to list')
+
+
+# records the paths and API IDs of each batch got
+class _RecordingApi (fakeapi.FakeApi):
+    def __init__ (self, data=fakeapi.DATA):
+        fakeapi.FakeApi.__init__(self, data)
+        self.requested = []
+
+    def _get_batch (self, path, api_ids):
+        self.requested.extend((path, api_id) for api_id in api_ids)
+        return fakeapi.FakeApi._get_batch(self, path, api_ids)
+
+
+# results move to earlier pages after the first page is got, as when earlier
+# results are removed, so the first result of the second page is never got
+class _ShiftingApi (fakeapi.FakeApi):
+    def get_page (self, path, page):
+        api_ids = self._api_ids(path)
+        num_pages = max(1, -(-len(api_ids) // self.batch_size))
+        start = page * self.batch_size + (1 if page > 0 else 0)
+        return (self._get_batch(path, api_ids[start:start + self.batch_size]),
+                num_pages)
+
+
+class CrawlTestCase (unittest.TestCase):
+    def test_full_recrawl (self):
+        for mutate in (_rename, _remove, _add):
+            with self.subTest(mutate=mutate.__name__):
+                data = _changed(mutate)
+                test_storage = _crawled()
+                crawl.crawl(fakeapi.FakeApi(data), test_storage,
+                            full_recrawl=True)
+                self.assertEqual(fakeapi.index(test_storage),
+                                 fakeapi.index(_crawled(data)))
+
+    def test_concurrent (self):
+        test_storage = storage.MemoryStorage()
+        crawl.crawl(fakeapi.FakeApi(batch_size=2), test_storage,
+                    concurrency=4)
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled()))
+
+    def test_processes (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                crawl.crawl(fakeapi.FakeApi(), file_storage, processes=2)
+                self.assertEqual(fakeapi.index(file_storage),
+                                 fakeapi.index(_crawled()))
+
+    def test_processes_unsupported_storage (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                with self.assertRaises(TypeError):
+                    crawl.crawl(fakeapi.FakeApi(), sqlite_storage,
+                                processes=2)
+
+    def test_async (self):
+        for paged in (True, False):
+            with self.subTest(paged=paged):
+                test_storage = storage.MemoryStorage()
+                asyncio.run(crawl.crawl_async(
+                    fakeapi.FakeAsyncApi(), test_storage, paged=paged))
+                self.assertEqual(fakeapi.index(test_storage),
+                                 fakeapi.index(_crawled()))
+
+
+class IncrementalCrawlTestCase (unittest.TestCase):
+    def test_equals_full (self):
+        for mutate in (_rename, _remove, _add, _swap_palettes,
+                       _rename_specialization):
+            with self.subTest(mutate=mutate.__name__):
+                data = _changed(mutate)
+                test_storage = _crawled()
+                crawl.crawl(fakeapi.FakeApi(data), test_storage,
+                            incremental=True)
+                self.assertEqual(fakeapi.index(test_storage),
+                                 fakeapi.index(_crawled(data)))
+
+    def test_unchanged (self):
+        test_storage = _crawled()
+        crawl.crawl(fakeapi.FakeApi(), test_storage, incremental=True)
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled()))
+
+    def test_new_results_only (self):
+        data = _changed(_add)
+        _rename(data)
+        test_storage = _crawled()
+        crawl.crawl(fakeapi.FakeApi(data), test_storage, incremental=True,
+                    check_changed=False)
+        self.assertEqual(test_storage.raw(('skills',), 20)['name'],
+                         'Elixir Gun')
+        self.assertEqual(test_storage.raw(('skills',), 26)['name'],
+                         'Flame Jet')
+
+    def test_other_entity_types (self):
+        # the index doesn't include every type, so is rebuilt
+        test_storage = _crawled(entity_types=(entity.Skill,))
+        crawl.crawl(fakeapi.FakeApi(), test_storage, incremental=True)
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled()))
+
+    def test_removed_results (self):
+        data = _changed(_remove)
+        test_storage = _crawled()
+        crawl.crawl(fakeapi.FakeApi(data), test_storage, incremental=True)
+        self.assertFalse(test_storage.exists_raw(('skills',), 22))
+
+
+class ResolvedIdsTestCase (unittest.TestCase):
+    def test_invalidated_by_crawl (self):
+        for make_storage in (storage.MemoryStorage, storage.SqliteStorage):
+            with self.subTest(storage=make_storage.__name__):
+                with tempfile.TemporaryDirectory() as path:
+                    if make_storage is storage.SqliteStorage:
+                        test_storage = make_storage(
+                            os.path.join(path, 'api.sqlite'))
+                    else:
+                        test_storage = make_storage()
+                    with test_storage:
+                        self._check(test_storage)
+
+    def _check (self, test_storage):
+        crawl.crawl(fakeapi.FakeApi(), test_storage)
+        self.assertEqual(
+            test_storage.from_id(entity.Skill, 'shelter').api_id, 10)
+        self.assertIsNotNone(test_storage.resolved_ids('skill', 'shelter'))
+
+        data = copy.deepcopy(fakeapi.DATA)
+        data[('skills',)].append(fakeapi._skill(
+            40, 'Shelter', 'Heal', 'Heal', 'Guardian'))
+        crawler = crawl.Crawler(fakeapi.FakeApi(data), test_storage,
+                                entity.BUILTIN_TYPES)
+        crawler.crawl(entity.Skill, [40])
+
+        self.assertIsNone(test_storage.resolved_ids('skill', 'shelter'))
+        self.assertEqual(
+            sorted(skill.api_id for skill in
+                   test_storage.all_from_id(entity.Skill, 'shelter')),
+            [10, 40])
+
+
+class ResumeTestCase (unittest.TestCase):
+    def test_resume (self):
+        test_storage = _crawled()
+        lookups = fakeapi.lookups(test_storage)
+        data = _changed(_rename)
+
+        failing_api = _FailingApi(10, data)
+        with self.assertRaises(ConnectionError):
+            crawl.crawl(failing_api, test_storage, full_recrawl=True)
+        # the previous index is still used
+        self.assertEqual(fakeapi.lookups(test_storage), lookups)
+        self.assertIsNotNone(test_storage.meta('crawl checkpoint'))
+
+        api = fakeapi.FakeApi(data)
+        crawl.crawl(api, test_storage, full_recrawl=True, resume=True)
+        self.assertIsNone(test_storage.meta('crawl checkpoint'))
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled(data)))
+        # paths listed before failing aren't listed again
+        full_api = fakeapi.FakeApi(data)
+        crawl.crawl(full_api, storage.MemoryStorage())
+        self.assertLess(len(api.listed_paths), len(full_api.listed_paths))
+
+    def test_resume_after_new_crawl (self):
+        test_storage = _crawled()
+        with self.assertRaises(ConnectionError):
+            crawl.crawl(_FailingApi(1, path=('skills',)), test_storage,
+                        full_recrawl=True, paged=False)
+        self.assertIn('"skills": 4',
+                      test_storage.meta('crawl refetch progress'))
+        # a new crawl replaces the checkpoint, so its progress no longer
+        # applies
+        with self.assertRaises(ConnectionError):
+            crawl.crawl(_UnlistableApi(), test_storage, full_recrawl=True,
+                        paged=False)
+
+        data = copy.deepcopy(fakeapi.DATA)
+        _skill(data, 100)['name'] = 'Smite'
+        crawl.crawl(fakeapi.FakeApi(data), test_storage, full_recrawl=True,
+                    paged=False, resume=True)
+        self.assertEqual(test_storage.raw(('skills',), 100)['name'], 'Smite')
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled(data)))
+
+    def test_resume_without_checkpoint (self):
+        test_storage = _crawled()
+        crawl.crawl(fakeapi.FakeApi(), test_storage, resume=True)
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled()))
+
+    def test_async_full_recrawl (self):
+        data = _changed(_remove)
+        test_storage = _crawled()
+        asyncio.run(crawl.crawl_async(fakeapi.FakeAsyncApi(data),
+                                      test_storage, full_recrawl=True))
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled(data)))
+        # results which are no longer listed stay stored
+        self.assertTrue(test_storage.exists_raw(('skills',), 22))
+
+
+class RetentionTestCase (unittest.TestCase):
+    def test_dropped (self):
+        test_storage = _crawled()
+        self.assertTrue(test_storage.exists_raw(('items',), 800))
+        self.assertFalse(test_storage.exists_raw(('items',), 806))
+        # paths with a type accepting every result keep every result
+        self.assertTrue(test_storage.exists_raw(('pets',), 2))
+
+        for check_changed in (True, False):
+            with self.subTest(check_changed=check_changed):
+                api = _RecordingApi()
+                crawl.crawl(api, test_storage, incremental=True,
+                            check_changed=check_changed)
+                self.assertNotIn((('items',), 806), api.requested)
+        api = _RecordingApi()
+        crawl.crawl(api, test_storage)
+        self.assertNotIn((('items',), 806), api.requested)
+        api = _RecordingApi()
+        crawl.crawl(api, test_storage, full_recrawl=True)
+        self.assertIn((('items',), 806), api.requested)
+        self.assertFalse(test_storage.exists_raw(('items',), 806))
+
+    def test_other_entity_types (self):
+        test_storage = _crawled(entity_types=(entity.Sigil,))
+        self.assertFalse(test_storage.exists_raw(('items',), 802))
+        # results dropped before are accepted by the new types
+        crawl.crawl(fakeapi.FakeApi(), test_storage, incremental=True,
+                    check_changed=False)
+        self.assertTrue(test_storage.exists_raw(('items',), 802))
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled()))
+
+    def test_changed_result (self):
+        # a stored result which is no longer accepted is dropped, and one which
+        # was dropped is stored once accepted, if fetched
+        data = copy.deepcopy(fakeapi.DATA)
+        items = data[('items',)]
+        items[0].update(type='Trophy', details={})
+        items[-1].update(name='Superior Sigil of Junk',
+                         type='UpgradeComponent', details={'type': 'Sigil'})
+        test_storage = _crawled()
+        crawl.crawl(fakeapi.FakeApi(data), test_storage, full_recrawl=True)
+        self.assertFalse(test_storage.exists_raw(('items',), 800))
+        self.assertTrue(test_storage.exists_raw(('items',), 806))
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled(data)))
+
+    def test_resume_refetch (self):
+        # the first batch of items has a result which is now accepted and one
+        # which is now dropped
+        data = copy.deepcopy(fakeapi.DATA)
+        items = data[('items',)]
+        items.insert(0, items.pop())
+        items[0].update(name='Superior Sigil of Junk',
+                        type='UpgradeComponent', details={'type': 'Sigil'})
+        items[2].update(type='Trophy', details={})
+
+        test_storage = _crawled()
+        with self.assertRaises(ConnectionError):
+            crawl.crawl(_FailingApi(1, data, ('items',)), test_storage,
+                        full_recrawl=True, paged=False)
+        crawl.crawl(fakeapi.FakeApi(data), test_storage, full_recrawl=True,
+                    paged=False, resume=True)
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled(data)))
+        self.assertEqual(test_storage.meta('crawl ignored /items'),
+                         _crawled(data).meta('crawl ignored /items'))
+
+
+class PagedCrawlTestCase (unittest.TestCase):
+    def test_equals_unpaged (self):
+        for batch_size in (1, 3, 100):
+            with self.subTest(batch_size=batch_size):
+                test_storage = storage.MemoryStorage()
+                crawl.crawl(fakeapi.FakeApi(batch_size=batch_size),
+                            test_storage)
+                self.assertEqual(fakeapi.index(test_storage),
+                                 fakeapi.index(_crawled(paged=False)))
+
+    def test_shifting_pages (self):
+        # the result which is never paged has changed, so must be refetched
+        data = copy.deepcopy(fakeapi.DATA)
+        _skill(data, 10)['name'] = 'Sanctuary'
+        test_storage = _crawled()
+        crawl.crawl(_ShiftingApi(data), test_storage, full_recrawl=True)
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled(data)))
+
+    def test_async_shifting_pages (self):
+        async_api = fakeapi.FakeAsyncApi()
+        async_api.sync_client = _ShiftingApi()
+        test_storage = storage.MemoryStorage()
+        asyncio.run(crawl.crawl_async(async_api, test_storage))
+        self.assertEqual(fakeapi.index(test_storage),
+                         fakeapi.index(_crawled(paged=False)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from gw2buildutil.api import crawl, entity, storage
+
+from . import fakeapi
+
+
+class RelationsFromResultTestCase (unittest.TestCase):
+    def test_same_as_built (self):
+        crawled_storage = storage.MemoryStorage()
+        crawl.crawl(fakeapi.FakeApi(), crawled_storage)
+        for entity_type in entity.BUILTIN_TYPES:
+            for result in fakeapi.DATA.get(entity_type.path(), []):
+                with self.subTest(type=entity_type.__name__,
+                                  api_id=result['id']):
+                    # other results aren't stored
+                    if not entity_type.accepts_result(result):
+                        continue
+                    try:
+                        relations = entity_type.relations_from_result(result)
+                        built = crawled_storage.from_api_id(
+                            entity_type, result['id'])
+                    except entity.SkipEntityError:
+                        continue
+                    if relations is not None:
+                        self.assertEqual(relations,
+                                         built.extra_entity_relations())
+
+
+class AcceptsResultTestCase (unittest.TestCase):
+    def test_same_as_built (self):
+        crawled_storage = storage.MemoryStorage()
+        crawl.crawl(fakeapi.FakeApi(), crawled_storage)
+        for entity_type in entity.BUILTIN_TYPES:
+            for result in fakeapi.DATA.get(entity_type.path(), []):
+                with self.subTest(type=entity_type.__name__,
+                                  api_id=result['id']):
+                    if entity_type.accepts_result(result):
+                        continue
+                    with self.assertRaises(entity.SkipEntityError):
+                        crawled_storage.from_result(entity_type, result)
+
+    def test_items (self):
+        accepted = {
+            entity_type.__name__: [
+                result['id'] for result in fakeapi.DATA[('items',)]
+                if entity_type.accepts_result(result)]
+            for entity_type in entity.BUILTIN_TYPES
+            if entity_type.path() == ('items',)}
+        self.assertEqual(accepted, {
+            'Sigil': [800, 801],
+            'Rune': [802],
+            'Relic': [803],
+            'Food': [804],
+            'UtilityConsumable': [805],
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
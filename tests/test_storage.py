@@ -0,0 +1,489 @@
+import os
+import tempfile
+import unittest
+
+from gw2buildutil.api import crawl, entity, storage
+
+from . import fakeapi
+
+
+# relates itself to a pet
+class _PetOwner (entity.Stats):
+    def extra_entity_relations (self):
+        return {(entity.RangerPet, 1): ['owner']}
+
+
+# records the API IDs of each request
+class _RecordingApi (fakeapi.FakeApi):
+    def __init__ (self):
+        fakeapi.FakeApi.__init__(self, batch_size=100)
+        self.requested = []
+
+    def _get_batch (self, path, api_ids):
+        self.requested.append(list(api_ids))
+        return fakeapi.FakeApi._get_batch(self, path, api_ids)
+
+
+def _crawled (codec=storage.JSON_CODEC):
+    crawled_storage = storage.MemoryStorage(codec=codec)
+    crawl.crawl(fakeapi.FakeApi(), crawled_storage)
+    return crawled_storage
+
+
+class EntityCacheTestCase (unittest.TestCase):
+    def test_evicts_least_recently_used (self):
+        cache = storage.EntityCache(2)
+        cache.put(entity.RangerPet, 1, 'a')
+        cache.put(entity.RangerPet, 2, 'b')
+        self.assertEqual(cache.get(entity.RangerPet, '1'), 'a')
+        cache.put(entity.RangerPet, 3, 'c')
+        with self.assertRaises(KeyError):
+            cache.get(entity.RangerPet, 2)
+        self.assertEqual(cache.get(entity.RangerPet, 1), 'a')
+        self.assertEqual(cache.stats(), {
+            'size': 2, 'max size': 2, 'hits': 2, 'misses': 1, 'evictions': 1,
+        })
+
+    def test_disabled (self):
+        cache = storage.EntityCache(0)
+        cache.put(entity.RangerPet, 1, 'a')
+        self.assertEqual(len(cache), 0)
+
+    def test_storage (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                file_storage.store_raw(
+                    ('pets',), {'id': 1, 'name': 'Juvenile Jungle Stalker'})
+                file_storage.store_raw(('itemstats',), {
+                    'id': 600, 'name': 'Berserker\'s', 'attributes': [1, 2, 3],
+                })
+                pet = file_storage.from_api_id(entity.RangerPet, 1)
+                self.assertIs(file_storage.from_api_id(entity.RangerPet, 1),
+                              pet)
+
+                # the pet's relations change
+                file_storage.store(file_storage.from_api_id(_PetOwner, 600))
+                self.assertIsNot(
+                    file_storage.from_api_id(entity.RangerPet, 1), pet)
+
+                file_storage.clear_raw()
+                self.assertEqual(len(file_storage.entity_cache), 0)
+
+
+class BatchTestCase (unittest.TestCase):
+    def test_deferred_writes (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                file_storage.store_raw(
+                    ('pets',), {'id': 1, 'name': 'Juvenile Jungle Stalker'})
+                pet = file_storage.from_api_id(entity.RangerPet, 1)
+                with file_storage.batch():
+                    with file_storage.batch():
+                        file_storage.store(pet)
+                    self.assertEqual(len(file_storage._db), 0)
+                    # reads see deferred writes
+                    self.assertIs(file_storage.from_id(
+                        entity.RangerPet, 'jungle stalker'), pet)
+                # two IDs, and the IDs of the pet
+                self.assertEqual(len(file_storage._db), 3)
+                self.assertIs(file_storage.from_id(
+                    entity.RangerPet, 'juvenile jungle stalker'), pet)
+
+    def test_missing (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                with self.assertRaises(KeyError) as cm:
+                    file_storage.all_from_id(entity.RangerPet, 'bear')
+                self.assertEqual(cm.exception.args, ('bear',))
+
+
+class BulkTestCase (unittest.TestCase):
+    def _check (self, test_storage):
+        crawl.crawl(fakeapi.FakeApi(), test_storage)
+        self.assertEqual(test_storage.raw_many(('skills',), [11, 10, 11]),
+                         [test_storage.raw(('skills',), api_id)
+                          for api_id in (11, 10, 11)])
+        skill = test_storage.from_api_id(entity.Skill, 10)
+        skills = test_storage.from_api_ids(entity.Skill, [11, 10])
+        self.assertEqual([s.api_id for s in skills], [11, 10])
+        self.assertIs(skills[1], skill)
+
+    def test_memory (self):
+        self._check(storage.MemoryStorage())
+
+    def test_sqlite (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                self._check(sqlite_storage)
+
+    def test_crawling (self):
+        api = _RecordingApi()
+        crawler = crawl.Crawler(api, storage.MemoryStorage(),
+                                entity.BUILTIN_TYPES)
+        crawler.storage.store_raw(('skills',), fakeapi.DATA[('skills',)][0])
+        results = crawler.storage.raw_many(('skills',), [10, 100, 11])
+        self.assertEqual([result['id'] for result in results], [10, 100, 11])
+        # missing results are fetched together
+        self.assertEqual(api.requested, [[10, 11]])
+
+
+class SqliteStorageTestCase (unittest.TestCase):
+    def test_lookups (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(
+                os.path.join(path, 'file')
+            ) as file_storage:
+                crawl.crawl(fakeapi.FakeApi(), file_storage)
+                file_lookups = fakeapi.lookups(file_storage)
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                crawl.crawl(fakeapi.FakeApi(), sqlite_storage)
+                self.assertEqual(fakeapi.lookups(sqlite_storage), file_lookups)
+                # API IDs keep their type
+                profession = sqlite_storage.from_id(
+                    entity.Profession, 'guardian')
+                self.assertEqual(profession.api_id, 'Guardian')
+                skill = sqlite_storage.from_id(entity.Skill, 'shelter')
+                self.assertEqual(skill.api_id, 10)
+
+
+class CodecTestCase (unittest.TestCase):
+    def test_round_trip (self):
+        for codec in (storage.JSON_CODEC, storage.BINARY_CODEC):
+            for result in fakeapi.DATA[('skills',)]:
+                with self.subTest(codec=codec.id_, api_id=result['id']):
+                    value = codec.encode(result)
+                    self.assertEqual(codec.decode(value), result)
+                    self.assertEqual(storage._decode(value), result)
+
+    def test_binary_is_smaller (self):
+        result = fakeapi.DATA[('professions',)][0]
+        self.assertLess(len(storage.BINARY_CODEC.encode(result)),
+                        len(storage.JSON_CODEC.encode(result)))
+
+    def test_storage (self):
+        self.assertEqual(fakeapi.index(_crawled(storage.BINARY_CODEC)),
+                         fakeapi.index(_crawled()))
+
+    def test_codec_change_invalidates_data (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                crawl.crawl(fakeapi.FakeApi(), file_storage)
+                self.assertEqual(file_storage.schema_version(),
+                                 fakeapi.FakeApi.schema_version)
+            with storage.FileStorage(
+                path, codec=storage.BINARY_CODEC
+            ) as file_storage:
+                self.assertIsNone(file_storage.schema_version())
+
+
+class FileStorageTestCase (unittest.TestCase):
+    def test_read_only_missing (self):
+        with tempfile.TemporaryDirectory() as path:
+            with self.assertRaises(FileNotFoundError):
+                storage.FileStorage(os.path.join(path, 'missing'),
+                                    read_only=True)
+
+    def test_read_only (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                _crawled().save(file_storage)
+            with storage.FileStorage(path, read_only=True) as file_storage:
+                self.assertEqual(file_storage.raw(('skills',), 10)['name'],
+                                 'Shelter')
+                with self.assertRaises(storage.ReadOnlyError):
+                    file_storage.store_raw(('skills',), {'id': 9})
+
+    def test_clear_replaces_files (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                crawl.crawl(fakeapi.FakeApi(), file_storage)
+                file_names = file_storage._db_files(file_storage._DB_NAME)
+                # readers with the files open keep the previous data
+                files = [open(os.path.join(path, file_name), 'rb')
+                         for file_name in file_names]
+                try:
+                    file_storage.clear()
+                    self.assertTrue(any(f.read() for f in files))
+                    for file_name, f in zip(file_names, files):
+                        file_path = os.path.join(path, file_name)
+                        if os.path.exists(file_path):
+                            self.assertNotEqual(
+                                os.stat(file_path).st_ino,
+                                os.fstat(f.fileno()).st_ino)
+                finally:
+                    for f in files:
+                        f.close()
+
+                self.assertEqual(len(file_storage._db), 0)
+                self.assertEqual(file_storage.raw(('skills',), 10)['name'],
+                                 'Shelter')
+                file_storage.clear_raw()
+                self.assertFalse(file_storage.exists_raw(('skills',), 10))
+                self.assertEqual(
+                    sorted(os.listdir(path)),
+                    sorted(file_storage._db_files(file_storage._DB_NAME) +
+                           file_storage._db_files(
+                               file_storage._RAW_DB_NAME)))
+
+
+class MemoryStorageTestCase (unittest.TestCase):
+    def test_save_load (self):
+        memory_storage = _crawled()
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                memory_storage.save(file_storage)
+                self.assertEqual(fakeapi.index(file_storage),
+                                 fakeapi.index(memory_storage))
+            with storage.FileStorage(path, read_only=True) as file_storage:
+                loaded_storage = storage.MemoryStorage()
+                loaded_storage.load(file_storage)
+
+        self.assertEqual(fakeapi.index(loaded_storage),
+                         fakeapi.index(memory_storage))
+        self.assertEqual(fakeapi.lookups(loaded_storage),
+                         fakeapi.lookups(memory_storage))
+        self.assertEqual(loaded_storage.raw(('skills',), 10),
+                         memory_storage.raw(('skills',), 10))
+
+
+class SnapshotStorageTestCase (unittest.TestCase):
+    def test_round_trip (self):
+        with tempfile.TemporaryDirectory() as path:
+            snapshot_path = os.path.join(path, 'api.snapshot')
+            with storage.FileStorage(
+                os.path.join(path, 'file')
+            ) as file_storage:
+                crawl.crawl(fakeapi.FakeApi(), file_storage)
+                storage.compile_snapshot(file_storage, snapshot_path)
+                file_lookups = fakeapi.lookups(file_storage)
+                file_result = file_storage.raw(('skills',), 10)
+
+            with storage.SnapshotStorage(snapshot_path) as snapshot_storage:
+                self.assertEqual(snapshot_storage.schema_version(),
+                                 fakeapi.FakeApi.schema_version)
+                self.assertEqual(fakeapi.lookups(snapshot_storage),
+                                 file_lookups)
+                self.assertEqual(snapshot_storage.raw(('skills',), 10),
+                                 file_result)
+                self.assertFalse(snapshot_storage.exists_raw(('skills',), 9))
+                with self.assertRaises(storage.ReadOnlyError):
+                    snapshot_storage.store_raw(('skills',), {'id': 9})
+
+            with storage.FileStorage(
+                os.path.join(path, 'file'), snapshot_path=snapshot_path
+            ) as file_storage:
+                self.assertTrue(file_storage.read_only)
+                self.assertEqual(fakeapi.lookups(file_storage), file_lookups)
+
+    def test_unsupported_storage (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                with self.assertRaises(TypeError):
+                    storage.compile_snapshot(
+                        sqlite_storage, os.path.join(path, 'api.snapshot'))
+
+    def test_memory_storage (self):
+        memory_storage = _crawled()
+        with tempfile.TemporaryDirectory() as path:
+            snapshot_path = os.path.join(path, 'api.snapshot')
+            storage.compile_snapshot(memory_storage, snapshot_path)
+            with storage.SnapshotStorage(snapshot_path) as snapshot_storage:
+                self.assertEqual(fakeapi.index(snapshot_storage),
+                                 fakeapi.index(memory_storage))
+
+
+class ResolvedIdsTestCase (unittest.TestCase):
+    def _check (self, test_storage):
+        test_storage.store_ids('skill', 'shelter', [10])
+        test_storage.store_resolved_ids('skill', 'shelter', [10])
+        self.assertEqual(list(test_storage.resolved_ids('skill', 'shelter')),
+                         [10])
+        # the ID now matches another entity
+        test_storage.store_ids('skill', 'shelter', [40])
+        self.assertIsNone(test_storage.resolved_ids('skill', 'shelter'))
+
+        test_storage.store_resolved_ids('skill', 'shelter', [10, 40])
+        test_storage.remove_entity_ids('skill', 40)
+        self.assertIsNone(test_storage.resolved_ids('skill', 'shelter'))
+
+    def test_memory (self):
+        self._check(storage.MemoryStorage())
+
+    def test_sqlite (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                self._check(sqlite_storage)
+
+    def test_not_unique (self):
+        test_storage = _crawled()
+        self.assertEqual(
+            len(test_storage.resolved_ids('skill', 'sword 1')), 2)
+        with self.assertRaises(storage.NotUniqueError):
+            test_storage.from_id(entity.Skill, 'sword 1')
+
+
+class EntityIdsTestCase (unittest.TestCase):
+    def _check (self, test_storage):
+        test_storage.store_ids('skill', 'Shelter', [10])
+        test_storage.store_ids('skill', 'heal', [10, 31])
+        # API IDs match whatever their type
+        self.assertEqual(test_storage.entity_ids('skill', 10),
+                         {'shelter', 'heal'})
+        self.assertEqual(test_storage.entity_ids('skill', '10'),
+                         {'shelter', 'heal'})
+
+        self.assertEqual(test_storage.remove_entity_ids('skill', '10'),
+                         {'shelter', 'heal'})
+        self.assertEqual(test_storage.entity_ids('skill', 10), set())
+        with self.assertRaises(KeyError):
+            test_storage.all_from_id(entity.Skill, 'shelter')
+        self.assertEqual(test_storage.entity_ids('skill', 31), {'heal'})
+
+    def test_memory (self):
+        self._check(storage.MemoryStorage())
+
+    def test_sqlite (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                self._check(sqlite_storage)
+
+
+class MetaTestCase (unittest.TestCase):
+    def _check (self, test_storage):
+        self.assertIsNone(test_storage.meta('key'))
+        test_storage.store_meta('key', 'value')
+        self.assertEqual(test_storage.meta('key'), 'value')
+        test_storage.store_meta('key', None)
+        self.assertIsNone(test_storage.meta('key'))
+
+        test_storage.store_meta('key', 'value')
+        test_storage.clear()
+        self.assertEqual(test_storage.meta('key'), 'value')
+        test_storage.clear_raw()
+        self.assertIsNone(test_storage.meta('key'))
+
+    def test_memory (self):
+        self._check(storage.MemoryStorage())
+
+    def test_sqlite (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                self._check(sqlite_storage)
+
+
+class StorageStatsTestCase (unittest.TestCase):
+    def test_disabled (self):
+        test_storage = _crawled()
+        self.assertIsNone(test_storage.stats)
+        test_storage.from_id(entity.Skill, 'shelter')
+
+    def test_operations (self):
+        test_storage = _crawled()
+        operations = []
+        test_storage.stats = storage.StorageStats(
+            lambda operation, elapsed: operations.append(operation))
+        test_storage.from_api_id(entity.Skill, 10)
+        with self.assertRaises(KeyError):
+            test_storage.raw(('skills',), 9)
+        with self.assertRaises(storage.NotUniqueError):
+            test_storage.from_id(entity.Skill, 'sword 1')
+
+        stats = test_storage.stats.snapshot()
+        self.assertEqual(stats['operations']['raw']['misses'], 1)
+        # an ambiguous ID isn't a miss
+        self.assertEqual(stats['operations']['from_id']['count'], 1)
+        self.assertEqual(stats['operations']['from_id']['misses'], 0)
+        self.assertGreater(stats['bytes read'], 0)
+        self.assertEqual(stats['decode count'], operations.count('decode'))
+        self.assertIn('from_api_id', operations)
+
+    def test_crawling_shares_stats (self):
+        crawler = crawl.Crawler(fakeapi.FakeApi(), storage.MemoryStorage(),
+                                entity.BUILTIN_TYPES)
+        crawler.storage.stats = storage.StorageStats()
+        self.assertIs(crawler.storage._storage.stats, crawler.storage.stats)
+
+
+class WarmPackStorageTestCase (unittest.TestCase):
+    def test_round_trip (self):
+        crawled_storage = storage.MemoryStorage()
+        with tempfile.TemporaryDirectory() as path:
+            warm_pack_path = os.path.join(path, 'api.pack')
+            crawl.crawl(fakeapi.FakeApi(), crawled_storage,
+                        warm_pack_path=warm_pack_path)
+            with storage.WarmPackStorage(warm_pack_path) as pack_storage:
+                self.assertEqual(pack_storage.schema_version(),
+                                 fakeapi.FakeApi.schema_version)
+                self.assertEqual(fakeapi.lookups(pack_storage),
+                                 fakeapi.lookups(crawled_storage))
+                self.assertEqual(
+                    pack_storage.from_api_id(entity.Skill, 10).api_id, 10)
+                self.assertFalse(pack_storage.exists_raw(('skills',), 10))
+                with self.assertRaises(storage.ReadOnlyError):
+                    pack_storage.store_raw(('skills',), {'id': 9})
+
+            with storage.WarmPackStorage(
+                warm_pack_path, crawled_storage
+            ) as pack_storage:
+                self.assertEqual(pack_storage.raw(('skills',), 10),
+                                 crawled_storage.raw(('skills',), 10))
+
+
+class RebuildIndexTestCase (unittest.TestCase):
+    def test_file (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                crawl.crawl(fakeapi.FakeApi(), file_storage)
+                lookups = fakeapi.lookups(file_storage)
+                with file_storage.rebuild_index():
+                    self.assertEqual(fakeapi.index(file_storage), {})
+                    file_storage.store_ids('skill', 'x', (10,))
+                    # other readers see the previous index
+                    with storage.FileStorage(
+                        path, read_only=True
+                    ) as reader:
+                        self.assertEqual(fakeapi.lookups(reader), lookups)
+                self.assertEqual(
+                    file_storage.from_id(entity.Skill, 'x').api_id, 10)
+                with self.assertRaises(KeyError):
+                    file_storage.from_id(entity.Skill, 'shelter')
+
+    def _check_failed (self, test_storage):
+        crawl.crawl(fakeapi.FakeApi(), test_storage)
+        lookups = fakeapi.lookups(test_storage)
+        with self.assertRaises(ValueError):
+            with test_storage.rebuild_index():
+                test_storage.store_ids('skill', 'x', (10,))
+                raise ValueError()
+        # the previous index is kept
+        self.assertEqual(fakeapi.lookups(test_storage), lookups)
+        with self.assertRaises(KeyError):
+            test_storage.from_id(entity.Skill, 'x')
+
+    def test_failed_file (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.FileStorage(path) as file_storage:
+                self._check_failed(file_storage)
+
+    def test_failed_sqlite (self):
+        with tempfile.TemporaryDirectory() as path:
+            with storage.SqliteStorage(
+                os.path.join(path, 'api.sqlite')
+            ) as sqlite_storage:
+                self._check_failed(sqlite_storage)
+
+
+if __name__ == '__main__':
+    unittest.main()